@@ -0,0 +1,178 @@
+import os
+import time
+import math
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from database import db
+import metrics
+
+# --- Admission Control ---
+# 1) Rate limit แบบ token bucket ต่อ key (ip_hash / session_id) เก็บใน OrderedDict ขนาดจำกัด
+#    (LRU: key ที่เงียบนานสุดถูกไล่ออกก่อน ซึ่งก็คือ bucket ที่เติมเต็มแล้ว -> ไล่ทิ้งได้ไม่เสียอะไร)
+#    ADMISSION_BACKEND=mongo : เช็ค bucket ใน worker ก่อน แล้วนับรวมทุก worker ด้วย fixed window ใน Mongo
+# 2) จำกัด /api/play ที่ทำงานพร้อมกัน (PLAY_MAX_INFLIGHT) ที่เหลือรอคิวได้ไม่เกิน PLAY_MAX_QUEUE
+#    เกินนั้นตอบ 429 พร้อม queue position / retry_after แทนที่จะปล่อยให้ latency พุ่งทุกคน
+
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "local")
+MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", "100000"))
+
+# rule -> (tokens ต่อนาที, burst)
+RULES = {
+    "play": (float(os.getenv("RATE_PLAY_PER_MIN", "12")), int(os.getenv("RATE_PLAY_BURST", "5"))),
+    "chat_session": (float(os.getenv("RATE_CHAT_PER_MIN", "20")), int(os.getenv("RATE_CHAT_BURST", "5"))),
+    "chat_ip": (float(os.getenv("RATE_CHAT_IP_PER_MIN", "40")), int(os.getenv("RATE_CHAT_IP_BURST", "10"))),
+}
+
+PLAY_MAX_INFLIGHT = int(os.getenv("PLAY_MAX_INFLIGHT", "200"))
+PLAY_MAX_QUEUE = int(os.getenv("PLAY_MAX_QUEUE", "1000"))
+PLAY_QUEUE_TIMEOUT = float(os.getenv("PLAY_QUEUE_TIMEOUT", "5"))
+
+class TokenBuckets:
+    """{key: (tokens, last_refill)} แบบ bounded LRU"""
+
+    def __init__(self, per_minute: float, burst: int, max_keys: int = MAX_KEYS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def take(self, key: str, now: float = None):
+        """คืน 0 ถ้าผ่าน, ไม่งั้นคืนจำนวนวินาทีที่ต้องรอ"""
+        now = time.monotonic() if now is None else now
+        tokens, last = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate if self.rate > 0 else 60.0
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+class LocalLimiter:
+    def __init__(self):
+        self._rules = {name: TokenBuckets(rate, burst) for name, (rate, burst) in RULES.items()}
+        self._rejected = {name: 0 for name in RULES}
+
+    def _reject(self, rule: str, wait: float):
+        self._rejected[rule] += 1
+        metrics.inc("admission_rejected_total", rule=rule)
+        return wait
+
+    async def check(self, rule: str, key: str):
+        """0 = ผ่าน, > 0 = วินาทีที่ต้องรอ (ตอบ 429)"""
+        wait = self._rules[rule].take(key)
+        return self._reject(rule, wait) if wait else 0.0
+
+    def stats(self):
+        return {
+            "backend": type(self).__name__,
+            "keys": {name: len(buckets) for name, buckets in self._rules.items()},
+            "rejected": dict(self._rejected),
+        }
+
+class MongoLimiter(LocalLimiter):
+    """นับรวมทุก worker: fixed window (burst ครั้งต่อ burst/rate วินาที) ใน collection rate_limits (TTL)"""
+
+    def __init__(self, database, name: str = "rate_limits"):
+        super().__init__()
+        self._windows = database[name]
+        self._ready = False
+
+    async def _ensure_index(self):
+        if not self._ready:
+            await self._windows.create_index("expires_at", expireAfterSeconds=0)
+            self._ready = True
+
+    async def check(self, rule: str, key: str):
+        wait = await super().check(rule, key)
+        if wait:
+            return wait
+        per_minute, burst = RULES[rule]
+        window = burst * 60.0 / per_minute if per_minute > 0 else 60.0
+        now = time.time()
+        index = math.floor(now / window)
+        window_end = (index + 1) * window
+        try:
+            await self._ensure_index()
+            doc = await self._windows.find_one_and_update(
+                {"_id": f"{rule}:{key}:{index}"},
+                {"$inc": {"count": 1},
+                 "$setOnInsert": {"expires_at": datetime.now() + timedelta(seconds=window_end - now + 5)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except PyMongoError:
+            # Mongo มีปัญหา -> ใช้ bucket ใน worker อย่างเดียว (fail open)
+            return 0.0
+        if doc["count"] > burst:
+            return self._reject(rule, window_end - now)
+        return 0.0
+
+class Saturated(Exception):
+    def __init__(self, position: int, retry_after: float):
+        super().__init__("saturated")
+        self.position = position
+        self.retry_after = retry_after
+
+class ConcurrencyGate:
+    """Semaphore + คิวรอที่จำกัดความยาว; คิวเต็ม/รอนานเกิน -> Saturated"""
+
+    def __init__(self, limit: int, max_queue: int, timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.waiting = 0
+        self.in_flight = 0
+        self.rejected = 0
+        self._sem = None
+
+    def _semaphore(self):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.limit)
+        return self._sem
+
+    async def acquire(self):
+        sem = self._semaphore()
+        if not sem.locked():
+            await sem.acquire()
+            self.in_flight += 1
+            return
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            metrics.inc("admission_rejected_total", rule="play_queue_full")
+            raise Saturated(self.waiting + 1, self.timeout)
+        self.waiting += 1
+        position = self.waiting
+        try:
+            await asyncio.wait_for(sem.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            metrics.inc("admission_rejected_total", rule="play_queue_timeout")
+            raise Saturated(position, self.timeout)
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore().release()
+
+    def stats(self):
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting,
+                "max_queue": self.max_queue, "rejected": self.rejected}
+
+limiter = MongoLimiter(db) if ADMISSION_BACKEND == "mongo" else LocalLimiter()
+play_gate = ConcurrencyGate(PLAY_MAX_INFLIGHT, PLAY_MAX_QUEUE, PLAY_QUEUE_TIMEOUT)
+
+def stats():
+    return {"limiter": limiter.stats(), "play_gate": play_gate.stats(),
+            "rules": {name: {"per_minute": rate, "burst": burst} for name, (rate, burst) in RULES.items()}}
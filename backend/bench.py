@@ -0,0 +1,345 @@
+"""
+Offline benchmark for the gacha backend
+
+Boot main.app ใน process เดียวกัน (httpx ASGITransport, ไม่ต้องเปิด port / network)
+ต่อกับ MongoDB stand-in (FakeCollection ใน memory หรือ mongod จริงผ่าน --mongo-uri)
+และ Gemini ปลอมที่ตั้ง latency / error rate ได้ แล้วยิง workload ผสมแบบงานจริง:
+  play     = ผู้เล่นใหม่ (POST /api/play)
+  replay   = IP เดิมกดซ้ำ (already_played)
+  image    = โหลดรูปที่สุ่มได้ (บางส่วนส่ง If-None-Match -> 304)
+  chat     = ส่งข้อความ + polling /api/chat/history?after=
+  history  = admin เปิดหน้า history (ตาม next_cursor)
+  export   = admin export ndjson
+  stats    = admin dashboard (/api/admin/stats)
+
+Usage:
+    python bench.py --json > bench.json
+    python bench.py --requests 20000 --clients 200 --db-latency-ms 2 --ai-latency-ms 800 --ai-error-rate 0.1
+    python bench.py --mix play=50,replay=20,image=30
+    python bench.py --mongo-uri mongodb://localhost:27017 --write-behind
+
+ผล (--json) = throughput + p50/p95/p99 รวมและแยกตาม endpoint ใช้เทียบ regression ระหว่าง build ได้
+(ใช้ --seed เดิม + args ชุดเดิม ให้ workload ซ้ำกันทุกครั้ง)
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from loadtest import summarize
+
+DEFAULT_MIX = "play=35,replay=15,image=25,chat=20,history=3,stats=1,export=1"
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets")
+
+def parse_mix(spec: str):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    return mix
+
+def configure_env(args):
+    """ต้องเรียกก่อน import main (module อ่าน env ตอน import)"""
+    os.environ.setdefault("ASSETS_DIR", os.path.abspath(ASSETS_DIR))
+    os.environ.setdefault("IMAGE_DIR", os.path.abspath(ASSETS_DIR))
+    os.environ.setdefault("STATIC_DIR", tempfile.mkdtemp(prefix="bench-static-"))
+    os.environ["BLESSING_POOL_MAX_RPM"] = str(args.ai_rpm)
+    os.environ["GEMINI_API_KEY"] = ""
+    os.environ["SELF_PING"] = "0"
+    if args.prizes:
+        os.environ["PRIZES_FILE"] = os.path.abspath(args.prizes)
+    if args.write_behind:
+        os.environ["WRITE_BEHIND"] = "1"
+        os.environ["WRITE_BEHIND_JOURNAL"] = os.path.join(tempfile.mkdtemp(prefix="bench-wb-"), "journal")
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+        os.environ["MONGO_DB_NAME"] = args.mongo_db
+
+def install_fakes(args, rng):
+    """แทนที่ collection ทุกจุดที่ถูก import ไปแล้ว + ใส่ Gemini ปลอมให้ blessing_pool"""
+    import database
+    import main
+    import chat_store
+    import exporter
+    import settings_cache
+    import write_behind
+    import blessing_pool
+    import stats_counters
+    import prize_engine
+    from bench_fakes import FakeCollection, FakeGenAI, Latency
+
+    if not args.mongo_uri:
+        latency = Latency(args.db_latency_ms, rng=rng)
+        fakes = {name: FakeCollection(name, latency) for name in ("players", "settings", "chats", "chat_messages", "event_stats", "prize_stock")}
+        for module in (database, main, chat_store, exporter, settings_cache, stats_counters, prize_engine):
+            for name, fake in fakes.items():
+                if hasattr(module, name):
+                    setattr(module, name, fake)
+        write_behind.COLLECTIONS.update({"players": fakes["players"], "chat_messages": fakes["chat_messages"]})
+
+    blessing_pool.client_ai = FakeGenAI(args.ai_latency_ms, args.ai_error_rate, rng=rng)
+
+async def start_app(args):
+    """รัน lifespan จริงของ main.app แล้วรอจน /api/health พร้อม (mongo init เสร็จ)"""
+    import database
+    import main
+    import settings_cache
+
+    if args.mongo_uri:
+        await database.client_db.drop_database(args.mongo_db)
+    await database.settings.update_one({"key": "system_status"}, {"$set": {"is_active": True}}, upsert=True)
+
+    lifespan = main.app.router.lifespan_context(main.app)
+    await lifespan.__aenter__()
+    while not main.is_ready():
+        await asyncio.sleep(0.05)
+    await settings_cache.refresh_settings()
+    return main.app, lifespan
+
+async def seed_players(count: int, rng: random.Random):
+    """ข้อมูลเก่าสำหรับ history/export (insert ตรง ไม่ผ่าน API)"""
+    import database
+    now = datetime.now()
+    docs = [{
+        "ip_hash": f"seed-{i:08d}",
+        "ip_address": f"172.16.{(i >> 8) & 255}.{i & 255}",
+        "gender": rng.choice(["male", "female"]),
+        "name": f"Seed{i}",
+        "image_file": "seed.png",
+        "blessing": "seeded",
+        "played_at": now - timedelta(seconds=i),
+    } for i in range(count)]
+    for start in range(0, len(docs), 1000):
+        await database.players.insert_many(docs[start:start + 1000], ordered=False)
+
+# --- Scenarios ---
+# แต่ละ scenario คืน (endpoint label, status key)
+
+class State:
+    def __init__(self, rng: random.Random, sessions: int):
+        self.rng = rng
+        self.counter = 0
+        self.played_ips = []
+        self.image_urls = []
+        self.etags = {}
+        # แต่ละห้องมาจาก IP ของตัวเอง (ไม่งั้นทุกห้องชน rate limit chat_ip เดียวกัน)
+        self.sessions = [{"id": f"bench-session-{i}", "after": -1, "ip": f"172.16.{i >> 8 & 255}.{i & 255}"}
+                         for i in range(sessions)]
+        self.history_cursor = None
+
+    def next_ip(self):
+        self.counter += 1
+        i = self.counter
+        return f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+def _status(res):
+    key = str(res.status_code)
+    if res.status_code in (200, 429) and res.headers.get("content-type", "").startswith("application/json"):
+        body = res.json()
+        if isinstance(body, dict) and "status" in body:
+            key = body["status"]
+    return key
+
+async def _play(client, state: State, ip: str):
+    body = {
+        "gender": state.rng.choice(["male", "female"]),
+        "name": f"Bench{state.counter}",
+        "lang": state.rng.choice(["th", "en"]),
+    }
+    res = await client.post("/api/play", json=body, headers={"X-Forwarded-For": ip})
+    if res.status_code == 200:
+        data = res.json().get("data") or {}
+        if data.get("image_url") and len(state.image_urls) < 1000:
+            state.image_urls.append(data["image_url"])
+    return res
+
+async def scenario_play(client, state: State):
+    ip = state.next_ip()
+    res = await _play(client, state, ip)
+    state.played_ips.append(ip)
+    return "POST /api/play", _status(res)
+
+async def scenario_replay(client, state: State):
+    if not state.played_ips:
+        return await scenario_play(client, state)
+    res = await _play(client, state, state.rng.choice(state.played_ips))
+    return "POST /api/play (replay)", _status(res)
+
+async def scenario_image(client, state: State):
+    if not state.image_urls:
+        return await scenario_play(client, state)
+    # เหมือน <img> ในหน้า result (ขอ AVIF/WebP ได้)
+    url = state.rng.choice(state.image_urls) + "&format=auto"
+    headers = {"Accept": "image/avif,image/webp,*/*"}
+    if url in state.etags and state.rng.random() < 0.3:
+        headers["If-None-Match"] = state.etags[url]
+    res = await client.get(url, headers=headers)
+    if res.headers.get("etag"):
+        state.etags[url] = res.headers["etag"]
+    return "GET /api/image", _status(res)
+
+async def scenario_chat(client, state: State):
+    session = state.rng.choice(state.sessions)
+    if session["after"] < 0 or state.rng.random() < 0.2:
+        res = await client.post("/api/chat/send", json={
+            "session_id": session["id"], "message": "bench message", "name": "Bench",
+        }, headers={"X-Forwarded-For": session["ip"]})
+        return "POST /api/chat/send", _status(res)
+    res = await client.get(f"/api/chat/history/{session['id']}", params={"after": session["after"]})
+    if res.status_code == 200:
+        for msg in res.json().get("data", []):
+            session["after"] = max(session["after"], msg["seq"])
+    return "GET /api/chat/history", _status(res)
+
+async def scenario_history(client, state: State, admin_key: str):
+    params = {"limit": 100}
+    if state.history_cursor:
+        params["cursor"] = state.history_cursor
+    res = await client.get("/api/admin/history", params=params, headers={"X-Admin-Key": admin_key})
+    if res.status_code == 200:
+        state.history_cursor = res.json()["pagination"].get("next_cursor")
+    return "GET /api/admin/history", _status(res)
+
+async def scenario_export(client, state: State, admin_key: str):
+    res = await client.get("/api/admin/export", params={"format": "ndjson"}, headers={"X-Admin-Key": admin_key})
+    return "GET /api/admin/export", str(res.status_code)
+
+async def scenario_stats(client, state: State, admin_key: str):
+    res = await client.get("/api/admin/stats", headers={"X-Admin-Key": admin_key})
+    return "GET /api/admin/stats", _status(res)
+
+SCENARIOS = {
+    "play": scenario_play,
+    "replay": scenario_replay,
+    "image": scenario_image,
+    "chat": scenario_chat,
+    "history": scenario_history,
+    "export": scenario_export,
+    "stats": scenario_stats,
+}
+ADMIN_SCENARIOS = {"history", "export", "stats"}
+
+async def run(args):
+    import httpx
+    rng = random.Random(args.seed)
+    configure_env(args)
+    install_fakes(args, rng)
+    import main
+    import blessing_pool
+    import write_behind
+    import prize_engine
+    import admission
+    import played_cache
+
+    app, lifespan = await start_app(args)
+    await seed_players(args.seed_players, rng)
+    if args.warmup > 0:
+        # ให้ blessing pool เติมก่อนเริ่มจับเวลา
+        await asyncio.sleep(args.warmup)
+
+    mix = parse_mix(args.mix)
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    state = State(rng, args.sessions)
+    counter = iter(range(args.requests))
+    results = {}
+    all_latencies = []
+    all_statuses = {}
+
+    async def worker(client):
+        for _ in counter:
+            name = rng.choices(names, weights)[0]
+            extra = (main.ADMIN_SECRET,) if name in ADMIN_SCENARIOS else ()
+            start = time.perf_counter()
+            try:
+                label, key = await SCENARIOS[name](client, state, *extra)
+            except Exception as e:
+                label, key = name, type(e).__name__
+            elapsed = time.perf_counter() - start
+            latencies, statuses = results.setdefault(label, ([], {}))
+            latencies.append(elapsed)
+            statuses[key] = statuses.get(key, 0) + 1
+            all_latencies.append(elapsed)
+            all_statuses[key] = all_statuses.get(key, 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.clients)))
+        elapsed = time.perf_counter() - started
+
+    await lifespan.__aexit__(None, None, None)
+    import metrics
+
+    return {
+        "config": {
+            "requests": args.requests,
+            "clients": args.clients,
+            "mix": mix,
+            "seed": args.seed,
+            "backend": "mongod" if args.mongo_uri else "in-memory",
+            "db_latency_ms": args.db_latency_ms,
+            "ai_latency_ms": args.ai_latency_ms,
+            "ai_error_rate": args.ai_error_rate,
+            "write_behind": args.write_behind,
+            "prizes": args.prizes,
+            "python": sys.version.split()[0],
+        },
+        "startup": metrics.boot_stats(),
+        "overall": summarize(all_latencies, all_statuses, elapsed),
+        "endpoints": {label: summarize(lat, st, elapsed) for label, (lat, st) in sorted(results.items())},
+        "blessing_pool": blessing_pool.pool_stats(),
+        "write_behind": write_behind.stats(),
+        "prizes": prize_engine.engine_stats(),
+        "admission": admission.stats(),
+        "played_cache": played_cache.cache_stats(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark (fake Mongo + fake Gemini)")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--seed-players", type=int, default=5000, help="existing play records for history/export")
+    parser.add_argument("--sessions", type=int, default=200, help="chat rooms to spread chat traffic over")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="per-operation latency of the fake Mongo")
+    parser.add_argument("--ai-latency-ms", type=float, default=1500.0)
+    parser.add_argument("--ai-error-rate", type=float, default=0.05)
+    parser.add_argument("--ai-rpm", type=float, default=600.0, help="blessing pool refill rate limit")
+    parser.add_argument("--warmup", type=float, default=0.0, help="seconds to let the blessing pool fill first")
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument("--prizes", default=None, help="prize weight/stock config (PRIZES_FILE)")
+    parser.add_argument("--mongo-uri", default=None, help="use a real (local) mongod instead of the in-memory fake")
+    parser.add_argument("--mongo-db", default="riser_gacha_bench", help="database dropped and reused with --mongo-uri")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable result")
+    args = parser.parse_args()
+
+    # log ของ app (print) ไป stderr เพื่อให้ stdout เป็น JSON ล้วน
+    with contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout):
+        result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, default=str))
+        return
+    overall = result["overall"]
+    print(f"📊 {overall['requests']} requests ({args.clients} clients, {result['config']['backend']}) "
+          f"in {overall['elapsed_s']}s -> {overall['rps']} req/s")
+    for label, r in result["endpoints"].items():
+        print(f"   {label:<28} x{r['requests']:<6} p50 {r['p50_ms']}ms | p95 {r['p95_ms']}ms | p99 {r['p99_ms']}ms | {r['statuses']}")
+    pool = result["blessing_pool"]
+    print(f"   blessing pool: hit_rate {pool['hit_rate']} | generated {pool['generated']} | ai_errors {pool['ai_errors']}")
+    cache = result["played_cache"]
+    print(f"   played cache: hit_rate {cache['hit_rate']} | entries {cache['entries']} | {cache['bytes']} bytes")
+
+if __name__ == "__main__":
+    main()
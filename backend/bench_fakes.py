@@ -0,0 +1,339 @@
+"""
+In-memory stand-ins สำหรับ bench.py (ไม่ต้องมี mongod / network)
+
+FakeCollection รองรับเฉพาะ subset ของ PyMongo async API ที่ backend ใช้จริง
+(find_one, find_one_and_update, insert_one/many, delete_one, find().sort().skip().limit(),
+create_index แบบ unique) และหน่วงเวลาแต่ละ operation เพื่อจำลอง round trip
+FakeGenAI เลียนแบบ client_ai.aio.models.generate_content พร้อม latency / error rate
+"""
+import asyncio
+import copy
+import random
+from itertools import islice
+from pymongo import ReturnDocument, ReplaceOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from bson import ObjectId
+
+class Latency:
+    """หน่วงเวลา mean_ms +/- jitter (ใช้ Random ที่ seed ได้ ให้ผลซ้ำได้)"""
+
+    def __init__(self, mean_ms: float, jitter: float = 0.3, rng: random.Random = None):
+        self.mean = mean_ms / 1000.0
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+
+    async def wait(self):
+        if self.mean <= 0:
+            return
+        await asyncio.sleep(max(0.0, self.rng.uniform(self.mean * (1 - self.jitter), self.mean * (1 + self.jitter))))
+
+# --- Query matching ---
+
+def _get(doc, field):
+    for part in field.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None
+        doc = doc[part]
+    return doc
+
+def _match_value(value, cond):
+    if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+        for op, arg in cond.items():
+            if op == "$nin" and value is None:
+                continue
+            if op == "$exists":
+                if (value is not None) != bool(arg):
+                    return False
+            elif value is None:
+                return False
+            elif op == "$gt" and not value > arg:
+                return False
+            elif op == "$gte" and not value >= arg:
+                return False
+            elif op == "$lt" and not value < arg:
+                return False
+            elif op == "$lte" and not value <= arg:
+                return False
+            elif op == "$in" and value not in arg:
+                return False
+            elif op == "$nin" and value in arg:
+                return False
+            elif op == "$ne" and value == arg:
+                return False
+        return True
+    return value == cond
+
+def matches(doc, query):
+    for field, cond in query.items():
+        if field == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif field == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        elif not _match_value(_get(doc, field), cond):
+            return False
+    return True
+
+def _parent(doc, field, create=True):
+    """(dict ที่ถือ field สุดท้าย, ชื่อ field) ของ path แบบ "a.b.c" """
+    *path, name = field.split(".")
+    for part in path:
+        if part not in doc:
+            if not create:
+                return None, name
+            doc[part] = {}
+        doc = doc[part]
+    return doc, name
+
+def project(doc, projection):
+    """Shallow copy (document ของ backend เป็น flat dict, caller แก้แค่ top-level)"""
+    if not projection:
+        return dict(doc)
+    include = {k for k, v in projection.items() if v and k != "_id"}
+    if include:
+        out = {k: doc[k] for k in include if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    return {k: v for k, v in doc.items() if projection.get(k, 1)}
+
+# --- Collection ---
+
+class FakeCursor:
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        self._sort = list(key) if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def skip(self, n: int):
+        self._skip = n
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    def _results(self):
+        docs = list(self._collection._docs)
+        for field, direction in reversed(self._sort):
+            docs.sort(key=lambda d: (_get(d, field) is not None, _get(d, field)), reverse=direction < 0)
+        # sort ก่อนแล้ว filter แบบ lazy -> หยุดเมื่อได้ครบ limit (เหมือนเดิน index)
+        found = (d for d in docs if matches(d, self._query))
+        stop = self._skip + self._limit if self._limit else None
+        return [project(d, self._projection) for d in islice(found, self._skip, stop)]
+
+    async def to_list(self, length=None):
+        await self._collection.latency.wait()
+        docs = self._results()
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await self._collection.latency.wait()
+        for doc in self._results():
+            yield doc
+
+class FakeCollection:
+    def __init__(self, name: str, latency: Latency):
+        self.name = name
+        self.latency = latency
+        self._docs = []
+        self._unique = {"_id": {}}  # field -> {value: doc}
+
+    # --- indexes ---
+
+    async def create_index(self, keys, unique: bool = False, **kwargs):
+        if unique and isinstance(keys, str):
+            self._unique.setdefault(keys, {d[keys]: d for d in self._docs if keys in d})
+        return keys if isinstance(keys, str) else "_".join(f"{k}_{v}" for k, v in keys)
+
+    def _check_unique(self, doc):
+        for field, seen in self._unique.items():
+            if field in doc and doc[field] in seen:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {field}_1",
+                                        code=11000)
+
+    def _store(self, doc):
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self._docs.append(doc)
+        for field, seen in self._unique.items():
+            if field in doc:
+                seen[doc[field]] = doc
+
+    def _remove(self, doc):
+        self._docs.remove(doc)
+        for field, seen in self._unique.items():
+            if seen.get(doc.get(field)) is doc:
+                del seen[doc[field]]
+
+    def _first(self, query):
+        for field, seen in self._unique.items():
+            if isinstance(query.get(field), str) and len(query) == 1:
+                return seen.get(query[field])
+        return next((d for d in self._docs if matches(d, query)), None)
+
+    # --- reads ---
+
+    async def find_one(self, query=None, projection=None):
+        await self.latency.wait()
+        doc = self._first(query or {})
+        return project(doc, projection) if doc else None
+
+    def find(self, query=None, projection=None, **kwargs):
+        return FakeCursor(self, query or {}, projection)
+
+    async def estimated_document_count(self):
+        await self.latency.wait()
+        return len(self._docs)
+
+    async def count_documents(self, query):
+        await self.latency.wait()
+        return sum(1 for d in self._docs if matches(d, query))
+
+    async def watch(self, *args, **kwargs):
+        # เหมือน standalone mongod -> settings_cache ตกไปใช้ polling
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+    # --- writes ---
+
+    async def insert_one(self, doc):
+        await self.latency.wait()
+        self._store(doc)
+        return doc["_id"]
+
+    async def insert_many(self, docs, ordered: bool = True):
+        await self.latency.wait()
+        errors = []
+        for i, doc in enumerate(docs):
+            try:
+                self._store(doc)
+            except DuplicateKeyError:
+                errors.append({"index": i, "code": 11000})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+
+    async def delete_one(self, query):
+        await self.latency.wait()
+        doc = self._first(query)
+        if doc:
+            self._remove(doc)
+        return _DeleteResult(1 if doc else 0)
+
+    async def find_one_and_delete(self, query, projection=None):
+        await self.latency.wait()
+        doc = self._first(query)
+        if doc:
+            self._remove(doc)
+        return project(doc, projection) if doc else None
+
+    async def delete_many(self, query):
+        await self.latency.wait()
+        doomed = [d for d in self._docs if matches(d, query)]
+        for doc in doomed:
+            self._remove(doc)
+        return _DeleteResult(len(doomed))
+
+    async def bulk_write(self, requests, ordered: bool = True):
+        """รองรับ UpdateOne / ReplaceOne"""
+        await self.latency.wait()
+        for op in requests:
+            if isinstance(op, ReplaceOne):
+                self._replace_one(op._filter, op._doc, op._upsert)
+            else:
+                self._upsert_one(op._filter, op._doc, op._upsert)
+
+    def _replace_one(self, query, replacement, upsert):
+        doc = self._first(query)
+        if doc is not None:
+            self._remove(doc)
+        elif not upsert:
+            return
+        new = copy.deepcopy(replacement)
+        if doc is not None:
+            new["_id"] = doc["_id"]
+        self._store(new)
+
+    def _upsert_one(self, query, update, upsert):
+        """คืน (before, after) ของ document ที่ถูกแก้"""
+        doc = self._first(query)
+        if doc is None:
+            if not upsert:
+                return None, None
+            doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+            doc.update(copy.deepcopy(update.get("$setOnInsert", {})))
+            self._apply(doc, update)
+            self._store(doc)
+            return None, doc
+        before = copy.deepcopy(doc)
+        self._apply(doc, update)
+        return before, doc
+
+    async def update_one(self, query, update, upsert: bool = False):
+        await self.find_one_and_update(query, update, upsert=upsert)
+
+    async def find_one_and_update(self, query, update, projection=None, upsert: bool = False,
+                                  return_document=ReturnDocument.BEFORE):
+        await self.latency.wait()
+        if isinstance(update, list):
+            raise NotImplementedError("pipeline updates are not supported by FakeCollection")
+        before, doc = self._upsert_one(query, update, upsert)
+        result = doc if return_document == ReturnDocument.AFTER else before
+        return project(result, projection) if result else None
+
+    @staticmethod
+    def _apply(doc, update):
+        for field, value in update.get("$set", {}).items():
+            parent, name = _parent(doc, field)
+            parent[name] = copy.deepcopy(value)
+        for field, value in update.get("$inc", {}).items():
+            parent, name = _parent(doc, field)
+            parent[name] = parent.get(name, 0) + value
+        for field in update.get("$unset", {}):
+            parent, name = _parent(doc, field, create=False)
+            if parent is not None:
+                parent.pop(name, None)
+
+class _DeleteResult:
+    def __init__(self, deleted_count: int):
+        self.deleted_count = deleted_count
+
+# --- Gemini ---
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class _FakeModels:
+    def __init__(self, latency: Latency, error_rate: float, rng: random.Random):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = rng
+        self.calls = 0
+
+    async def generate_content(self, model=None, contents=None, config=None):
+        self.calls += 1
+        await self.latency.wait()
+        if self.rng.random() < self.error_rate:
+            raise RuntimeError("fake Gemini: 503 UNAVAILABLE")
+        return _FakeResponse(f"Hello {{name}}! (bench blessing #{self.calls})\n\n\"Music is the strongest form of magic.\"")
+
+class FakeGenAI:
+    """ใช้แทน genai.Client: client.aio.models.generate_content(...)"""
+
+    def __init__(self, latency_ms: float, error_rate: float, rng: random.Random = None):
+        rng = rng or random.Random()
+        self.models = _FakeModels(Latency(latency_ms, rng=rng), error_rate, rng)
+        self.aio = self
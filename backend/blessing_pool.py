@@ -0,0 +1,191 @@
+import os
+import random
+import asyncio
+from collections import deque
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+# --- Blessing Pool ---
+# สร้างคำอวยพรล่วงหน้าไว้ใน memory แยกตาม (lang, gender)
+# /api/play หยิบจาก pool แบบ O(1) แล้วใส่ชื่อตอนเสิร์ฟ ไม่ต้องรอ Gemini inline
+# background task คอยเติมเมื่อ pool ต่ำกว่า low watermark: เรียก AI พร้อมกันได้ไม่เกิน POOL_MAX_CONCURRENCY
+# และเริ่ม request ใหม่ห่างกันตาม BLESSING_POOL_MAX_RPM (throughput ไม่ถูกจำกัดด้วย latency ของ Gemini)
+# pool หมด (โหลดเกินกว่าที่ AI เติมทัน) -> ใช้ template ล่าสุดซ้ำ (POOL_REUSE_SIZE อัน) ก่อนตกไป backup message
+# template ใส่ชื่อตอนเสิร์ฟอยู่แล้ว ใช้ซ้ำได้โดยข้อความยังเป็นของแต่ละคน
+
+GEMINI_KEY = os.getenv("GEMINI_API_KEY")
+AI_MODEL_NAME = os.getenv("AI_MODEL_NAME", "gemini-flash-latest")
+
+POOL_TARGET = int(os.getenv("BLESSING_POOL_TARGET", "20"))
+POOL_LOW_WATERMARK = int(os.getenv("BLESSING_POOL_LOW", "8"))
+POOL_MAX_RPM = float(os.getenv("BLESSING_POOL_MAX_RPM", "30"))
+POOL_AI_TIMEOUT = float(os.getenv("BLESSING_POOL_AI_TIMEOUT", "15"))
+POOL_ERROR_BACKOFF = float(os.getenv("BLESSING_POOL_ERROR_BACKOFF", "5"))
+POOL_MAX_CONCURRENCY = max(1, int(os.getenv("BLESSING_POOL_CONCURRENCY", "8")))
+POOL_REUSE_SIZE = int(os.getenv("BLESSING_POOL_REUSE", "50"))
+
+NAME_PLACEHOLDER = "{name}"
+LANGS = ("th", "en")
+GENDERS = ("male", "female")
+
+# AI Setup: google.genai import หนัก -> import/สร้าง client ตอน refill_loop เริ่ม (ใน thread) ไม่ใช่ตอน import
+client_ai = None
+
+def _create_client():
+    from google import genai
+    return genai.Client(api_key=GEMINI_KEY)
+
+async def init_client():
+    global client_ai
+    if client_ai is None and GEMINI_KEY:
+        try:
+            client_ai = await asyncio.to_thread(_create_client)
+            print(f"✅ Google GenAI Client Ready (Model: {AI_MODEL_NAME})")
+        except Exception as e:
+            print(f"❌ Gemini Client Error: {e}")
+    return client_ai
+
+_buckets = {(lang, gender): deque() for lang in LANGS for gender in GENDERS}
+_recent = {key: deque(maxlen=max(POOL_REUSE_SIZE, 1)) for key in _buckets}  # template ล่าสุดไว้ใช้ซ้ำ
+_in_flight = {key: 0 for key in _buckets}
+_tasks = set()
+_stats = {"hits": 0, "reused": 0, "misses": 0, "released": 0, "generated": 0, "invalid": 0, "ai_errors": 0}
+
+def _bucket_key(lang: str, gender: str):
+    return ('en' if lang == 'en' else 'th', gender)
+
+def build_prompt(gender: str, lang: str):
+    prompt_th = f"""
+    Role: คุณคือตัวแทนจาก "โปรเจกต์แฟนคลับ (@Jaiidees)" ที่ทำกิจกรรมแจกของที่ระลึกด้วยใจรัก
+    Tone: อบอุ่น, ละมุน, เป็นกันเอง, น่ารัก, ให้เกียรติ แต่ไม่ทางการ
+    Language: ภาษาไทยที่อ่านแล้วยิ้มตาม (ความยาว 3-4 บรรทัด)
+    Input: เพื่อนแฟนคลับชื่อ "{NAME_PLACEHOLDER}" เมนฝั่ง "{gender.upper()}"
+    Task: เขียนข้อความขอบคุณที่มาร่วมสนุกกับโปรเจกต์แฟนคลับ: 1.ทักทาย 2.ความเชื่อมโยงที่รักศิลปินเหมือนกัน 3.อวยพรให้ใจฟูและเดินทางปลอดภัย 4.ปิดท้าย Quote ภาษาอังกฤษสั้นๆ
+    Rule: เขียนชื่อเป็นคำว่า {NAME_PLACEHOLDER} ตรงตัว (ห้ามแปลงหรือแทนค่า)
+    """
+
+    prompt_en = f"""
+    Role: You are a representative from the "Fan Project (@Jaiidees)", created with love by fans for fans.
+    Tone: Warm, soft, friendly, sweet, and not corporate/official.
+    Language: Heartwarming English (Length: 3-4 sentences).
+    Input: Fellow fan named "{NAME_PLACEHOLDER}" supporting the "{gender.upper()}" side.
+    Task: Write a thank you note for joining our fan project gacha. Express joy in sharing the same love for the artist. Wish them joy and safe travels. End with a short English Quote.
+    Rule: Write the fan's name as the literal token {NAME_PLACEHOLDER} (do not replace it).
+    """
+
+    return prompt_en if lang == 'en' else prompt_th
+
+async def generate_template(gender: str, lang: str):
+    from google.genai import types
+    with metrics.stage("ai"):
+        response = await asyncio.wait_for(
+            client_ai.aio.models.generate_content(
+                model=AI_MODEL_NAME,
+                contents=build_prompt(gender, lang),
+                config=types.GenerateContentConfig(temperature=0.8)
+            ),
+            timeout=POOL_AI_TIMEOUT
+        )
+    return response.text.strip()
+
+def personalise(template: str, name: str):
+    return template.replace(NAME_PLACEHOLDER, name)
+
+def acquire(lang: str, gender: str):
+    """Pop a template (O(1)); pool ว่าง -> template ล่าสุดซ้ำ; None ถ้ายังไม่เคยมี -> caller ใช้ backup message
+    คืน (template, popped): popped=True เฉพาะที่หยิบออกจาก pool จริง -> คืนด้วย release() ได้"""
+    key = _bucket_key(lang, gender)
+    bucket = _buckets.get(key)
+    if bucket:
+        _stats["hits"] += 1
+        return bucket.popleft(), True
+    if POOL_REUSE_SIZE > 0 and _recent.get(key):
+        _stats["reused"] += 1
+        return random.choice(_recent[key]), False
+    _stats["misses"] += 1
+    metrics.inc("blessing_fallback_total", lang=_bucket_key(lang, gender)[0])
+    return None, False
+
+def release(lang: str, gender: str, template, popped: bool):
+    """คืน template ที่หยิบไปแต่ไม่ได้ใช้ (เช่น player เล่นไปแล้ว); template ที่ใช้ซ้ำจาก _recent ไม่ถูกคืน"""
+    bucket = _buckets.get(_bucket_key(lang, gender))
+    if not popped or template is None or bucket is None:
+        return
+    bucket.appendleft(template)
+    _stats["released"] += 1
+
+def _add(key, template: str):
+    if NAME_PLACEHOLDER not in template:
+        # AI ไม่ใส่ {name} ตามสั่ง -> เสิร์ฟแล้วจะไม่มีชื่อผู้เล่น ทิ้งไป (รอบหน้าสร้างใหม่)
+        _stats["invalid"] += 1
+        return
+    _buckets[key].append(template)
+    _recent[key].append(template)
+    _stats["generated"] += 1
+
+def pool_stats():
+    served = _stats["hits"] + _stats["reused"] + _stats["misses"] - _stats["released"]
+    return {
+        "enabled": bool(GEMINI_KEY) or client_ai is not None,
+        "client_ready": client_ai is not None,
+        "depth": {f"{lang}_{gender}": len(q) for (lang, gender), q in _buckets.items()},
+        "target": POOL_TARGET,
+        "low_watermark": POOL_LOW_WATERMARK,
+        "in_flight": sum(_in_flight.values()),
+        **_stats,
+        "hit_rate": round((served - _stats["misses"]) / served, 4) if served else None,
+    }
+
+async def _fill(key, slots):
+    lang, gender = key
+    try:
+        template = await generate_template(gender, lang)
+        if template:
+            _add(key, template)
+    except Exception as e:
+        _stats["ai_errors"] += 1
+        metrics.inc("ai_errors_total", error=type(e).__name__)
+        print(f"🔥 Blessing pool AI Error ({lang}/{gender}): {e}")
+        # ถือ slot ไว้ระหว่าง backoff -> error ติดกันหลายครั้งลดจำนวน request ที่ยิงไปเอง
+        await asyncio.sleep(POOL_ERROR_BACKOFF)
+    finally:
+        _in_flight[key] -= 1
+        slots.release()
+
+async def refill_loop():
+    """Background task: เติม bucket ที่ต่ำกว่า low watermark จนถึง target"""
+    if not await init_client():
+        print("ℹ️ Blessing pool disabled (no GEMINI_API_KEY or client error) -> backup messages only")
+        return
+
+    min_interval = 60.0 / POOL_MAX_RPM if POOL_MAX_RPM > 0 else 0.0
+    slots = asyncio.Semaphore(POOL_MAX_CONCURRENCY)
+    refilling = set(_buckets)  # เติมให้เต็มตอนเริ่ม
+    print(f"🎁 Blessing pool started (target {POOL_TARGET}, low {POOL_LOW_WATERMARK}, "
+          f"{POOL_MAX_RPM} rpm, {POOL_MAX_CONCURRENCY} concurrent)")
+
+    def level(key):
+        return len(_buckets[key]) + _in_flight[key]
+
+    while True:
+        for key in _buckets:
+            if level(key) < POOL_LOW_WATERMARK:
+                refilling.add(key)
+            elif level(key) >= POOL_TARGET:
+                refilling.discard(key)
+
+        if not refilling:
+            await asyncio.sleep(1)
+            continue
+
+        await slots.acquire()
+        # เติมถังที่เหลือน้อยที่สุดก่อน (นับที่กำลังสร้างอยู่ด้วย)
+        key = min(refilling, key=level)
+        _in_flight[key] += 1
+        task = asyncio.ensure_future(_fill(key, slots))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+        # เว้นระยะเริ่ม request ตาม RPM
+        await asyncio.sleep(min_interval)
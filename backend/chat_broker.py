@@ -0,0 +1,97 @@
+import os
+import asyncio
+from collections import defaultdict
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+from database import db
+
+# --- Chat Broker ---
+# กระจายข้อความใหม่ไปยัง subscriber (SSE) ตาม session_id
+# CHAT_BROKER=local : ส่งใน process เดียว (uvicorn worker เดียว)
+# CHAT_BROKER=mongo : ผ่าน capped collection + tailable cursor (หลาย worker / หลายเครื่อง)
+
+CHAT_BROKER = os.getenv("CHAT_BROKER", "local")
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("CHAT_SUBSCRIBER_QUEUE", "100"))
+EVENTS_CAPPED_BYTES = int(os.getenv("CHAT_EVENTS_CAPPED_BYTES", str(16 * 1024 * 1024)))
+
+class LocalBroker:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, channel: str):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[channel].add(queue)
+        return queue
+
+    def unsubscribe(self, channel: str, queue):
+        subs = self._subscribers.get(channel)
+        if subs is None:
+            return
+        subs.discard(queue)
+        if not subs:
+            del self._subscribers[channel]
+
+    def deliver(self, channel: str, payload):
+        for queue in self._subscribers.get(channel, ()):
+            try:
+                queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                # subscriber ช้าเกิน -> ข้ามไป, ฝั่ง stream จะเห็น seq กระโดดแล้วดึงส่วนที่ขาดจาก DB เอง
+                pass
+
+    async def publish(self, channel: str, payload):
+        self.deliver(channel, payload)
+
+    async def run(self):
+        return
+
+    def stats(self):
+        return {
+            "backend": type(self).__name__,
+            "channels": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+        }
+
+class MongoBroker(LocalBroker):
+    """Publish ลง capped collection, ทุก worker tail แล้ว deliver ให้ subscriber ของตัวเอง"""
+
+    def __init__(self, database, name: str = "chat_events"):
+        super().__init__()
+        self._db = database
+        self._name = name
+        self._events = database[name]
+
+    async def publish(self, channel: str, payload):
+        await self._events.insert_one({"channel": channel, "payload": payload})
+
+    async def _ensure_collection(self):
+        try:
+            await self._db.create_collection(self._name, capped=True, size=EVENTS_CAPPED_BYTES)
+        except CollectionInvalid:
+            pass
+
+    async def run(self):
+        """Background task: tail capped collection ตลอดอายุ process"""
+        started = False
+        last_id = None
+
+        while True:
+            try:
+                if not started:
+                    # task เริ่มก่อน Mongo พร้อม (lifespan) -> ลองใหม่ใน loop จนต่อได้
+                    await self._ensure_collection()
+                    last = await self._events.find_one({}, sort=[("$natural", -1)])
+                    last_id = last["_id"] if last else None
+                    started = True
+                    print("📡 Chat broker: tailing Mongo capped collection")
+                query = {"_id": {"$gt": last_id}} if last_id else {}
+                cursor = self._events.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                async for event in cursor:
+                    last_id = event["_id"]
+                    self.deliver(event["channel"], event["payload"])
+            except PyMongoError as e:
+                print(f"⚠️ Chat broker tail error: {e}")
+            # cursor ตาย (collection ว่าง/เชื่อมต่อหลุด) -> รอแล้วเริ่มใหม่
+            await asyncio.sleep(1)
+
+broker = MongoBroker(db) if CHAT_BROKER == "mongo" else LocalBroker()
@@ -0,0 +1,148 @@
+import os
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from database import chats, chat_messages, encode_keyset_cursor, keyset_query
+from chat_broker import broker
+import write_behind
+
+# --- Chat Storage ---
+# ห้องแชท (chats) เก็บแค่ข้อมูลสรุป: last_message, unread_count, message_count, last_updated
+# ข้อความแต่ละอันเป็น document แยกใน chat_messages (session_id, seq, timestamp)
+# seq = ลำดับข้อความในห้อง ได้จาก $inc message_count (ใช้เป็น cursor ของ stream/polling)
+# WRITE_BEHIND=1 buffer แค่ insert ลง chat_messages; find_one_and_update ของห้อง (seq / last_message)
+# ยังเป็น synchronous เสมอ เพราะ seq ต้องเรียงและไม่ซ้ำข้าม worker
+
+# ข้อความที่ seq ขาดช่วงเกินเวลานี้ถือว่าหายถาวร (insert ล้มเหลว) ไม่ต้องรอแล้ว
+GAP_GRACE = timedelta(seconds=5)
+MESSAGES_PAGE_MAX = 500
+# ห้องหนึ่งรับข้อความจาก user ได้ไม่เกินนี้ (กันห้องโตไม่จำกัด), นับแยกใน user_message_count -> ข้อความ admin ไม่นับ
+ROOM_MAX_MESSAGES = int(os.getenv("CHAT_ROOM_MAX_MESSAGES", "500"))
+MESSAGE_FIELDS = {"_id": 0, "seq": 1, "sender": 1, "text": 1, "timestamp": 1}
+ROOM_FIELDS = {"messages": 0}
+
+_migrated = False  # True เมื่อ migrate_embedded_messages เสร็จแล้ว (ทุก worker รู้ผ่าน init_db)
+
+async def append_message(session_id: str, sender: str, text: str, name: str = None):
+    """อัปเดตห้อง + insert ข้อความ แล้ว publish ให้ subscriber; คืน event หรือ None ถ้าไม่มีห้อง/ห้องเต็ม"""
+    if not _migrated:
+        # startup migration ยังไม่จบ: ห้องเก่าต้องย้ายก่อน ไม่งั้น seq จาก $inc ชนกับข้อความเดิม
+        legacy = await chats.find_one({"session_id": session_id, "messages": {"$exists": True}})
+        if legacy:
+            await _migrate_room(legacy)
+
+    now = datetime.now()
+    query = {"session_id": session_id}
+    if sender == "user":
+        # ห้องเก่าที่ยังไม่มี user_message_count ถือว่ายังไม่เต็ม
+        query["$or"] = [{"user_message_count": {"$lt": ROOM_MAX_MESSAGES}},
+                        {"user_message_count": {"$exists": False}}]
+        update = {
+            "$inc": {"message_count": 1, "user_message_count": 1, "unread_count": 1},
+            "$set": {"last_message": text, "last_updated": now, "is_read": False, "name": name},
+            "$setOnInsert": {"created_at": now},
+        }
+        upsert = True
+    else:
+        update = {
+            "$inc": {"message_count": 1},
+            "$set": {"last_message": text, "is_read": True, "unread_count": 0},
+        }
+        upsert = False
+
+    try:
+        room = await chats.find_one_and_update(query, update, projection={"_id": 0, "message_count": 1},
+                                               upsert=upsert, return_document=ReturnDocument.AFTER)
+    except DuplicateKeyError:
+        # ห้องถูกสร้างพร้อมกันจากอีก request (หรือห้องเต็ม) -> อัปเดตซ้ำแบบไม่ upsert
+        room = await chats.find_one_and_update(query, update, projection={"_id": 0, "message_count": 1},
+                                               return_document=ReturnDocument.AFTER)
+    if not room:
+        return None
+
+    event = {"seq": room["message_count"] - 1, "sender": sender, "text": text, "timestamp": now}
+    if write_behind.ENABLED:
+        await write_behind.enqueue("chat_messages", {"session_id": session_id, **event})
+    else:
+        await chat_messages.insert_one({"session_id": session_id, **event})
+    await broker.publish(session_id, event)
+    return event
+
+def contiguous(messages, after: int):
+    """ตัดที่ seq แรกที่ขาดช่วง (ข้อความก่อนหน้ายัง insert ไม่เสร็จ) เพื่อไม่ให้ cursor ข้ามข้อความ"""
+    result = []
+    expected = after + 1
+    for m in messages:
+        if m["seq"] != expected and datetime.now() - m["timestamp"] < GAP_GRACE:
+            break
+        result.append(m)
+        expected = m["seq"] + 1
+    return result
+
+async def load_messages(session_id: str, after: int = -1, limit: int = MESSAGES_PAGE_MAX):
+    """ข้อความที่ seq > after เรียงตามเวลา"""
+    cursor = chat_messages.find(
+        {"session_id": session_id, "seq": {"$gt": after}}, MESSAGE_FIELDS
+    ).sort("seq", 1).limit(min(limit, MESSAGES_PAGE_MAX))
+    return contiguous(await cursor.to_list(length=None), after)
+
+async def room_exists(session_id: str):
+    return await chats.find_one({"session_id": session_id}, {"_id": 1}) is not None
+
+async def list_rooms(limit: int = 50, cursor: str = None):
+    """ห้องเรียงตาม last_updated ล่าสุด, keyset pagination (ไม่มีประวัติข้อความ)"""
+    query = keyset_query("last_updated", cursor) if cursor else {}
+    rooms = await chats.find(query, ROOM_FIELDS).sort([("last_updated", -1), ("_id", -1)]).limit(limit).to_list(length=None)
+    next_cursor = encode_keyset_cursor(rooms[-1]["last_updated"], rooms[-1]["_id"]) if len(rooms) == limit else None
+    data = [{
+        "session_id": r["session_id"],
+        "name": r.get("name", "Fan"),
+        "last_message": r.get("last_message", ""),
+        "last_updated": r.get("last_updated"),
+        "is_read": r.get("is_read", True),
+        "unread_count": r.get("unread_count", 0),
+        "message_count": r.get("message_count", 0),
+    } for r in rooms]
+    return data, next_cursor
+
+async def migrate_embedded_messages():
+    """ย้าย messages array เดิมใน chats ไปที่ chat_messages (idempotent, เรียกตอน startup)
+    error ส่งต่อให้ init_db -> ไม่เขียน schema_version แล้ว init ใหม่รอบหน้า"""
+    migrated = 0
+    async for room in chats.find({"messages": {"$exists": True}}):
+        await _migrate_room(room)
+        migrated += 1
+    if migrated:
+        print(f"💬 Migrated {migrated} chat rooms to chat_messages")
+
+async def _migrate_room(room):
+    messages = room.get("messages") or []
+    docs = [{"session_id": room["session_id"], "seq": i, **m} for i, m in enumerate(messages)]
+    if docs:
+        try:
+            await chat_messages.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+    unread = 0
+    if not room.get("is_read", True):
+        for m in reversed(messages):
+            if m.get("sender") != "user":
+                break
+            unread += 1
+
+    # เงื่อนไข messages $exists -> startup กับ append_message ย้ายห้องเดียวกันพร้อมกันได้ ตั้งค่าครั้งเดียว
+    await chats.update_one({"_id": room["_id"], "messages": {"$exists": True}}, {
+        "$set": {
+            "message_count": len(messages),
+            "last_message": messages[-1]["text"] if messages else "",
+            "unread_count": unread,
+        },
+        "$unset": {"messages": ""},
+    })
+
+def mark_migrated():
+    """เรียกเมื่อ init_db เสร็จ (migration ของ leader ผ่านแล้ว) -> append_message ไม่ต้องเช็คห้องเก่าอีก"""
+    global _migrated
+    _migrated = True
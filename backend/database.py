@@ -0,0 +1,142 @@
+import os
+import socket
+import asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import AsyncMongoClient
+from pymongo.write_concern import WriteConcern
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+from metrics import MongoCommandMetrics
+
+load_dotenv()
+
+# --- Async MongoDB Data Access Layer ---
+# ทุก route ใช้ collection จากไฟล์นี้ (non-blocking) แทน MongoClient แบบ sync
+# สร้าง client ตอน import ไม่มี I/O (connect แบบ lazy), งานที่คุย DB จริงอยู่ใน init_db()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "riser_gacha")
+
+# Pool & Timeout Tuning (ปรับผ่าน env ได้ตามขนาดเครื่อง)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "3000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000"))
+
+# Write Concern (w=1 พอสำหรับงาน event, เปลี่ยนเป็น "majority" ได้ถ้าใช้ replica set)
+MONGO_WRITE_W = os.getenv("MONGO_WRITE_W", "1")
+MONGO_WRITE_TIMEOUT_MS = int(os.getenv("MONGO_WRITE_TIMEOUT_MS", "3000"))
+
+write_concern = WriteConcern(
+    w=int(MONGO_WRITE_W) if MONGO_WRITE_W.isdigit() else MONGO_WRITE_W,
+    wtimeout=MONGO_WRITE_TIMEOUT_MS,
+)
+
+client_db = AsyncMongoClient(
+    MONGO_URI,
+    appname="riser-gacha",
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    retryWrites=True,
+    retryReads=True,
+    event_listeners=[MongoCommandMetrics()],
+)
+db = client_db.get_database(MONGO_DB_NAME, write_concern=write_concern)
+players = db['players']
+settings = db['settings']
+chats = db['chats']
+chat_messages = db['chat_messages']
+event_stats = db['event_stats']
+prize_stock = db['prize_stock']
+
+# --- Schema Init (leader only) ---
+# index/seed ทำครั้งเดียวต่อ SCHEMA_VERSION: worker แรกที่ได้ lock (settings _id=init_lock) เป็นคนทำ
+# worker อื่นรอจน marker schema_version ขึ้น แล้วข้ามไปเลย (ไม่ต้อง create_index ซ้ำทุกครั้งที่ boot)
+# เพิ่ม index ใหม่ -> bump SCHEMA_VERSION
+
+SCHEMA_VERSION = 2
+INIT_LOCK_TTL = int(os.getenv("INIT_LOCK_TTL", "60"))
+
+async def _create_schema():
+    await players.create_index("ip_hash", unique=True)
+    await players.create_index([("played_at", -1), ("_id", -1)])
+    await chats.create_index("session_id", unique=True)
+    await chats.create_index([("last_updated", -1), ("_id", -1)])
+    await chat_messages.create_index([("session_id", 1), ("seq", 1)], unique=True)
+    await chat_messages.create_index([("session_id", 1), ("timestamp", 1)])
+    await event_stats.create_index([("kind", 1), ("bucket", -1)])
+
+    if not await settings.find_one({"key": "system_status"}):
+        await settings.insert_one({"key": "system_status", "is_active": False})
+        print("🔒 System initialized as CLOSED")
+
+async def _schema_ready():
+    marker = await settings.find_one({"_id": "schema_version"})
+    return bool(marker) and marker.get("version", 0) >= SCHEMA_VERSION
+
+async def _acquire_init_lock(owner: str):
+    now = datetime.now()
+    lock = {"owner": owner, "expires_at": now + timedelta(seconds=INIT_LOCK_TTL)}
+    try:
+        await settings.insert_one({"_id": "init_lock", **lock})
+        return True
+    except DuplicateKeyError:
+        # lock ค้างจาก worker ที่ตายไปแล้ว -> ยึดต่อเมื่อหมดอายุ
+        taken = await settings.find_one_and_update(
+            {"_id": "init_lock", "expires_at": {"$lt": now}}, {"$set": lock})
+        return taken is not None
+
+async def init_db(setup_steps=()):
+    """Create indexes & seed settings ครั้งเดียว (leader), คืน True เมื่อ schema พร้อม"""
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    try:
+        while not await _schema_ready():
+            if await _acquire_init_lock(owner):
+                try:
+                    await _create_schema()
+                    for step in setup_steps:
+                        await step()
+                    await settings.update_one({"_id": "schema_version"},
+                                              {"$set": {"version": SCHEMA_VERSION, "by": owner, "at": datetime.now()}},
+                                              upsert=True)
+                    print(f"🧱 Schema v{SCHEMA_VERSION} initialized by {owner}")
+                finally:
+                    await settings.delete_one({"_id": "init_lock", "owner": owner})
+            else:
+                # worker อื่นกำลังสร้าง index อยู่
+                await asyncio.sleep(0.5)
+
+        print(f"✅ MongoDB Connected (pool {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE}, w={MONGO_WRITE_W})")
+        return True
+    except Exception as e:
+        print(f"❌ MongoDB Error: {e}")
+        return False
+
+# --- Keyset Cursor Helpers ---
+# cursor = "<datetime iso>|<ObjectId>" ใช้กับ sort (datetime desc, _id desc)
+
+def encode_keyset_cursor(ts: datetime, oid):
+    return f"{ts.isoformat()}|{oid}"
+
+def decode_keyset_cursor(cursor: str):
+    ts, _, oid = cursor.partition("|")
+    return datetime.fromisoformat(ts), ObjectId(oid)
+
+def keyset_query(field: str, cursor: str):
+    ts, oid = decode_keyset_cursor(cursor)
+    return {"$or": [
+        {field: {"$lt": ts}},
+        {field: ts, "_id": {"$lt": oid}},
+    ]}
+
+async def close_db():
+    await client_db.close()
@@ -0,0 +1,95 @@
+import io
+import os
+import csv
+import json
+import zlib
+from datetime import datetime
+from fastapi.encoders import jsonable_encoder
+from database import players
+
+# --- Streaming Export ---
+# อ่าน players ทีละ batch จาก server-side cursor แล้ว stream ออกไปเลย
+# memory คงที่ไม่ว่าจะมีผู้เล่นกี่คน (ไม่ list() ทั้ง collection)
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+EXPORT_FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+CSV_COLUMNS = [
+    ("Timestamp", "played_at"),
+    ("Name", "name"),
+    ("Gender", "gender"),
+    ("IP Address", "ip_address"),
+    ("IP Hash", "ip_hash"),
+    ("Blessing", "blessing"),
+    ("Image File", "image_file"),
+]
+
+def build_query(since: datetime = None, until: datetime = None):
+    played_at = {}
+    if since:
+        played_at["$gte"] = since
+    if until:
+        played_at["$lt"] = until
+    return {"played_at": played_at} if played_at else {}
+
+async def iter_batches(query: dict):
+    cursor = players.find(query, {"_id": 0}, batch_size=EXPORT_BATCH_SIZE).sort("played_at", -1)
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _dumps(doc):
+    return json.dumps(jsonable_encoder(doc), ensure_ascii=False)
+
+async def stream_json(query: dict):
+    """{"status": "success", "data": [...]} แบบเดิม แต่ stream ทีละ batch"""
+    yield '{"status": "success", "data": ['
+    first = True
+    async for batch in iter_batches(query):
+        chunk = ",".join(_dumps(doc) for doc in batch)
+        yield chunk if first else "," + chunk
+        first = False
+    yield "]}"
+
+async def stream_ndjson(query: dict):
+    async for batch in iter_batches(query):
+        yield "".join(_dumps(doc) + "\n" for doc in batch)
+
+async def stream_csv(query: dict):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM ให้ Excel อ่านภาษาไทยถูก
+    buffer.write("\ufeff")
+    writer.writerow([header for header, _ in CSV_COLUMNS])
+    async for batch in iter_batches(query):
+        for doc in batch:
+            writer.writerow([
+                doc.get(field).isoformat() if isinstance(doc.get(field), datetime) else doc.get(field, "")
+                for _, field in CSV_COLUMNS
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+async def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_stream(fmt: str, query: dict, gzip: bool = False):
+    streams = {"json": stream_json, "ndjson": stream_ndjson, "csv": stream_csv}
+    chunks = streams[fmt](query)
+    return gzip_stream(chunks) if gzip else chunks
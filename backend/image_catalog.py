@@ -0,0 +1,130 @@
+import os
+import asyncio
+import mimetypes
+from collections import namedtuple
+from static_delivery import file_etag, make_entry, parse_accept
+
+# --- Image Catalogue ---
+# สแกนโฟลเดอร์รูปครั้งเดียวตอน startup แล้วเก็บเป็น tuple (immutable) ต่อ gender
+# การสุ่มรูปและเสิร์ฟรูปเป็น lookup ใน memory ล้วนๆ, reload ได้จาก admin หรือเมื่อโฟลเดอร์เปลี่ยน
+
+IMAGE_DIR = os.getenv("IMAGE_DIR", "/app/processed_images")
+ASSETS_DIR = os.getenv("ASSETS_DIR", "/app/assets")
+GENDERS = ("male", "female")
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
+CATALOG_POLL_SECONDS = float(os.getenv("IMAGE_CATALOG_POLL", "30"))
+
+# Variants ที่ prepare_images.py สร้างไว้ใน <gender>/_variants/<stem>.<suffix>
+VARIANTS_DIRNAME = "_variants"
+VARIANT_SUFFIXES = {"avif": "image/avif", "webp": "image/webp", "960w.webp": "960w", "thumb.webp": "thumb"}
+# ลำดับ format ที่เลือกเมื่อ browser รองรับ (เล็กสุดก่อน)
+NEGOTIATED_FORMATS = ("image/avif", "image/webp")
+
+# field ชุดเดียวกับ StaticEntry เพื่อส่งต่อให้ static_delivery.serve_entry ได้ตรงๆ
+ImageEntry = namedtuple("ImageEntry", ["gender", "filename", "path", "size", "mtime", "etag", "content_type", "variants"])
+
+_catalog = {"entries": {}, "by_name": {}, "alternates": {}, "signature": None}
+
+def _resolve_dir(gender: str):
+    target_dir = os.path.join(IMAGE_DIR, gender)
+    if os.path.isdir(target_dir):
+        return target_dir
+    fallback = os.path.join(ASSETS_DIR, gender)
+    if os.path.isdir(fallback):
+        return fallback
+    return None
+
+def _load_alternates(target_dir: str, filename: str):
+    stem = os.path.splitext(filename)[0]
+    found = {}
+    for suffix, key in VARIANT_SUFFIXES.items():
+        path = os.path.join(target_dir, VARIANTS_DIRNAME, f"{stem}.{suffix}")
+        if os.path.isfile(path):
+            found[key] = make_entry(path)
+    return found
+
+def _dir_signature():
+    sig = []
+    for gender in GENDERS:
+        target_dir = _resolve_dir(gender)
+        sig.append((target_dir, os.stat(target_dir).st_mtime_ns if target_dir else None))
+    return tuple(sig)
+
+def load_catalog():
+    """Scan IMAGE_DIR (fallback ASSETS_DIR) แล้วสลับ catalogue ใหม่แบบ atomic"""
+    entries = {}
+    alternates = {}
+    for gender in GENDERS:
+        target_dir = _resolve_dir(gender)
+        items = []
+        if target_dir:
+            for filename in sorted(os.listdir(target_dir)):
+                if not filename.lower().endswith(IMAGE_EXTS):
+                    continue
+                path = os.path.join(target_dir, filename)
+                st = os.stat(path)
+                content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                items.append(ImageEntry(gender, filename, path, st.st_size, st.st_mtime, file_etag(path), content_type, {}))
+                found = _load_alternates(target_dir, filename)
+                if found:
+                    alternates[(gender, filename)] = found
+        entries[gender] = tuple(items)
+
+    _catalog["entries"] = entries
+    _catalog["by_name"] = {(e.gender, e.filename): e for items in entries.values() for e in items}
+    _catalog["alternates"] = alternates
+    _catalog["signature"] = _dir_signature()
+    print("🖼️ Image catalogue loaded: " + ", ".join(f"{g}={len(entries[g])}" for g in GENDERS))
+    return catalog_stats()
+
+def catalog_stats():
+    return {gender: len(items) for gender, items in _catalog["entries"].items()}
+
+def is_valid_gender(gender: str):
+    return gender in GENDERS
+
+def entries(gender: str):
+    """tuple ของรูปใน gender นี้ (object ใหม่ทุกครั้งที่ reload -> ใช้เช็คว่า catalogue เปลี่ยนได้)"""
+    return _catalog["entries"].get(gender, ())
+
+def lookup(gender: str, filename: str):
+    return _catalog["by_name"].get((gender, filename))
+
+def _quality(prefs: dict, content_type: str):
+    major = content_type.split("/")[0]
+    for key in (content_type, f"{major}/*", "*/*"):
+        if key in prefs:
+            return prefs[key]
+    return 0.0
+
+def lookup_variant(gender: str, filename: str, accept: str = "", size: str = None, negotiate: bool = False):
+    """เลือกไฟล์ที่เล็กที่สุดที่ client รองรับ; คืน (entry, negotiated)
+    negotiate=False (ค่าเริ่มต้น) -> ไฟล์ต้นฉบับเสมอ (เช่นปุ่ม download ที่ชื่อไฟล์เป็น .png)"""
+    entry = lookup(gender, filename)
+    alternates = _catalog["alternates"].get((gender, filename))
+    if not entry or not alternates:
+        return entry, False
+    if size and size in alternates:
+        return alternates[size], False
+    if not negotiate:
+        return entry, False
+    prefs = parse_accept(accept)
+    original_q = _quality(prefs, entry.content_type)
+    best, best_q = entry, 0.0
+    for content_type in NEGOTIATED_FORMATS:
+        # ต้องระบุ type ตรงๆ (*/* ไม่ได้แปลว่าถอด AVIF ได้) และไม่ต่ำกว่าต้นฉบับ
+        q = prefs.get(content_type, 0.0)
+        if content_type in alternates and q > best_q and q >= original_q:
+            best, best_q = alternates[content_type], q
+    return best, True
+
+async def watch_catalog():
+    """Background task: reload เมื่อ mtime ของโฟลเดอร์รูปเปลี่ยน"""
+    while True:
+        await asyncio.sleep(CATALOG_POLL_SECONDS)
+        try:
+            if _dir_signature() != _catalog["signature"]:
+                print("🔄 Image directory changed -> reloading catalogue")
+                await asyncio.to_thread(load_catalog)
+        except OSError as e:
+            print(f"⚠️ Image catalogue watch failed: {e}")
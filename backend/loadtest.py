@@ -0,0 +1,96 @@
+"""
+Load test for /api/play
+
+วัด latency (p50/p95/p99) ของ /api/play ภายใต้ client พร้อมกันหลายร้อยคน
+แต่ละ request ใช้ X-Forwarded-For คนละค่า เพื่อจำลองแฟนคลับคนละเครื่อง
+
+Usage:
+    python loadtest.py --url http://127.0.0.1:8000 --clients 300 --requests 3000
+    python loadtest.py --json > after.json
+
+เปรียบเทียบ before/after: รันกับ build เก่าและ build ใหม่ด้วย args ชุดเดียวกัน
+(ต้องเปิดระบบผ่าน /api/admin/toggle_system ก่อน ไม่งั้นจะได้ status "closed")
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import httpx
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+def summarize(latencies, statuses, elapsed):
+    return {
+        "requests": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        "statuses": statuses,
+    }
+
+async def run(url: str, clients: int, total: int, timeout: float):
+    latencies = []
+    statuses = {}
+    counter = iter(range(total))
+    run_id = random.randint(0, 255)
+
+    async def worker(client: httpx.AsyncClient):
+        for i in counter:
+            fake_ip = f"10.{run_id}.{(i >> 8) & 255}.{i & 255}"
+            body = {
+                "gender": random.choice(["male", "female"]),
+                "name": f"LoadTest{i}",
+                "lang": random.choice(["th", "en"]),
+            }
+            start = time.perf_counter()
+            try:
+                res = await client.post(
+                    f"{url}/api/play",
+                    json=body,
+                    headers={"X-Forwarded-For": fake_ip},
+                )
+                key = str(res.status_code)
+                if res.status_code == 200:
+                    key = res.json().get("status", key)
+            except Exception as e:
+                key = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[key] = statuses.get(key, 0) + 1
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    return summarize(latencies, statuses, elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/play")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable result")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.url, args.clients, args.requests, args.timeout))
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"📊 /api/play x{result['requests']} ({args.clients} clients) in {result['elapsed_s']}s -> {result['rps']} req/s")
+    print(f"   p50 {result['p50_ms']}ms | p95 {result['p95_ms']}ms | p99 {result['p99_ms']}ms | max {result['max_ms']}ms")
+    print(f"   statuses: {result['statuses']}")
+
+if __name__ == "__main__":
+    main()
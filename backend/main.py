@@ -1,74 +1,53 @@
+import time
+BOOT_STARTED = time.perf_counter()  # วัด time-to-first-request ตั้งแต่เริ่ม import
+
 import os
 import random
 import hashlib
+import json
 import asyncio
 import httpx
+from contextlib import asynccontextmanager
 from math import ceil
 from datetime import datetime
 from bson import ObjectId
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from bson.errors import InvalidId
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
-from google import genai
-from google.genai import types
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from dotenv import load_dotenv
+from database import players, init_db, close_db, encode_keyset_cursor, keyset_query
+import blessing_pool
+import image_catalog
+import static_delivery
+import chat_store
+import exporter
+import write_behind
+import stats_counters
+import prize_engine
+import admission
+import played_cache
+import metrics
+from chat_broker import broker
+from settings_cache import is_system_active, toggle_system_status, settings_sync_loop
 
 load_dotenv()
 
 # --- 1. Configuration & Setup ---
 
-app = FastAPI()
-
 # Config Variables
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-GEMINI_KEY = os.getenv("GEMINI_API_KEY")
 ADMIN_SECRET = os.getenv("ADMIN_SECRET", "my_super_secret")
 SELF_URL = os.getenv("RENDER_EXTERNAL_URL", "http://127.0.0.1:8000")
-AI_MODEL_NAME = os.getenv("AI_MODEL_NAME", "gemini-flash-latest")
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "0") == "1"
+STARTUP_STEP_TIMEOUT = float(os.getenv("STARTUP_STEP_TIMEOUT", "10"))
+DB_INIT_RETRY_SECONDS = float(os.getenv("DB_INIT_RETRY_SECONDS", "5"))
+SELF_PING = os.getenv("SELF_PING", "1") == "1"
 
-# Middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Database Setup
-try:
-    client_db = MongoClient(MONGO_URI)
-    db = client_db['riser_gacha']
-    players = db['players']
-    settings = db['settings']
-    chats = db['chats'] # ✅ Collection ใหม่สำหรับเก็บห้องแชท
-    
-    # Create Indexes
-    players.create_index("ip_hash", unique=True)
-    chats.create_index("session_id", unique=True)
-    
-    # Initialize Settings
-    if not settings.find_one({"key": "system_status"}):
-        settings.insert_one({"key": "system_status", "is_active": False})
-        print("🔒 System initialized as CLOSED")
-    
-    print("✅ MongoDB Connected")
-except Exception as e:
-    print(f"❌ MongoDB Error: {e}")
-
-# AI Setup
-client_ai = None
-if GEMINI_KEY:
-    try:
-        client_ai = genai.Client(api_key=GEMINI_KEY)
-        print(f"✅ Google GenAI Client Ready (Model: {AI_MODEL_NAME})")
-    except Exception as e:
-        print(f"❌ Gemini Client Error: {e}")
+metrics.mark_boot("started", BOOT_STARTED)
 
-# Directories
-IMAGE_DIR = "/app/processed_images"
-STATIC_DIR = "/app/static"
 
 # --- Backup Messages (Fallback) ---
 BACKUP_MESSAGES_TH = [
@@ -89,12 +68,15 @@ BACKUP_MESSAGES_EN = [
 
 # --- 2. Background Tasks ---
 
-@app.get("/api/health")
-async def health_check():
-    return {"status": "alive", "timestamp": datetime.now()}
+_readiness = {"catalog": False, "static": False, "mongo": False}
+
+def is_ready():
+    return all(_readiness.values())
 
 async def keep_alive_ping():
     """Ping own server every 5 mins to prevent sleeping"""
+    if not SELF_PING:
+        return
     await asyncio.sleep(10)
     print(f"🚀 Self-Ping system started. URL: {SELF_URL}/api/health")
     async with httpx.AsyncClient() as client:
@@ -106,68 +88,158 @@ async def keep_alive_ping():
                 print(f"⚠️ Self-Ping failed: {e}")
             await asyncio.sleep(300)
 
-@app.on_event("startup")
-async def startup_event():
+async def init_database():
+    """Background: index/seed/migration (leader เดียว) จำกัดเวลาต่อรอบ, ลองใหม่จนสำเร็จ"""
+    while True:
+        try:
+            if await asyncio.wait_for(init_db([chat_store.migrate_embedded_messages]), STARTUP_STEP_TIMEOUT):
+                chat_store.mark_migrated()
+                await asyncio.wait_for(prize_engine.seed_stock(), STARTUP_STEP_TIMEOUT)
+                _readiness["mongo"] = True
+                return
+        except asyncio.TimeoutError:
+            print(f"⏱️ MongoDB init timed out after {STARTUP_STEP_TIMEOUT}s")
+        except PyMongoError as e:
+            print(f"❌ Prize stock seed failed: {e}")
+        await asyncio.sleep(DB_INIT_RETRY_SECONDS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # สิ่งที่ต้องมีก่อนรับ request: catalogue รูป, static index, คิว write-behind ที่ค้าง
+    await asyncio.to_thread(image_catalog.load_catalog)
+    prize_engine.load_config()
+    _readiness["catalog"] = True
+    await asyncio.to_thread(static_delivery.load_static_index)
+    _readiness["static"] = True
+    try:
+        await asyncio.wait_for(write_behind.replay_journal(), STARTUP_STEP_TIMEOUT)
+    except asyncio.TimeoutError:
+        # record ยังอยู่ในคิว/journal -> flush_loop ลองต่อ
+        print(f"⏱️ Write-behind replay timed out after {STARTUP_STEP_TIMEOUT}s")
+
+    # งานที่คุย Mongo / Gemini ทำเบื้องหลัง ไม่ block การเปิดรับ request
+    asyncio.create_task(init_database())
+    asyncio.create_task(write_behind.flush_loop())
+    asyncio.create_task(stats_counters.flush_loop())
+    asyncio.create_task(image_catalog.watch_catalog())
+    asyncio.create_task(prize_engine.refresh_loop())
+    asyncio.create_task(broker.run())
+    asyncio.create_task(settings_sync_loop())
+    asyncio.create_task(blessing_pool.refill_loop())
+    asyncio.create_task(metrics.loop_lag_monitor())
     asyncio.create_task(keep_alive_ping())
 
+    metrics.mark_boot("serving")
+    print(f"🚀 Serving after {metrics.boot_stats()['serving_ms']}ms")
+    yield
+
+    try:
+        await write_behind.flush_all()
+    except Exception as e:
+        print(f"⚠️ Write-behind final flush failed (kept in journal): {e}")
+    try:
+        await stats_counters.flush()
+        await prize_engine.return_leases()
+    except Exception as e:
+        print(f"⚠️ Stats/prize final flush failed: {e}")
+    await close_db()
+
+app = FastAPI(lifespan=lifespan, default_response_class=metrics.TimedJSONResponse)
+
+# Middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.get("/api/health")
+async def health_check(response: Response, ready: bool = False):
+    """Liveness + readiness; ?ready=true ตอบ 503 ถ้ายังไม่พร้อม (ใช้กับ load balancer)"""
+    if ready and not is_ready():
+        response.status_code = 503
+    return {
+        "status": "alive",
+        "ready": is_ready(),
+        "checks": _readiness,
+        "startup": metrics.boot_stats(),
+        "timestamp": datetime.now(),
+    }
+
+# --- Metrics Gauges (อ่านจาก stats ของแต่ละ module ตอน scrape) ---
+
+metrics.register_gauge("blessing_pool_depth", lambda: {
+    (("bucket", key),): depth for key, depth in blessing_pool.pool_stats()["depth"].items()
+}, "Pre-generated blessings waiting per lang/gender")
+metrics.register_gauge("write_behind_queue_depth", lambda: write_behind.stats()["queue_depth"],
+                       "Records waiting for the next write-behind flush")
+metrics.register_gauge("static_lru_bytes", lambda: static_delivery.lru_stats()["bytes"],
+                       "Bytes held by the static file LRU")
+metrics.register_gauge("chat_subscribers", lambda: broker.stats()["subscribers"],
+                       "Open chat SSE subscribers in this worker")
+metrics.register_gauge("image_catalog_images", lambda: {
+    (("gender", gender),): count for gender, count in image_catalog.catalog_stats().items()
+}, "Images in the in-memory catalogue")
+metrics.register_gauge("play_in_flight", lambda: admission.play_gate.stats()["in_flight"],
+                       "/api/play requests currently being processed")
+metrics.register_gauge("play_queue_depth", lambda: admission.play_gate.stats()["waiting"],
+                       "/api/play requests waiting for a slot")
+metrics.register_gauge("played_cache_entries", lambda: played_cache.cache_stats()["entries"],
+                       "Played results cached for already_played replays")
+metrics.register_gauge("played_cache_bytes", lambda: played_cache.cache_stats()["bytes"],
+                       "Approximate bytes held by the played result cache")
+metrics.register_gauge("prize_available_cards", lambda: {
+    (("gender", gender),): count for gender, count in prize_engine.engine_stats()["available"].items()
+}, "Cards that can still be drawn")
+metrics.register_gauge("prize_leased_units", lambda: prize_engine.engine_stats()["leased"],
+                       "Stock units reserved in this worker's lease cache")
+
 # --- 3. Helpers ---
 
 def get_ip_hash(ip: str):
     return hashlib.sha256(ip.encode()).hexdigest()
 
-def get_random_image(gender: str):
-    target_dir = os.path.join(IMAGE_DIR, gender)
-    if not os.path.exists(target_dir):
-        fallback = os.path.join("/app/assets", gender)
-        if os.path.exists(fallback):
-            target_dir = fallback
-        else:
-            raise HTTPException(500, "Image assets missing")
-            
-    files = [f for f in os.listdir(target_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    if not files:
+def get_client_ip(request: Request):
+    client_ip = request.headers.get("X-Forwarded-For") or request.client.host
+    if "," in client_ip: client_ip = client_ip.split(",")[0].strip()
+    return client_ip
+
+def too_many_requests(status: str, retry_after: float, **extra):
+    """429 + Retry-After (frontend ดู status เหมือน response ปกติ)"""
+    retry_after = max(1, ceil(retry_after))
+    return JSONResponse({"status": status, "retry_after": retry_after, **extra},
+                        status_code=429, headers={"Retry-After": str(retry_after)})
+
+async def get_random_image(gender: str):
+    """สุ่มตาม weight/stock (prize_engine); None = ของหมดทุกใบ"""
+    if not image_catalog.is_valid_gender(gender):
+        raise HTTPException(400, "Invalid gender")
+    if not image_catalog.entries(gender):
         raise HTTPException(500, "No images found")
-    return random.choice(files)
+    return await prize_engine.draw(gender)
+
+def get_image_url(gender: str, filename: str):
+    # ?v=<etag> ทำให้ URL เปลี่ยนเมื่อรูปเปลี่ยน -> browser cache แบบ immutable ได้
+    entry = image_catalog.lookup(gender, filename)
+    if not entry:
+        return f"/api/image/{gender}/{filename}"
+    version = entry.etag.strip('"')[:12]
+    return f"/api/image/{gender}/{filename}?v={version}"
 
-async def generate_blessing(name: str, gender: str, lang: str):
+def get_backup_message(lang: str):
     backup_list = BACKUP_MESSAGES_EN if lang == 'en' else BACKUP_MESSAGES_TH
-    if not client_ai:
-        return random.choice(backup_list)
-    
-    try:
-        prompt_th = f"""
-        Role: คุณคือตัวแทนจาก "โปรเจกต์แฟนคลับ (@Jaiidees)" ที่ทำกิจกรรมแจกของที่ระลึกด้วยใจรัก
-        Tone: อบอุ่น, ละมุน, เป็นกันเอง, น่ารัก, ให้เกียรติ แต่ไม่ทางการ
-        Language: ภาษาไทยที่อ่านแล้วยิ้มตาม (ความยาว 3-4 บรรทัด)
-        Input: เพื่อนแฟนคลับชื่อ "{name}" เมนฝั่ง "{gender.upper()}"
-        Task: เขียนข้อความขอบคุณที่มาร่วมสนุกกับโปรเจกต์แฟนคลับ: 1.ทักทาย 2.ความเชื่อมโยงที่รักศิลปินเหมือนกัน 3.อวยพรให้ใจฟูและเดินทางปลอดภัย 4.ปิดท้าย Quote ภาษาอังกฤษสั้นๆ
-        """
-        
-        prompt_en = f"""
-        Role: You are a representative from the "Fan Project (@Jaiidees)", created with love by fans for fans.
-        Tone: Warm, soft, friendly, sweet, and not corporate/official.
-        Language: Heartwarming English (Length: 3-4 sentences).
-        Input: Fellow fan named "{name}" supporting the "{gender.upper()}" side.
-        Task: Write a thank you note for joining our fan project gacha. Express joy in sharing the same love for the artist. Wish them joy and safe travels. End with a short English Quote.
-        """
-        
-        final_prompt = prompt_en if lang == 'en' else prompt_th
-
-        response = await asyncio.wait_for(
-            client_ai.aio.models.generate_content(
-                model=AI_MODEL_NAME,
-                contents=final_prompt,
-                config=types.GenerateContentConfig(temperature=0.8)
-            ),
-            timeout=5.0
-        )
-        return response.text.strip()
-    except Exception as e:
-        print(f"🔥 AI Error: {e} -> Using Manual Backup")
-        return random.choice(backup_list)
+    return random.choice(backup_list)
 
 # --- 4. Chat System Routes (NEW) ---
 
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+def format_sse(msg: dict):
+    data = json.dumps(jsonable_encoder(msg), ensure_ascii=False)
+    return f"id: {msg['seq']}\nevent: message\ndata: {data}\n\n"
+
 @app.post("/api/chat/send")
 async def send_chat(request: Request):
     try:
@@ -179,53 +251,77 @@ async def send_chat(request: Request):
         if not session_id or not message:
             raise HTTPException(400, "Missing data")
 
-        # Prepare new message
-        new_msg = {
-            "sender": "user",
-            "text": message,
-            "timestamp": datetime.now()
-        }
+        wait = (await admission.limiter.check("chat_session", session_id)
+                or await admission.limiter.check("chat_ip", get_ip_hash(get_client_ip(request))))
+        if wait:
+            return too_many_requests("rate_limited", wait)
 
-        # Check if chat exists
-        chat_room = chats.find_one({"session_id": session_id})
-
-        if chat_room:
-            # Update existing chat
-            chats.update_one(
-                {"session_id": session_id}, 
-                {
-                    "$push": {"messages": new_msg},
-                    "$set": {
-                        "last_updated": datetime.now(), 
-                        "is_read": False, 
-                        "name": name
-                    }
-                }
-            )
-        else:
-            # Create new chat
-            chats.insert_one({
-                "session_id": session_id,
-                "name": name,
-                "created_at": datetime.now(),
-                "last_updated": datetime.now(),
-                "is_read": False,
-                "messages": [new_msg]
-            })
-            
-        return {"status": "success"}
+        # สร้างห้องใหม่ถ้ายังไม่มี
+        event = await chat_store.append_message(session_id, "user", message, name=name)
+        if not event:
+            return too_many_requests("room_full", 3600)
+
+        return {"status": "success", "seq": event["seq"]}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Chat Error: {e}")
         raise HTTPException(500, str(e))
 
 @app.get("/api/chat/history/{session_id}")
-async def get_chat_history(session_id: str):
-    """API for User to poll chat history"""
-    chat = chats.find_one({"session_id": session_id}, {"_id": 0})
-    if chat:
-        return {"status": "success", "data": chat["messages"]}
+async def get_chat_history(session_id: str, after: int = -1):
+    """API for User to poll chat history (fallback ของ /api/chat/stream), ?after=<seq> คืนเฉพาะข้อความใหม่"""
+    messages = await chat_store.load_messages(session_id, after)
+    if messages or await chat_store.room_exists(session_id):
+        return {"status": "success", "data": messages}
     return {"status": "empty", "data": []}
 
+@app.get("/api/chat/stream/{session_id}")
+async def stream_chat(session_id: str, request: Request, after: int = -1):
+    """Server-Sent Events: ส่งข้อความที่ seq > after แล้ว push ข้อความใหม่แบบ real-time"""
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        after = int(last_event_id)
+
+    async def event_stream():
+        queue = broker.subscribe(session_id)
+        last_seq = after
+        held = {}  # ข้อความที่มาก่อนลำดับ รอจนต่อกันครบ
+        try:
+            yield "retry: 3000\n\n"
+            for msg in await chat_store.load_messages(session_id, last_seq):
+                last_seq = msg["seq"]
+                yield format_sse(msg)
+
+            while True:
+                try:
+                    msg = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    if not held:
+                        continue
+                    msg = None  # ยังมีข้อความค้างรอช่องว่าง -> ลองใหม่ (ช่องว่างอาจเกิน GAP_GRACE แล้ว)
+                if msg is not None:
+                    if msg["seq"] <= last_seq:
+                        continue
+                    held[msg["seq"]] = msg
+                # seq กระโดด (queue เต็ม/ข้าม worker) -> เติมส่วนที่ขาดจาก DB
+                if last_seq + 1 not in held:
+                    for m in await chat_store.load_messages(session_id, last_seq):
+                        held.setdefault(m["seq"], m)
+                # กติกาเดียวกับ contiguous(): seq ที่หายเกิน GAP_GRACE (insert ล้มเหลว) ข้ามไปเลย
+                for m in chat_store.contiguous([held[seq] for seq in sorted(held)], last_seq):
+                    last_seq = m["seq"]
+                    yield format_sse(m)
+                held = {seq: m for seq, m in held.items() if seq > last_seq}
+        finally:
+            broker.unsubscribe(session_id, queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
 @app.post("/api/admin/reply")
 async def admin_reply(request: Request):
     """API for Admin to reply"""
@@ -238,47 +334,40 @@ async def admin_reply(request: Request):
         session_id = data.get("session_id")
         message = data.get("message")
         
-        chats.update_one(
-            {"session_id": session_id},
-            {
-                "$push": {
-                    "messages": {
-                        "sender": "admin",
-                        "text": message,
-                        "timestamp": datetime.now()
-                    }
-                },
-                "$set": {"is_read": True}
-            }
-        )
-        return {"status": "success"}
+        event = await chat_store.append_message(session_id, "admin", message)
+        if not event:
+            raise HTTPException(404, "Chat not found")
+        return {"status": "success", "seq": event["seq"]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, str(e))
 
 @app.get("/api/admin/chats")
-async def get_all_chats(request: Request):
-    """API for Admin to list all chats"""
+async def get_all_chats(request: Request, limit: int = 50, cursor: str = None):
+    """API for Admin to list chats (ไม่มีประวัติข้อความ), ?cursor= สำหรับหน้าถัดไป"""
     auth_header = request.headers.get("X-Admin-Key")
     if auth_header != ADMIN_SECRET:
         raise HTTPException(401, "Unauthorized")
     
     try:
-        # Get chats sorted by last update
-        cursor = chats.find({}).sort("last_updated", -1).limit(50)
-        chat_list = []
-        for c in cursor:
-            c["_id"] = str(c["_id"])
-            last_msg = c["messages"][-1]["text"] if c["messages"] else ""
-            
-            chat_list.append({
-                "session_id": c["session_id"],
-                "name": c["name"],
-                "last_message": last_msg,
-                "last_updated": c["last_updated"],
-                "is_read": c.get("is_read", True),
-                "messages": c["messages"]
-            })
-        return {"status": "success", "data": chat_list}
+        chat_list, next_cursor = await chat_store.list_rooms(max(1, min(limit, 200)), cursor)
+        return {"status": "success", "data": chat_list, "next_cursor": next_cursor}
+    except (ValueError, InvalidId):
+        raise HTTPException(400, "Invalid cursor")
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+@app.get("/api/admin/chats/{session_id}")
+async def get_chat_messages(session_id: str, request: Request, after: int = -1, limit: int = 200):
+    """API for Admin to load one conversation on demand, ?after=<seq> คืนเฉพาะข้อความใหม่"""
+    auth_header = request.headers.get("X-Admin-Key")
+    if auth_header != ADMIN_SECRET:
+        raise HTTPException(401, "Unauthorized")
+
+    try:
+        messages = await chat_store.load_messages(session_id, after, limit)
+        return {"status": "success", "data": messages}
     except Exception as e:
         raise HTTPException(500, str(e))
 
@@ -289,32 +378,82 @@ async def get_system_status(request: Request):
     auth_header = request.headers.get("X-Admin-Key")
     if auth_header != ADMIN_SECRET:
         raise HTTPException(401, "Unauthorized")
-    status = settings.find_one({"key": "system_status"})
-    return {"is_active": status.get("is_active", False)}
+    return {"is_active": is_system_active()}
+
+@app.get("/api/admin/blessing_pool")
+async def get_blessing_pool(request: Request):
+    auth_header = request.headers.get("X-Admin-Key")
+    if auth_header != ADMIN_SECRET:
+        raise HTTPException(401, "Unauthorized")
+    return {"status": "success", "data": blessing_pool.pool_stats()}
+
+@app.get("/api/admin/write_behind")
+async def get_write_behind(request: Request):
+    auth_header = request.headers.get("X-Admin-Key")
+    if auth_header != ADMIN_SECRET:
+        raise HTTPException(401, "Unauthorized")
+    return {"status": "success", "data": write_behind.stats()}
+
+@app.get("/api/admin/admission")
+async def get_admission(request: Request):
+    auth_header = request.headers.get("X-Admin-Key")
+    if auth_header != ADMIN_SECRET:
+        raise HTTPException(401, "Unauthorized")
+    return {"status": "success", "data": {**admission.stats(), "played_cache": played_cache.cache_stats()}}
+
+@app.post("/api/admin/reload_images")
+async def reload_images(request: Request):
+    auth_header = request.headers.get("X-Admin-Key")
+    if auth_header != ADMIN_SECRET:
+        raise HTTPException(401, "Unauthorized")
+    counts = await asyncio.to_thread(image_catalog.load_catalog)
+    prize_engine.load_config()
+    await prize_engine.seed_stock()
+    return {"status": "success", "data": counts}
 
 @app.post("/api/admin/toggle_system")
 async def toggle_system(request: Request):
     auth_header = request.headers.get("X-Admin-Key")
     if auth_header != ADMIN_SECRET:
         raise HTTPException(401, "Unauthorized")
-    current = settings.find_one({"key": "system_status"})
-    new_status = not current.get("is_active", False)
-    settings.update_one({"key": "system_status"}, {"$set": {"is_active": new_status}})
+    new_status = await toggle_system_status()
     return {"is_active": new_status}
 
+HISTORY_TOTAL_TTL = float(os.getenv("HISTORY_TOTAL_TTL", "5"))
+_history_total = {"value": 0, "at": 0.0}
+
+async def get_history_total():
+    """estimated_document_count (metadata, ไม่ scan) + cache สั้นๆ"""
+    now = time.monotonic()
+    if now - _history_total["at"] > HISTORY_TOTAL_TTL:
+        _history_total["value"] = await players.estimated_document_count()
+        _history_total["at"] = now
+    return _history_total["value"]
+
 @app.get("/api/admin/history")
-async def get_history(request: Request, page: int = 1, limit: int = 100):
+async def get_history(request: Request, page: int = 1, limit: int = 100, cursor: str = None):
+    """?cursor=<next_cursor> = keyset pagination (เร็วทุกหน้า), ไม่ใส่ = page/offset แบบเดิม"""
     auth_header = request.headers.get("X-Admin-Key")
     if auth_header != ADMIN_SECRET:
         raise HTTPException(401, "Unauthorized")
 
     try:
-        skip = (page - 1) * limit
-        total_docs = players.count_documents({})
-        total_pages = ceil(total_docs / limit) if limit > 0 else 1
+        query = keyset_query("played_at", cursor) if cursor else {}
+    except (ValueError, InvalidId):
+        raise HTTPException(400, "Invalid cursor")
+
+    try:
+        limit = max(1, limit)
+        total_docs = await get_history_total()
+        total_pages = ceil(total_docs / limit)
         
-        cursor = players.find({}, {"_id": 0}).sort("played_at", -1).skip(skip).limit(limit)
-        logs = list(cursor)
+        docs = players.find(query).sort([("played_at", -1), ("_id", -1)])
+        if not cursor:
+            docs = docs.skip((page - 1) * limit)
+        logs = await docs.limit(limit).to_list(length=None)
+        next_cursor = encode_keyset_cursor(logs[-1]["played_at"], logs[-1]["_id"]) if len(logs) == limit else None
+        for log in logs:
+            del log["_id"]
         return {
             "status": "success", 
             "data": logs, 
@@ -322,104 +461,256 @@ async def get_history(request: Request, page: int = 1, limit: int = 100):
                 "page": page,
                 "limit": limit,
                 "total_docs": total_docs,
-                "total_pages": total_pages
+                "total_pages": total_pages,
+                "next_cursor": next_cursor
             }
         }
     except Exception as e:
         raise HTTPException(500, str(e))
 
 @app.get("/api/admin/export")
-async def get_export_data(request: Request):
+async def get_export_data(request: Request, format: str = "json", gzip: bool = False,
+                          since: datetime = None, until: datetime = None):
+    """Stream players ทั้งหมด (json/ndjson/csv), ?since=&until= กรองตาม played_at, ?gzip=true บีบอัด"""
     auth_header = request.headers.get("X-Admin-Key")
     if auth_header != ADMIN_SECRET:
         raise HTTPException(401, "Unauthorized")
+    if format not in exporter.EXPORT_FORMATS:
+        raise HTTPException(400, "Unsupported format")
 
-    try:
-        cursor = players.find({}, {"_id": 0}).sort("played_at", -1)
-        logs = list(cursor)
-        return {"status": "success", "data": logs}
-    except Exception as e:
-        raise HTTPException(500, str(e))
+    headers = {"Content-Disposition": f'attachment; filename="Riser_Gacha_Export.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    query = exporter.build_query(since, until)
+    return StreamingResponse(exporter.export_stream(format, query, gzip),
+                             media_type=exporter.EXPORT_FORMATS[format], headers=headers)
+
+def reconcile_lost_play(doc: dict):
+    """Write-behind หลาย worker: record นี้แพ้ unique ip_hash ตอน flush (worker อื่นเขียนก่อน)
+    -> ย้อน stats / คืนรางวัล / ล้าง cache ให้ reload ครั้งหน้าเห็นผลที่อยู่ใน DB จริง"""
+    stats_counters.record_delete(doc)
+    prize_engine.release(doc.get("gender"), doc.get("image_file"))
+    played_cache.invalidate(doc["ip_hash"])
+
+write_behind.on_conflict("players", reconcile_lost_play)
 
 @app.post("/api/play")
 async def play_gacha(request: Request):
+    if not is_system_active():
+        return {"status": "closed"}
+
+    # Admission: rate limit ต่อ IP แล้วจำกัดจำนวน request ที่ทำงานพร้อมกัน
+    client_ip = get_client_ip(request)
+    ip_hash = get_ip_hash(client_ip)
+    # Reload หน้า result: ตอบจาก cache ใน memory ก่อน (ไม่แตะ DB, ไม่กิน rate limit / slot)
+    cached = played_cache.get(ip_hash)
+    if cached:
+        return already_played(cached)
+
+    wait = await admission.limiter.check("play", ip_hash)
+    if wait:
+        return too_many_requests("rate_limited", wait)
+    try:
+        await admission.play_gate.acquire()
+    except admission.Saturated as e:
+        return too_many_requests("busy", e.retry_after, queue_position=e.position)
     try:
-        system_status = settings.find_one({"key": "system_status"})
-        if not system_status.get("is_active", False):
-            return {"status": "closed"}
+        return await _play(request, client_ip, ip_hash)
+    finally:
+        admission.play_gate.release()
+
+def already_played(old: dict):
+    return {
+        "status": "already_played",
+        "data": {
+            "image_url": get_image_url(old['gender'], old['image_file']),
+            "blessing": old['blessing']
+        }
+    }
 
+async def _play(request: Request, client_ip: str, ip_hash: str):
+    reserved = None  # รางวัลที่จองไว้แล้ว ต้องคืนถ้าไม่ได้แจกจริง
+    cache_version = played_cache.version()
+    try:
         data = await request.json()
         gender = data.get("gender")
         name = data.get("name", "Fan")
-        lang = data.get("lang", "th")
-        
-        # IP Checking
-        client_ip = request.headers.get("X-Forwarded-For") or request.client.host
-        if "," in client_ip: client_ip = client_ip.split(",")[0].strip()
-        ip_hash = get_ip_hash(client_ip)
-
-        # Check Duplicate
-        if players.find_one({"ip_hash": ip_hash}):
-            old = players.find_one({"ip_hash": ip_hash})
-            return {
-                "status": "already_played",
-                "data": {
-                    "image_url": f"/api/image/{old['gender']}/{old['image_file']}",
-                    "blessing": old['blessing']
-                }
-            }
-
-        selected_image = get_random_image(gender)
-        blessing = await generate_blessing(name, gender, lang)
-
-        # Insert Record
-        players.insert_one({
-            "ip_hash": ip_hash,
-            "ip_address": client_ip, 
+        lang = 'en' if data.get("lang") == 'en' else 'th'
+        projection = {"_id": 0, "gender": 1, "image_file": 1, "blessing": 1}
+
+        # เช็คว่าเล่นไปแล้วก่อนสุ่มรางวัล: replay ที่ cache ไม่มี (หมดอายุ / worker อื่น)
+        # ต้องได้ผลเดิม ไม่ใช่ out_of_stock และไม่ต้องจอง stock
+        old = write_behind.lookup_pending("players", ip_hash) if write_behind.ENABLED else None
+        old = old or await players.find_one({"ip_hash": ip_hash}, projection)
+        if old:
+            played_cache.put(ip_hash, old, cache_version)
+            return already_played(old)
+
+        # Pick prize & pre-generated blessing (no AI wait; stock จาก lease ใน memory)
+        selected_image = await get_random_image(gender)
+        if not selected_image:
+            return {"status": "out_of_stock"}
+        reserved = selected_image
+        template, popped = blessing_pool.acquire(lang, gender)
+        blessing = blessing_pool.personalise(template, name) if template else get_backup_message(lang)
+
+        record = {
+            "ip_address": client_ip,
             "gender": gender,
             "name": name,
             "image_file": selected_image,
             "blessing": blessing,
-            "played_at": datetime.now()
-        })
+            "lang": lang,
+            "played_at": datetime.now(),
+            **prize_engine.lease_tag(gender, selected_image),
+        }
 
+        if write_behind.ENABLED:
+            # เช็คคิวซ้ำหลัง await (request ซ้อนจาก IP เดียวกันใน worker นี้)
+            old = write_behind.lookup_pending("players", ip_hash)
+            if not old:
+                await write_behind.enqueue("players", {"ip_hash": ip_hash, **record}, key=ip_hash)
+        else:
+            # Atomic Claim: reserve ip_hash slot (upsert) กัน request ซ้อนที่ผ่าน find_one มาพร้อมกัน
+            try:
+                old = await players.find_one_and_update(
+                    {"ip_hash": ip_hash},
+                    {"$setOnInsert": record},
+                    projection=projection,
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE
+                )
+            except DuplicateKeyError:
+                # Concurrent upsert from same IP lost the race
+                old = await players.find_one({"ip_hash": ip_hash}, projection)
+
+        reserved = None
+        if old:
+            blessing_pool.release(lang, gender, template, popped)
+            prize_engine.release(gender, selected_image)
+            played_cache.put(ip_hash, old, cache_version)
+            return already_played(old)
+
+        stats_counters.record_play(record)
+        played_cache.put(ip_hash, record, cache_version)
         return {
             "status": "success",
             "data": {
-                "image_url": f"/api/image/{gender}/{selected_image}",
+                "image_url": get_image_url(gender, selected_image),
                 "blessing": blessing
             }
         }
+    except HTTPException:
+        raise
     except Exception as e:
+        if reserved:
+            prize_engine.release(gender, reserved)
         print(f"🔥 Error: {e}")
         raise HTTPException(500, str(e))
 
 @app.get("/api/image/{gender}/{filename}")
-def get_image(gender: str, filename: str):
-    path = os.path.join(IMAGE_DIR, gender, filename)
-    if not os.path.exists(path):
-        path = os.path.join("/app/assets", gender, filename)
-    if os.path.exists(path):
-        return FileResponse(path)
-    raise HTTPException(404)
+async def get_image(gender: str, filename: str, request: Request, v: str = None, size: str = None,
+                    format: str = None):
+    entry = image_catalog.lookup(gender, filename)
+    if not entry:
+        raise HTTPException(404)
+    versioned = bool(v) and entry.etag.strip('"').startswith(v)
+    cache_control = static_delivery.CACHE_IMMUTABLE if versioned else static_delivery.CACHE_SHORT
+    # ?format=auto (ใช้กับ <img>): ส่ง AVIF/WebP ถ้า browser รองรับ (ผ่าน Accept), ไม่ใส่ = ไฟล์ต้นฉบับ
+    # ?size=thumb|960w สำหรับรูปเล็ก
+    variant, negotiated = image_catalog.lookup_variant(gender, filename, request.headers.get("accept", ""), size,
+                                                       negotiate=format == "auto")
+    return await static_delivery.serve_entry(request, variant, cache_control, vary="Accept" if negotiated else None)
 
 @app.delete("/api/admin/delete/{ip_hash}")
 async def delete_history(ip_hash: str, request: Request):
     auth_header = request.headers.get("X-Admin-Key")
     if auth_header != ADMIN_SECRET:
         raise HTTPException(401, "Unauthorized")
-    result = players.delete_one({"ip_hash": ip_hash})
-    if result.deleted_count == 1:
+    pending = write_behind.lookup_pending("players", ip_hash) if write_behind.ENABLED else None
+    discarded = await write_behind.discard("players", ip_hash) if pending else False
+    deleted = await players.find_one_and_delete({"ip_hash": ip_hash}, projection=STATS_FIELDS)
+    played_cache.invalidate(ip_hash)
+    if deleted or discarded:
+        stats_counters.record_delete(deleted or pending)
         return {"status": "deleted"}
     raise HTTPException(404, "Record not found")
 
+@app.get("/api/admin/prizes")
+async def get_prizes(request: Request):
+    """Weight / stock / remaining ของทุกรูป"""
+    auth_header = request.headers.get("X-Admin-Key")
+    if auth_header != ADMIN_SECRET:
+        raise HTTPException(401, "Unauthorized")
+    try:
+        return {"status": "success", "data": await prize_engine.inventory(), "engine": prize_engine.engine_stats()}
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+@app.post("/api/admin/prizes/restock")
+async def restock_prize(request: Request):
+    """เติมของ: {"gender": "male", "image_file": "Achi.png", "add": 10}"""
+    auth_header = request.headers.get("X-Admin-Key")
+    if auth_header != ADMIN_SECRET:
+        raise HTTPException(401, "Unauthorized")
+    data = await request.json()
+    gender, image_file, add = data.get("gender"), data.get("image_file"), data.get("add")
+    if not image_catalog.lookup(gender, image_file):
+        raise HTTPException(400, "Invalid prize")
+    # bool เป็น subclass ของ int -> เช็ค type ตรงๆ; ติดลบทำให้ remaining/stock ต่ำกว่า 0
+    if type(add) is not int or add <= 0:
+        raise HTTPException(400, "add must be a positive integer")
+    if prize_engine.card_config(gender, image_file)["stock"] is None:
+        raise HTTPException(400, "Prize has unlimited stock")
+    doc = await prize_engine.restock(gender, image_file, add)
+    return {"status": "success", "remaining": doc["remaining"], "stock": doc["stock"]}
+
+STATS_FIELDS = {"_id": 0, "gender": 1, "image_file": 1, "lang": 1, "played_at": 1}
+
+@app.get("/api/admin/stats")
+async def get_event_stats(request: Request, window: int = 60):
+    """สรุป gender / lang / รูป / plays ต่อนาที จาก counter (O(1) ไม่ scan players)"""
+    auth_header = request.headers.get("X-Admin-Key")
+    if auth_header != ADMIN_SECRET:
+        raise HTTPException(401, "Unauthorized")
+    try:
+        data = await stats_counters.get_stats(max(1, min(window, 24 * 60)))
+        return {"status": "success", "data": data}
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+@app.post("/api/admin/stats/rebuild")
+async def rebuild_event_stats(request: Request):
+    """ซ่อม counter โดยนับใหม่จาก players (aggregation รอบเดียว)"""
+    auth_header = request.headers.get("X-Admin-Key")
+    if auth_header != ADMIN_SECRET:
+        raise HTTPException(401, "Unauthorized")
+    try:
+        counters = await stats_counters.rebuild()
+        return {"status": "success", "counters": counters}
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+@app.get("/api/metrics")
+async def get_metrics(request: Request):
+    """Prometheus text format (X-Admin-Key หรือ Authorization: Bearer <ADMIN_SECRET>, ยกเว้น METRICS_PUBLIC=1)"""
+    if not METRICS_PUBLIC:
+        auth_header = request.headers.get("X-Admin-Key") or request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if auth_header != ADMIN_SECRET:
+            raise HTTPException(401, "Unauthorized")
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 # --- Frontend Serving ---
-if os.path.exists(os.path.join(STATIC_DIR, "assets")):
-    app.mount("/assets", StaticFiles(directory=os.path.join(STATIC_DIR, "assets")), name="static")
 
 @app.get("/{full_path:path}")
-async def serve_spa(full_path: str):
-    file_path = os.path.join(STATIC_DIR, full_path)
-    if os.path.exists(file_path) and os.path.isfile(file_path):
-        return FileResponse(file_path)
-    return FileResponse(os.path.join(STATIC_DIR, "index.html"))
\ No newline at end of file
+async def serve_spa(full_path: str, request: Request):
+    entry = static_delivery.lookup_static(full_path)
+    if entry and full_path.startswith("assets/"):
+        # Vite ใส่ content hash ในชื่อไฟล์ใต้ /assets -> cache ได้ถาวร
+        return await static_delivery.serve_entry(request, entry, static_delivery.CACHE_IMMUTABLE)
+    if entry and full_path != "index.html":
+        return await static_delivery.serve_entry(request, entry, static_delivery.CACHE_SHORT)
+    index = static_delivery.lookup_static("index.html")
+    if not index:
+        raise HTTPException(404)
+    return await static_delivery.serve_entry(request, index, static_delivery.CACHE_REVALIDATE)
@@ -0,0 +1,245 @@
+import os
+import time
+import random
+import asyncio
+import cProfile
+import contextvars
+from contextlib import contextmanager
+from fastapi.responses import JSONResponse
+from pymongo import monitoring
+
+# --- Metrics & Instrumentation ---
+# Histogram/Counter แบบเบาๆ ใน process (ไม่ต้องพึ่ง prometheus_client)
+# - http_request_duration_seconds{route,method,status}  (middleware)
+# - stage_duration_seconds{route,stage}  (db / ai / fs / serialize)
+# - mongo_command_duration_seconds{command}  (PyMongo command listener)
+# - event_loop_lag_seconds
+# export เป็น Prometheus text format ที่ /api/metrics
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+
+# Sampling profiler (opt-in): PROFILE_ROUTES=/api/play,/api/chat/send PROFILE_SAMPLE_RATE=0.01
+PROFILE_ROUTES = {r for r in os.getenv("PROFILE_ROUTES", "").split(",") if r}
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+_histograms = {}  # name -> {labels(tuple): [bucket counts..., sum, count]}
+_counters = {}    # name -> {labels(tuple): value}
+_gauges = {}      # name -> callable() -> {labels(tuple): value} | float
+_help = {}
+_current_scope = contextvars.ContextVar("metrics_scope", default=None)
+_profiling = {"active": False}
+# Boot timeline (perf_counter): started = main เริ่ม import, serving = lifespan พร้อมรับ request
+_boot = {"started": None, "serving": None, "first_request": None}
+
+def _labels_key(labels: dict):
+    return tuple(sorted(labels.items()))
+
+def describe(name: str, text: str):
+    _help[name] = text
+
+def observe(name: str, value: float, **labels):
+    series = _histograms.setdefault(name, {})
+    row = series.get(_labels_key(labels))
+    if row is None:
+        row = series[_labels_key(labels)] = [0] * (len(BUCKETS) + 2)
+    for i, bound in enumerate(BUCKETS):
+        if value <= bound:
+            row[i] += 1
+            break
+    row[-2] += value
+    row[-1] += 1
+
+def inc(name: str, amount: float = 1, **labels):
+    series = _counters.setdefault(name, {})
+    key = _labels_key(labels)
+    series[key] = series.get(key, 0) + amount
+
+def register_gauge(name: str, fn, text: str = None):
+    """fn() คืนตัวเลข หรือ dict {labels dict as tuple: value}"""
+    _gauges[name] = fn
+    if text:
+        _help[name] = text
+
+def current_route():
+    scope = _current_scope.get()
+    if not scope:
+        return "background"
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+@contextmanager
+def stage(name: str):
+    """with stage("db"): ... -> stage_duration_seconds{route, stage}"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_duration_seconds", time.perf_counter() - started, route=current_route(), stage=name)
+
+class TimedJSONResponse(JSONResponse):
+    """default_response_class: จับเวลา json.dumps เป็น stage serialize"""
+
+    def render(self, content):
+        with stage("serialize"):
+            return super().render(content)
+
+# --- Boot timing ---
+
+def mark_boot(phase: str, at: float = None):
+    _boot[phase] = at if at is not None else time.perf_counter()
+
+def boot_stats():
+    """ms นับจาก started: serving (พร้อมรับ request) / first_request (request แรกจริง)"""
+    started = _boot["started"]
+    if started is None:
+        return {}
+    return {f"{phase}_ms": round((at - started) * 1000, 1)
+            for phase, at in _boot.items() if phase != "started" and at is not None}
+
+register_gauge("startup_seconds", lambda: {
+    (("phase", key[:-3]),): ms / 1000 for key, ms in boot_stats().items()
+}, "Time from process import to serving / first request")
+
+# --- Mongo command timing ---
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        observe("mongo_command_duration_seconds", seconds, command=event.command_name)
+        observe("stage_duration_seconds", seconds, route=current_route(), stage="db")
+
+    def failed(self, event):
+        inc("mongo_command_failures_total", command=event.command_name)
+        observe("stage_duration_seconds", event.duration_micros / 1e6, route=current_route(), stage="db")
+
+# --- HTTP middleware ---
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: เวลา/สถานะต่อ route (SSE นับแค่ time-to-first-byte)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        token = _current_scope.set(scope)
+        started = time.perf_counter()
+        if _boot["first_request"] is None:
+            _boot["first_request"] = started
+        state = {"status": 500, "recorded": False}
+        profiler = self._maybe_profile(scope)
+
+        def record():
+            if state["recorded"]:
+                return
+            state["recorded"] = True
+            observe("http_request_duration_seconds", time.perf_counter() - started,
+                    route=current_route(), method=scope["method"], status=str(state["status"]))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                headers = dict(message.get("headers") or [])
+                if headers.get(b"content-type", b"").startswith(b"text/event-stream"):
+                    record()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record()
+            if profiler:
+                self._finish_profile(profiler, scope)
+            _current_scope.reset(token)
+
+    def _maybe_profile(self, scope):
+        if not PROFILE_ROUTES or _profiling["active"]:
+            return None
+        if scope.get("path") not in PROFILE_ROUTES or random.random() >= PROFILE_SAMPLE_RATE:
+            return None
+        # cProfile ทำงานทั้ง thread (รวม task อื่นที่รันระหว่าง await) -> ใช้ดูภาพรวม hot path
+        _profiling["active"] = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _finish_profile(self, profiler, scope):
+        profiler.disable()
+        _profiling["active"] = False
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        safe = scope["path"].strip("/").replace("/", "_") or "root"
+        path = os.path.join(PROFILE_DIR, f"{safe}-{int(time.time() * 1000)}.prof")
+        profiler.dump_stats(path)
+        inc("profiles_captured_total", route=safe)
+
+# --- Event loop lag ---
+
+async def loop_lag_monitor():
+    """Background task: วัดว่า event loop ตื่นช้ากว่าที่ควรเท่าไร (blocking call จะทำให้ค่านี้พุ่ง)"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, time.perf_counter() - started - LOOP_LAG_INTERVAL)
+        observe("event_loop_lag_seconds", lag)
+        _last_lag["value"] = lag
+
+_last_lag = {"value": 0.0}
+register_gauge("event_loop_lag_last_seconds", lambda: _last_lag["value"], "Most recent event loop lag sample")
+
+# --- Prometheus exposition ---
+
+def _fmt_labels(key, extra=None):
+    items = list(key) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    parts = []
+    for k, v in items:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+def _header(lines, name, kind):
+    if name in _help:
+        lines.append(f"# HELP {name} {_help[name]}")
+    lines.append(f"# TYPE {name} {kind}")
+
+def render_prometheus():
+    lines = []
+    for name, series in sorted(_histograms.items()):
+        _header(lines, name, "histogram")
+        for key, row in series.items():
+            cumulative = 0
+            for i, bound in enumerate(BUCKETS):
+                cumulative += row[i]
+                lines.append(f"{name}_bucket{_fmt_labels(key, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{_fmt_labels(key, {'le': '+Inf'})} {row[-1]}")
+            lines.append(f"{name}_sum{_fmt_labels(key)} {row[-2]:.6f}")
+            lines.append(f"{name}_count{_fmt_labels(key)} {row[-1]}")
+    for name, series in sorted(_counters.items()):
+        _header(lines, name, "counter")
+        for key, value in series.items():
+            lines.append(f"{name}{_fmt_labels(key)} {value}")
+    for name, fn in sorted(_gauges.items()):
+        try:
+            value = fn()
+        except Exception:
+            continue
+        _header(lines, name, "gauge")
+        if isinstance(value, dict):
+            for key, v in value.items():
+                lines.append(f"{name}{_fmt_labels(key)} {float(v)}")
+        elif value is not None:
+            lines.append(f"{name} {float(value)}")
+    return "\n".join(lines) + "\n"
+
+describe("http_request_duration_seconds", "HTTP request latency by route")
+describe("stage_duration_seconds", "Time spent per stage (db, ai, fs, serialize) by route")
+describe("mongo_command_duration_seconds", "MongoDB command latency")
+describe("event_loop_lag_seconds", "Event loop scheduling lag")
@@ -0,0 +1,74 @@
+import os
+import time
+from collections import OrderedDict
+import metrics
+
+# --- Played Result Cache ---
+# แฟนกด reload หน้า result บ่อยมาก -> POST /api/play ซ้ำจาก IP เดิม
+# เก็บผลที่เล่นแล้ว {ip_hash: (expires_at, result)} ใน LRU (memory) ตอบ already_played ได้โดยไม่แตะ DB
+# result = {"gender", "image_file", "blessing"} (สร้าง image_url ตอนตอบ -> ?v=<etag> ตามรูปล่าสุดเสมอ)
+# จำกัดขนาดด้วย PLAYED_CACHE_MAX_BYTES (ประมาณจากขนาด string) และหมดอายุตาม TTL
+# TTL = ระยะที่ worker อื่นอาจยังเห็นผลเก่าหลัง admin ลบประวัติ (invalidate ได้แค่ใน worker ที่รับ request ลบ)
+
+MAX_BYTES = int(os.getenv("PLAYED_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+TTL_SECONDS = float(os.getenv("PLAYED_CACHE_TTL_SECONDS", "300"))
+ENTRY_OVERHEAD = 200  # tuple + dict + key ของแต่ละ entry (ประมาณ)
+
+_cache = OrderedDict()
+_state = {"bytes": 0, "hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+def _size(ip_hash: str, result: dict):
+    return ENTRY_OVERHEAD + len(ip_hash) + sum(len(str(v).encode()) for v in result.values())
+
+def _drop(ip_hash: str):
+    entry = _cache.pop(ip_hash, None)
+    if entry:
+        _state["bytes"] -= entry[2]
+    return entry
+
+def get(ip_hash: str):
+    """ผลที่เล่นไปแล้ว หรือ None (ไม่มี / หมดอายุ)"""
+    entry = _cache.get(ip_hash)
+    if entry and entry[0] > time.monotonic():
+        _cache.move_to_end(ip_hash)
+        _state["hits"] += 1
+        metrics.inc("played_cache_lookups_total", result="hit")
+        return entry[1]
+    if entry:
+        _drop(ip_hash)
+    _state["misses"] += 1
+    metrics.inc("played_cache_lookups_total", result="miss")
+    return None
+
+def version():
+    """อ่านก่อน query DB แล้วส่งให้ put -> ถ้ามีการลบระหว่างนั้น จะไม่ cache ผลที่อ่านมาก่อนลบ"""
+    return _state["invalidations"]
+
+def put(ip_hash: str, result: dict, seen_version: int = None):
+    if TTL_SECONDS <= 0 or (seen_version is not None and seen_version != _state["invalidations"]):
+        return
+    result = {"gender": result["gender"], "image_file": result["image_file"], "blessing": result["blessing"]}
+    size = _size(ip_hash, result)
+    if size > MAX_BYTES:
+        return
+    _drop(ip_hash)
+    _cache[ip_hash] = (time.monotonic() + TTL_SECONDS, result, size)
+    _state["bytes"] += size
+    while _state["bytes"] > MAX_BYTES and _cache:
+        _, (_, _, evicted) = _cache.popitem(last=False)
+        _state["bytes"] -= evicted
+        _state["evictions"] += 1
+
+def invalidate(ip_hash: str):
+    _state["invalidations"] += 1
+    _drop(ip_hash)
+
+def clear():
+    _state["invalidations"] += 1
+    _cache.clear()
+    _state["bytes"] = 0
+
+def cache_stats():
+    lookups = _state["hits"] + _state["misses"]
+    return {"entries": len(_cache), **_state,
+            "hit_rate": round(_state["hits"] / lookups, 4) if lookups else 0.0}
@@ -0,0 +1,284 @@
+import os
+import json
+import uuid
+import random
+import socket
+import asyncio
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+from database import prize_stock, players
+import image_catalog
+
+# --- Prize Engine (weighted draw + stock) ---
+# แต่ละรูปมี weight และ stock (ของรางวัลจริง) ตั้งใน PRIZES_FILE:
+#   {"default": {"weight": 1, "stock": null},
+#    "male": {"Achi.png": {"weight": 3, "stock": 20}}, "female": {...}}
+# stock = null -> ไม่จำกัด (ไม่แตะ DB เลย)
+# สุ่มด้วย alias table (O(1) ต่อครั้ง) สร้างใหม่เฉพาะเมื่อรายการรูปที่ยังมีของเปลี่ยน
+# stock จริงอยู่ใน Mongo (prize_stock.remaining) แต่ละ worker ขอ "lease" ทีละ PRIZE_LEASE_SIZE ชิ้น
+# ด้วย $inc แบบมีเงื่อนไข (atomic) แล้วแจกจาก lease ใน memory -> ไม่ oversell และไม่ต้อง round trip ทุกครั้ง
+# lease ที่เหลือคืนเข้า Mongo ตอน shutdown
+# lease มีเจ้าของ: prize_stock.leases.<owner> = {granted, expires_at} ต่ออายุทุก refresh_loop
+# worker ตาย (ไม่ต่ออายุเกิน PRIZE_LEASE_TTL_SECONDS) -> worker อื่นคืนส่วนที่ยังไม่แจกเข้า remaining
+#   ส่วนที่แจกแล้ว = players ที่มี lease_owner = owner นั้น (record ของรางวัลที่มี stock ติด owner ไว้)
+#   (write-behind: record ที่ค้างใน journal ของ worker ที่ตายยังไม่ถูกนับจนกว่าจะ replay -> TTL ควรยาวกว่าเวลา restart)
+
+PRIZES_FILE = os.getenv("PRIZES_FILE", "prizes.json")
+LEASE_SIZE = max(1, int(os.getenv("PRIZE_LEASE_SIZE", "5")))
+REFRESH_SECONDS = float(os.getenv("PRIZE_REFRESH_SECONDS", "10"))
+LEASE_TTL = float(os.getenv("PRIZE_LEASE_TTL_SECONDS", "120"))
+# ใช้เป็นชื่อ field ใน Mongo -> ห้ามมี "."
+OWNER = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}".replace(".", "_").replace("$", "_")
+
+_config = {"default": {"weight": 1, "stock": None}}
+_leases = {}      # (gender, filename) -> ชิ้นที่ worker นี้จองไว้แล้ว
+_granted = set()  # (gender, filename) ที่ worker นี้มี leases.<OWNER> ใน Mongo
+_depleted = set() # (gender, filename) ที่ Mongo บอกว่าหมด
+_tables = {}      # gender -> {"source": entries tuple, "cards": [...], "prob": [...], "alias": [...]}
+_stats = {"draws": 0, "lease_requests": 0, "rebuilds": 0, "out_of_stock": 0, "reclaimed": 0}
+
+def load_config():
+    """อ่าน PRIZES_FILE (ไม่มีไฟล์ = ทุกรูป weight 1 ไม่จำกัด stock)"""
+    global _config
+    if not os.path.isfile(PRIZES_FILE):
+        return _config
+    with open(PRIZES_FILE, encoding="utf-8") as f:
+        config = json.load(f)
+    config.setdefault("default", {"weight": 1, "stock": None})
+    _config = config
+    _tables.clear()
+    print(f"🎁 Prize config loaded from {PRIZES_FILE}")
+    return _config
+
+def card_config(gender: str, filename: str):
+    default = _config["default"]
+    card = _config.get(gender, {}).get(filename, {})
+    return {"weight": card.get("weight", default.get("weight", 1)), "stock": card.get("stock", default.get("stock"))}
+
+def _key(gender: str, filename: str):
+    return f"{gender}/{filename}"
+
+# --- Alias table (Vose) ---
+
+def build_alias(weights):
+    n = len(weights)
+    total = float(sum(weights))
+    prob = [w * n / total for w in weights]
+    alias = [0] * n
+    small = [i for i, p in enumerate(prob) if p < 1.0]
+    large = [i for i, p in enumerate(prob) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        alias[s] = l
+        prob[l] = prob[l] + prob[s] - 1.0
+        (small if prob[l] < 1.0 else large).append(l)
+    for i in small + large:
+        prob[i] = 1.0
+    return prob, alias
+
+def _rebuild(gender: str, entries):
+    cards, weights = [], []
+    for entry in entries:
+        weight = card_config(gender, entry.filename)["weight"]
+        if weight > 0 and (gender, entry.filename) not in _depleted:
+            cards.append(entry.filename)
+            weights.append(weight)
+    prob, alias = build_alias(weights) if cards else ([], [])
+    _tables[gender] = {"source": entries, "cards": cards, "prob": prob, "alias": alias}
+    _stats["rebuilds"] += 1
+    return _tables[gender]
+
+def _table(gender: str):
+    """ใช้ table เดิมจนกว่า catalogue (tuple ใหม่) หรือรายการที่หมดจะเปลี่ยน"""
+    entries = image_catalog.entries(gender)
+    table = _tables.get(gender)
+    if table is None or table["source"] is not entries:
+        table = _rebuild(gender, entries)
+    return table
+
+def _sample(table):
+    i = random.randrange(len(table["cards"]))
+    return table["cards"][i] if random.random() < table["prob"][i] else table["cards"][table["alias"][i]]
+
+# --- Stock ---
+
+async def _request_lease(gender: str, filename: str):
+    """จอง LEASE_SIZE ชิ้น (ถ้าเหลือไม่พอ ขอทีละชิ้น); คืนจำนวนที่ได้"""
+    for size in sorted({LEASE_SIZE, 1}, reverse=True):
+        _stats["lease_requests"] += 1
+        doc = await prize_stock.find_one_and_update(
+            {"_id": _key(gender, filename), "remaining": {"$gte": size}},
+            {"$inc": {"remaining": -size, f"leases.{OWNER}.granted": size},
+             "$set": {f"leases.{OWNER}.expires_at": datetime.now() + timedelta(seconds=LEASE_TTL)}},
+            projection={"_id": 0, "remaining": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is not None:
+            _granted.add((gender, filename))
+            return size
+    return 0
+
+def _mark_depleted(gender: str, filename: str):
+    _depleted.add((gender, filename))
+    _tables.pop(gender, None)
+
+async def draw(gender: str):
+    """สุ่มรูปตาม weight จากรูปที่ยังมีของ; None = หมดทุกใบ"""
+    while True:
+        table = _table(gender)
+        if not table["cards"]:
+            _stats["out_of_stock"] += 1
+            return None
+        filename = _sample(table)
+        if card_config(gender, filename)["stock"] is None:
+            _stats["draws"] += 1
+            return filename
+
+        card = (gender, filename)
+        if _leases.get(card, 0) <= 0:
+            granted = await _request_lease(gender, filename)
+            if not granted:
+                # หมดใน Mongo -> เอาออกจาก table แล้วสุ่มใหม่
+                _mark_depleted(gender, filename)
+                continue
+            _leases[card] = _leases.get(card, 0) + granted
+        _leases[card] -= 1
+        _stats["draws"] += 1
+        return filename
+
+def lease_tag(gender: str, filename: str):
+    """field ที่ใส่ใน player record: บอกว่ารางวัลชิ้นนี้มาจาก lease ของ worker ไหน (ใช้ตอน reclaim)"""
+    return {"lease_owner": OWNER} if card_config(gender, filename)["stock"] is not None else {}
+
+def release(gender: str, filename: str):
+    """คืนชิ้นที่จองไปแต่ไม่ได้แจก (เช่น เล่นไปแล้ว / error) เข้า lease ใน memory"""
+    if filename and card_config(gender, filename)["stock"] is not None:
+        card = (gender, filename)
+        _leases[card] = _leases.get(card, 0) + 1
+        if card in _depleted:
+            _depleted.discard(card)
+            _tables.pop(gender, None)
+
+async def return_leases():
+    """Shutdown: คืน lease ที่ยังไม่ได้แจกกลับเข้า Mongo แล้วลบ lease ของ worker นี้"""
+    ops = [UpdateOne({"_id": _key(g, f)}, {"$inc": {"remaining": max(_leases.get((g, f), 0), 0)},
+                                           "$unset": {f"leases.{OWNER}": ""}})
+           for g, f in _granted | set(_leases)]
+    if ops:
+        await prize_stock.bulk_write(ops, ordered=False)
+    _leases.clear()
+    _granted.clear()
+
+async def renew_leases():
+    """ต่ออายุ lease ของ worker นี้ (เรียกจาก refresh_loop ถี่กว่า LEASE_TTL)"""
+    expires_at = datetime.now() + timedelta(seconds=LEASE_TTL)
+    ops = [UpdateOne({"_id": _key(g, f), f"leases.{OWNER}": {"$exists": True}},
+                     {"$set": {f"leases.{OWNER}.expires_at": expires_at}}) for g, f in _granted]
+    if ops:
+        await prize_stock.bulk_write(ops, ordered=False)
+
+async def reclaim_expired():
+    """คืนชิ้นที่ยังไม่แจกจาก lease ของ worker ที่หายไป (ไม่ต่ออายุ) เข้า remaining; คืนจำนวนชิ้น"""
+    now = datetime.now()
+    reclaimed = 0
+    async for doc in prize_stock.find({"leases": {"$exists": True}}, {"gender": 1, "image_file": 1, "leases": 1}):
+        for owner, lease in list((doc.get("leases") or {}).items()):
+            if owner == OWNER or lease.get("expires_at") is None or lease["expires_at"] >= now:
+                continue
+            given = await players.count_documents({"gender": doc.get("gender"), "image_file": doc.get("image_file"),
+                                                   "lease_owner": owner})
+            unused = max(0, lease.get("granted", 0) - given)
+            # เงื่อนไข expires_at เดิม -> worker อื่น reclaim ไปแล้ว / เจ้าของกลับมาต่ออายุ = ไม่ทำซ้ำ
+            taken = await prize_stock.find_one_and_update(
+                {"_id": doc["_id"], f"leases.{owner}.expires_at": lease["expires_at"]},
+                {"$inc": {"remaining": unused}, "$unset": {f"leases.{owner}": ""}},
+            )
+            if taken is not None and unused:
+                reclaimed += unused
+                print(f"♻️ Reclaimed {unused} unused {doc['_id']} from expired lease {owner}")
+    _stats["reclaimed"] += reclaimed
+    return reclaimed
+
+async def seed_stock():
+    """สร้าง prize_stock ของรูปที่มี stock (idempotent: ไม่ทับ remaining เดิม)"""
+    ops = []
+    for gender in image_catalog.GENDERS:
+        for entry in image_catalog.entries(gender):
+            stock = card_config(gender, entry.filename)["stock"]
+            if stock is None:
+                continue
+            ops.append(UpdateOne(
+                {"_id": _key(gender, entry.filename)},
+                {"$setOnInsert": {"remaining": stock, "stock": stock},
+                 "$set": {"gender": gender, "image_file": entry.filename}},
+                upsert=True,
+            ))
+    if ops:
+        await prize_stock.bulk_write(ops, ordered=False)
+    await refresh_depleted()
+    return len(ops)
+
+async def refresh_depleted():
+    """อ่าน remaining ใหม่ (เช่น admin เติมของ) แล้วเปิดรูปที่กลับมามีของ / ปิดรูปที่หมด"""
+    changed = set()
+    async for doc in prize_stock.find({}, {"gender": 1, "image_file": 1, "remaining": 1}):
+        card = (doc.get("gender"), doc.get("image_file"))
+        empty = doc.get("remaining", 0) <= 0 and _leases.get(card, 0) <= 0
+        if empty != (card in _depleted):
+            (_depleted.add if empty else _depleted.discard)(card)
+            changed.add(card[0])
+    for gender in changed:
+        _tables.pop(gender, None)
+
+async def refresh_loop():
+    """Background: seed รูปใหม่ (catalogue reload) + sync รายการที่หมด/เติม จาก Mongo"""
+    while True:
+        await asyncio.sleep(REFRESH_SECONDS)
+        try:
+            await renew_leases()
+            await reclaim_expired()
+            await seed_stock()
+        except PyMongoError as e:
+            print(f"⚠️ Prize stock refresh failed: {e}")
+
+async def restock(gender: str, filename: str, add: int):
+    """เติมของ (add > 0 ตรวจที่ endpoint)"""
+    doc = await prize_stock.find_one_and_update(
+        {"_id": _key(gender, filename)},
+        {"$inc": {"remaining": add, "stock": add}, "$set": {"gender": gender, "image_file": filename}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    await refresh_depleted()
+    return doc
+
+async def inventory():
+    """ทุกรูป: weight / stock / remaining (Mongo) / leased (worker นี้)"""
+    stock_docs = {doc["_id"]: doc async for doc in prize_stock.find({})}
+    result = {}
+    for gender in image_catalog.GENDERS:
+        cards = []
+        for entry in image_catalog.entries(gender):
+            config = card_config(gender, entry.filename)
+            doc = stock_docs.get(_key(gender, entry.filename), {})
+            cards.append({
+                "image_file": entry.filename,
+                "weight": config["weight"],
+                "stock": doc.get("stock", config["stock"]),
+                "remaining": doc.get("remaining"),
+                "leased": _leases.get((gender, entry.filename), 0),
+                "available": (gender, entry.filename) not in _depleted,
+            })
+        result[gender] = cards
+    return result
+
+def engine_stats():
+    return {
+        **_stats,
+        "available": {gender: len(_table(gender)["cards"]) for gender in image_catalog.GENDERS},
+        "depleted": len(_depleted),
+        "leased": sum(_leases.values()),
+        "lease_size": LEASE_SIZE,
+        "lease_owner": OWNER,
+    }
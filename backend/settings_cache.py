@@ -0,0 +1,77 @@
+import os
+import time
+import asyncio
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from database import settings
+
+# --- In-process cache ของ system_status ---
+# /api/play อ่านค่าจาก memory อย่างเดียว, ค่าถูก sync จาก Mongo ผ่าน change stream
+# (ถ้า Mongo เป็น replica set) หรือ polling ทุก SETTINGS_CACHE_TTL วินาที
+# ทำให้หลาย uvicorn worker เห็นค่าตรงกันภายในไม่เกิน TTL
+
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "2"))
+
+_state = {"is_active": False, "loaded_at": 0.0, "source": "default"}
+
+def is_system_active() -> bool:
+    """Hot path: ไม่มี I/O"""
+    return _state["is_active"]
+
+def cache_info():
+    return {
+        "is_active": _state["is_active"],
+        "age_s": round(time.monotonic() - _state["loaded_at"], 3) if _state["loaded_at"] else None,
+        "source": _state["source"],
+    }
+
+def _apply(doc, source: str):
+    _state["is_active"] = bool(doc.get("is_active", False)) if doc else False
+    _state["loaded_at"] = time.monotonic()
+    _state["source"] = source
+
+async def refresh_settings():
+    doc = await settings.find_one({"key": "system_status"})
+    _apply(doc, "poll")
+    return _state["is_active"]
+
+async def toggle_system_status() -> bool:
+    """Flip แบบ atomic ใน Mongo แล้วอัปเดต cache ทันที"""
+    doc = await settings.find_one_and_update(
+        {"key": "system_status"},
+        [{"$set": {"is_active": {"$not": [{"$ifNull": ["$is_active", False]}]}}}],
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    _apply(doc, "write")
+    return _state["is_active"]
+
+async def _watch_change_stream():
+    pipeline = [{"$match": {"fullDocument.key": "system_status"}}]
+    async with await settings.watch(pipeline, full_document="updateLookup") as stream:
+        print("📡 Settings cache: change stream active")
+        await refresh_settings()
+        async for change in stream:
+            _apply(change.get("fullDocument"), "change_stream")
+
+async def _poll_loop():
+    print(f"🔁 Settings cache: polling every {SETTINGS_CACHE_TTL}s")
+    while True:
+        try:
+            await refresh_settings()
+        except PyMongoError as e:
+            print(f"⚠️ Settings refresh failed: {e}")
+        await asyncio.sleep(SETTINGS_CACHE_TTL)
+
+async def settings_sync_loop():
+    """Background task: ใช้ change stream ถ้าได้, ไม่งั้น fallback เป็น polling"""
+    try:
+        await refresh_settings()
+    except PyMongoError as e:
+        print(f"⚠️ Settings initial load failed: {e}")
+    try:
+        await _watch_change_stream()
+    except PyMongoError as e:
+        # Standalone mongod ไม่รองรับ change stream
+        print(f"ℹ️ Change stream unavailable ({type(e).__name__}) -> polling fallback")
+    await _poll_loop()
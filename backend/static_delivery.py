@@ -0,0 +1,220 @@
+import os
+import asyncio
+import hashlib
+import mimetypes
+from collections import OrderedDict, namedtuple
+from fastapi import Request
+from fastapi.responses import Response, FileResponse
+from metrics import stage
+
+# --- Static Delivery ---
+# เสิร์ฟไฟล์ (รูป gacha + ไฟล์ SPA) พร้อม ETag/304, Cache-Control, Range
+# และ pre-compressed (.br/.gz) ของ frontend bundle ถ้ามี
+# ไฟล์ที่ถูกเรียกบ่อยเก็บใน LRU (memory) ไม่ต้องอ่าน disk ซ้ำ
+
+STATIC_DIR = os.getenv("STATIC_DIR", "/app/static")
+LRU_MAX_BYTES = int(os.getenv("STATIC_LRU_MAX_BYTES", str(64 * 1024 * 1024)))
+LRU_MAX_FILE_BYTES = int(os.getenv("STATIC_LRU_MAX_FILE_BYTES", str(8 * 1024 * 1024)))
+
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "no-cache"
+CACHE_SHORT = "public, max-age=3600"
+
+# ลำดับความสำคัญของ encoding ที่ลองเสิร์ฟ
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+StaticEntry = namedtuple("StaticEntry", ["path", "size", "mtime", "etag", "content_type", "variants"])
+
+_index = {}
+_lru = OrderedDict()
+_lru_state = {"bytes": 0, "hits": 0, "misses": 0}
+_loading = {}  # (path, mtime) -> future ของการอ่านที่กำลังทำอยู่
+
+# --- File Index (SPA) ---
+
+def file_etag(path: str):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return f'"{digest.hexdigest()[:20]}"'
+
+def make_entry(path: str, etag: str = None, content_type: str = None, variants=None):
+    st = os.stat(path)
+    return StaticEntry(
+        path=path,
+        size=st.st_size,
+        mtime=st.st_mtime,
+        etag=etag or file_etag(path),
+        content_type=content_type or mimetypes.guess_type(path)[0] or "application/octet-stream",
+        variants=variants or {},
+    )
+
+def load_static_index():
+    """Scan STATIC_DIR ครั้งเดียวตอน startup (ไฟล์ build ไม่เปลี่ยนระหว่างรัน)"""
+    index = {}
+    if os.path.isdir(STATIC_DIR):
+        for root, _, files in os.walk(STATIC_DIR):
+            for filename in files:
+                if filename.endswith((".br", ".gz")):
+                    continue
+                path = os.path.join(root, filename)
+                content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                variants = {}
+                for encoding, suffix in PRECOMPRESSED:
+                    if os.path.isfile(path + suffix):
+                        variants[encoding] = make_entry(path + suffix, content_type=content_type)
+                rel = os.path.relpath(path, STATIC_DIR).replace(os.sep, "/")
+                index[rel] = make_entry(path, content_type=content_type, variants=variants)
+    _index.clear()
+    _index.update(index)
+    print(f"📦 Static index loaded: {len(index)} files")
+    return len(index)
+
+def lookup_static(rel_path: str):
+    return _index.get(rel_path)
+
+# --- LRU of hot files ---
+
+def _read_file(path: str, start: int = 0, length: int = -1):
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+async def get_cached_bytes(entry: StaticEntry):
+    """คืน bytes จาก LRU; None ถ้าไฟล์ใหญ่เกิน LRU_MAX_FILE_BYTES"""
+    if entry.size > LRU_MAX_FILE_BYTES:
+        return None
+    cached = _lru.get(entry.path)
+    if cached and cached[0] == entry.mtime:
+        _lru.move_to_end(entry.path)
+        _lru_state["hits"] += 1
+        return cached[1]
+
+    _lru_state["misses"] += 1
+    # miss พร้อมกันหลาย request (เช่นตอนเปิดผล) -> อ่าน disk ครั้งเดียวแล้วรอผลเดียวกัน
+    key = (entry.path, entry.mtime)
+    loading = _loading.get(key)
+    if loading is None:
+        loading = _loading[key] = asyncio.ensure_future(_load(entry))
+        loading.add_done_callback(lambda _: _loading.pop(key, None))
+    return await asyncio.shield(loading)
+
+async def _load(entry: StaticEntry):
+    with stage("fs"):
+        data = await asyncio.to_thread(_read_file, entry.path)
+    # อ่านใหม่หลัง await: entry อาจถูกแทน/ไล่ออกไประหว่างรอ
+    cached = _lru.pop(entry.path, None)
+    if cached:
+        _lru_state["bytes"] -= len(cached[1])
+    _lru[entry.path] = (entry.mtime, data)
+    _lru_state["bytes"] += len(data)
+    while _lru_state["bytes"] > LRU_MAX_BYTES and _lru:
+        _, (_, evicted) = _lru.popitem(last=False)
+        _lru_state["bytes"] -= len(evicted)
+    return data
+
+def lru_stats():
+    return {"files": len(_lru), **_lru_state}
+
+# --- HTTP negotiation ---
+
+def _etag_matches(header: str, etag: str):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return etag in candidates
+
+def _parse_range(header: str, size: int):
+    """Single byte range เท่านั้น; คืน (start, end) / None (ไม่มี/ไม่รองรับ) / False (416)"""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[6:].strip().partition("-")
+    try:
+        if start_s == "":
+            length = int(end_s)
+            if length <= 0:
+                return False
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return False
+    return start, min(end, size - 1)
+
+def parse_accept(accept: str):
+    """Accept / Accept-Encoding header -> {token: q} (q=0 = ไม่รับ)"""
+    prefs = {}
+    for part in (accept or "").split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        prefs[media_type.lower()] = q
+    return prefs
+
+def _pick_variant(request: Request, entry: StaticEntry):
+    """เลือก encoding ที่ q สูงสุด (เท่ากันเรียงตาม PRECOMPRESSED); q=0 หรือไม่ได้ระบุ (และไม่มี *) = ไม่รับ"""
+    if not entry.variants:
+        return entry, None
+    prefs = parse_accept(request.headers.get("accept-encoding", ""))
+    best, best_q = None, 0.0
+    for encoding, _ in PRECOMPRESSED:
+        q = prefs.get(encoding, prefs.get("*", 0.0))
+        if encoding in entry.variants and q > best_q:
+            best, best_q = encoding, q
+    if best is None:
+        return entry, None
+    return entry.variants[best], best
+
+async def serve_entry(request: Request, entry: StaticEntry, cache_control: str, vary: str = None):
+    """ETag/304 + Range + pre-compressed + LRU สำหรับไฟล์ใน index"""
+    body_entry, encoding = _pick_variant(request, entry)
+    headers = {
+        "ETag": body_entry.etag,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    if entry.variants:
+        vary = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+    if vary:
+        headers["Vary"] = vary
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    if _etag_matches(request.headers.get("if-none-match"), body_entry.etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not encoding and (not if_range or if_range == body_entry.etag):
+        byte_range = _parse_range(request.headers.get("range"), body_entry.size)
+    if byte_range is False:
+        headers["Content-Range"] = f"bytes */{body_entry.size}"
+        return Response(status_code=416, headers=headers)
+
+    data = await get_cached_bytes(body_entry)
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{body_entry.size}"
+        if data is None:
+            with stage("fs"):
+                chunk = await asyncio.to_thread(_read_file, body_entry.path, start, end - start + 1)
+        else:
+            chunk = data[start:end + 1]
+        return Response(chunk, status_code=206, media_type=entry.content_type, headers=headers)
+    if data is None:
+        return FileResponse(body_entry.path, media_type=entry.content_type, headers=headers)
+    return Response(data, media_type=entry.content_type, headers=headers)
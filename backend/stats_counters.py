@@ -0,0 +1,174 @@
+import os
+import asyncio
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, ReplaceOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from database import players, event_stats
+
+# --- Event Statistics (incremental counters) ---
+# /api/admin/stats อ่านจาก event_stats (document ละ 1 counter) แทนการ scan players
+#   {"_id": "gender:male", "kind": "gender", "key": "male", "count": n}
+#   kind = total / gender / lang / image / minute (minute มี bucket = เวลาที่ตัดเหลือนาที)
+# play_gacha / delete_history เพิ่ม-ลด delta ใน memory (O(1), ไม่มี round trip)
+# แล้ว flush_loop ส่งเป็น $inc แบบ bulk ทุก STATS_FLUSH_INTERVAL_MS (atomic ต่อ counter, ข้าม worker ได้)
+# ตัวเลขเพี้ยน (crash ก่อน flush / record ชนตอน write-behind flush) -> rebuild() นับใหม่จาก players
+
+FLUSH_INTERVAL = int(os.getenv("STATS_FLUSH_INTERVAL_MS", "250")) / 1000.0
+DEFAULT_WINDOW_MINUTES = 60
+
+_delta = {}  # _id -> (fields, amount)
+_flush_lock = None
+_rebuild_cutoff = None  # ระหว่าง rebuild: play ที่ played_at < cutoff นับโดย aggregation แล้ว
+
+def _minute(ts: datetime):
+    return ts.replace(second=0, microsecond=0)
+
+def _counters(doc: dict, lang: str = None):
+    """(_id, fields) ของทุก counter ที่ play หนึ่งครั้งกระทบ"""
+    gender = doc.get("gender")
+    image_file = doc.get("image_file")
+    lang = lang or doc.get("lang")
+    items = [("total:plays", {"kind": "total", "key": "plays"})]
+    if gender:
+        items.append((f"gender:{gender}", {"kind": "gender", "key": gender}))
+    if lang:
+        items.append((f"lang:{lang}", {"kind": "lang", "key": lang}))
+    if gender and image_file:
+        key = f"{gender}/{image_file}"
+        items.append((f"image:{key}", {"kind": "image", "key": key, "gender": gender, "image_file": image_file}))
+    if doc.get("played_at"):
+        bucket = _minute(doc["played_at"])
+        items.append((f"minute:{bucket.isoformat()}", {"kind": "minute", "key": bucket.isoformat(), "bucket": bucket}))
+    return items
+
+def _add(doc: dict, amount: int, lang: str = None):
+    if _rebuild_cutoff and doc.get("played_at") and doc["played_at"] < _rebuild_cutoff:
+        return
+    for _id, fields in _counters(doc, lang):
+        prev = _delta.get(_id)
+        _delta[_id] = (fields, (prev[1] if prev else 0) + amount)
+
+def record_play(doc: dict, lang: str = None):
+    _add(doc, 1, lang)
+
+def record_delete(doc: dict):
+    _add(doc, -1)
+
+def _lock():
+    global _flush_lock
+    if _flush_lock is None:
+        _flush_lock = asyncio.Lock()
+    return _flush_lock
+
+def _restore(items):
+    for _id, (fields, amount) in items:
+        prev = _delta.get(_id)
+        _delta[_id] = (fields, (prev[1] if prev else 0) + amount)
+
+async def flush():
+    """ส่ง delta ที่สะสมเป็น $inc (upsert) รอบเดียว; ล้มเหลว -> คืนเฉพาะ op ที่ไม่สำเร็จเข้าไปรอบหน้า"""
+    async with _lock():
+        if not _delta:
+            return
+        items = [(_id, entry) for _id, entry in _delta.items() if entry[1]]
+        _delta.clear()
+        ops = [UpdateOne({"_id": _id}, {"$inc": {"count": amount}, "$set": fields}, upsert=True)
+               for _id, (fields, amount) in items]
+        try:
+            if ops:
+                await event_stats.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # ordered=False: op อื่นสำเร็จไปแล้ว -> คืนแค่ตัวที่ error (ไม่งั้นนับซ้ำ)
+            _restore(items[err["index"]] for err in e.details.get("writeErrors", []))
+            raise
+        except PyMongoError:
+            _restore(items)
+            raise
+
+async def flush_loop():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await flush()
+        except PyMongoError as e:
+            print(f"⚠️ Stats flush failed (will retry): {e}")
+
+async def get_stats(window_minutes: int = DEFAULT_WINDOW_MINUTES):
+    """Counter ทั้งหมด + plays ต่อนาทีย้อนหลัง window_minutes (รวม delta ที่ยังไม่ flush ของ worker นี้)"""
+    since = _minute(datetime.now()) - timedelta(minutes=window_minutes - 1)
+    docs = await event_stats.find({"$or": [
+        {"kind": {"$ne": "minute"}},
+        {"kind": "minute", "bucket": {"$gte": since}},
+    ]}).to_list(length=None)
+
+    counts = {doc["_id"]: (doc, doc.get("count", 0)) for doc in docs}
+    for _id, (fields, amount) in _delta.items():
+        doc, count = counts.get(_id, ({"_id": _id, **fields}, 0))
+        if fields["kind"] != "minute" or fields["bucket"] >= since:
+            counts[_id] = (doc, count + amount)
+
+    result = {"total_plays": 0, "by_gender": {}, "by_lang": {}, "by_image": {}, "plays_per_minute": []}
+    for doc, count in counts.values():
+        kind = doc["kind"]
+        if kind == "total":
+            result["total_plays"] = count
+        elif kind == "gender":
+            result["by_gender"][doc["key"]] = count
+        elif kind == "lang":
+            result["by_lang"][doc["key"]] = count
+        elif kind == "image":
+            result["by_image"].setdefault(doc["gender"], {})[doc["image_file"]] = count
+        elif kind == "minute" and count:
+            result["plays_per_minute"].append({"minute": doc["bucket"], "plays": count})
+    result["plays_per_minute"].sort(key=lambda b: b["minute"])
+    return result
+
+async def rebuild():
+    """ซ่อม counter: นับใหม่จาก players ด้วย aggregation รอบเดียว แล้วแทนที่ event_stats
+    นับเฉพาะ played_at < cutoff; delta ใน worker นี้ล้างพร้อมตั้ง cutoff (ไม่มี await คั่น) -> ไม่นับซ้ำ
+    เขียนแบบ ReplaceOne upsert แล้วค่อยลบ counter ที่ไม่มีแล้ว -> flush ของ worker อื่นที่แทรกเข้ามาไม่ทำให้ล้ม"""
+    global _rebuild_cutoff
+    async with _lock():
+        cutoff = datetime.now()
+        _rebuild_cutoff = cutoff
+        _delta.clear()
+        try:
+            cursor = await players.aggregate([{"$match": {"played_at": {"$lt": cutoff}}}, {"$facet": {
+                "gender": [{"$group": {"_id": "$gender", "count": {"$sum": 1}}}],
+                "lang": [{"$match": {"lang": {"$exists": True}}}, {"$group": {"_id": "$lang", "count": {"$sum": 1}}}],
+                "image": [{"$group": {"_id": {"gender": "$gender", "image_file": "$image_file"}, "count": {"$sum": 1}}}],
+                "minute": [{"$group": {"_id": {"$dateTrunc": {"date": "$played_at", "unit": "minute"}}, "count": {"$sum": 1}}}],
+            }}])
+            facets = (await cursor.to_list(length=1))[0]
+            docs = _rebuilt_docs(facets)
+            ids = [doc["_id"] for doc in docs]
+            await event_stats.bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs],
+                                         ordered=False)
+            # ไม่ลบ minute bucket ตั้งแต่ cutoff (play ใหม่ที่ worker อื่น flush เข้ามาแล้ว)
+            await event_stats.delete_many({"_id": {"$nin": ids}, "$or": [
+                {"kind": {"$ne": "minute"}},
+                {"bucket": {"$lt": _minute(cutoff)}},
+            ]})
+            return len(docs)
+        finally:
+            _rebuild_cutoff = None
+
+def _rebuilt_docs(facets: dict):
+    docs = [{"_id": "total:plays", "kind": "total", "key": "plays",
+             "count": sum(g["count"] for g in facets["gender"])}]
+    for g in facets["gender"]:
+        if g["_id"]:
+            docs.append({"_id": f"gender:{g['_id']}", "kind": "gender", "key": g["_id"], "count": g["count"]})
+    for g in facets["lang"]:
+        docs.append({"_id": f"lang:{g['_id']}", "kind": "lang", "key": g["_id"], "count": g["count"]})
+    for g in facets["image"]:
+        gender, image_file = g["_id"].get("gender"), g["_id"].get("image_file")
+        if gender and image_file:
+            key = f"{gender}/{image_file}"
+            docs.append({"_id": f"image:{key}", "kind": "image", "key": key,
+                         "gender": gender, "image_file": image_file, "count": g["count"]})
+    for g in facets["minute"]:
+        if g["_id"]:
+            docs.append({"_id": f"minute:{g['_id'].isoformat()}", "kind": "minute",
+                         "key": g["_id"].isoformat(), "bucket": g["_id"], "count": g["count"]})
+    return docs
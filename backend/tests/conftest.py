@@ -0,0 +1,5 @@
+import os
+import sys
+
+# backend ใช้ import แบบ flat (uvicorn main:app จากโฟลเดอร์ backend)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,46 @@
+import asyncio
+import pytest
+import admission
+
+def test_token_bucket_burst_then_refill():
+    buckets = admission.TokenBuckets(per_minute=60, burst=3)
+    assert [buckets.take("ip", now=0.0) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("ip", now=0.0) == pytest.approx(1.0)
+    assert buckets.take("ip", now=1.0) == 0
+    assert buckets.take("other", now=1.0) == 0  # key อื่นไม่กระทบกัน
+
+def test_token_bucket_is_bounded_lru():
+    buckets = admission.TokenBuckets(per_minute=60, burst=1, max_keys=2)
+    buckets.take("a", now=0.0)
+    buckets.take("b", now=0.0)
+    buckets.take("a", now=0.0)  # a ใช้ล่าสุด -> b ถูกไล่ก่อน
+    buckets.take("c", now=0.0)
+    assert len(buckets) == 2
+    assert buckets.take("b", now=0.0) == 0  # b กลับมาเป็น bucket ใหม่ (เต็ม)
+
+def test_local_limiter_counts_rejections(monkeypatch):
+    monkeypatch.setitem(admission.RULES, "play", (60.0, 2))
+    limiter = admission.LocalLimiter()
+
+    async def run():
+        return [await limiter.check("play", "ip") for _ in range(3)]
+    waits = asyncio.run(run())
+    assert waits[:2] == [0.0, 0.0] and waits[2] > 0
+    assert limiter.stats()["rejected"]["play"] == 1
+
+def test_gate_rejects_when_queue_full_and_on_timeout():
+    gate = admission.ConcurrencyGate(limit=1, max_queue=1, timeout=0.05)
+
+    async def run():
+        await gate.acquire()
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(admission.Saturated) as full:
+            await gate.acquire()
+        with pytest.raises(admission.Saturated):
+            await waiter
+        gate.release()
+        await gate.acquire()  # ว่างแล้วเข้าได้ทันที
+        return full.value.position
+    assert asyncio.run(run()) == 2
+    assert gate.stats() == {"limit": 1, "in_flight": 1, "waiting": 0, "max_queue": 1, "rejected": 2}
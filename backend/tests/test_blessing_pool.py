@@ -0,0 +1,25 @@
+import importlib
+import pytest
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setenv("BLESSING_POOL_REUSE", "5")
+    import blessing_pool
+    return importlib.reload(blessing_pool)
+
+def test_only_popped_templates_are_released(pool):
+    key = ("th", "male")
+    pool._add(key, "สวัสดี {name}")
+    first = pool.acquire("th", "male")
+    reused = pool.acquire("th", "male")  # pool ว่าง -> ใช้ template ล่าสุดซ้ำ
+    assert first == ("สวัสดี {name}", True) and reused == ("สวัสดี {name}", False)
+    pool.release("th", "male", *reused)
+    assert len(pool._buckets[key]) == 0
+    pool.release("th", "male", *first)
+    assert list(pool._buckets[key]) == ["สวัสดี {name}"]
+    assert pool.pool_stats()["released"] == 1
+
+def test_template_without_placeholder_is_discarded(pool):
+    pool._add(("en", "female"), "Hello friend")
+    assert pool.acquire("en", "female") == (None, False)
+    assert pool.pool_stats()["invalid"] == 1 and pool.pool_stats()["generated"] == 0
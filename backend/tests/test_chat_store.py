@@ -0,0 +1,45 @@
+import asyncio
+from datetime import datetime
+import pytest
+import chat_store
+from bench_fakes import FakeCollection, Latency
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    monkeypatch.setattr(chat_store, "chats", FakeCollection("chats", Latency(0)))
+    monkeypatch.setattr(chat_store, "chat_messages", FakeCollection("chat_messages", Latency(0)))
+    monkeypatch.setattr(chat_store, "_migrated", False)
+    monkeypatch.setattr(chat_store.write_behind, "ENABLED", False)
+
+def test_append_migrates_legacy_room_before_startup_migration():
+    legacy = [{"sender": "user", "text": f"old {i}", "timestamp": datetime(2026, 1, 1)} for i in range(3)]
+
+    async def run():
+        await chat_store.chats.insert_one({"session_id": "s", "messages": legacy, "is_read": False})
+        event = await chat_store.append_message("s", "user", "new", name="A")
+        await chat_store.migrate_embedded_messages()  # startup มาถึงทีหลัง: ห้องนี้ย้ายไปแล้ว
+        return event
+    event = asyncio.run(run())
+    assert event["seq"] == 3
+    seqs = sorted(m["seq"] for m in chat_store.chat_messages._docs)
+    assert seqs == [0, 1, 2, 3]
+    room = chat_store.chats._docs[0]
+    assert "messages" not in room and room["message_count"] == 4 and room["unread_count"] == 4
+
+def test_contiguous_waits_for_recent_gap_only():
+    now = datetime.now()
+    old = now - chat_store.GAP_GRACE * 2
+    fresh = [{"seq": 1, "timestamp": now}, {"seq": 3, "timestamp": now}]
+    assert [m["seq"] for m in chat_store.contiguous(fresh, 0)] == [1]  # seq 2 ยัง insert ไม่เสร็จ
+    stale = [{"seq": 1, "timestamp": old}, {"seq": 3, "timestamp": old}]
+    assert [m["seq"] for m in chat_store.contiguous(stale, 0)] == [1, 3]  # seq 2 หายถาวร ข้ามได้
+    assert chat_store.contiguous([{"seq": 5, "timestamp": now}], 0) == []
+
+def test_load_messages_stops_at_gap():
+    now = datetime.now()
+
+    async def run():
+        await chat_store.chat_messages.insert_many(
+            [{"session_id": "s", "seq": seq, "text": str(seq), "timestamp": now} for seq in (0, 1, 3)])
+        return await chat_store.load_messages("s", after=-1)
+    assert [m["seq"] for m in asyncio.run(run())] == [0, 1]
@@ -0,0 +1,36 @@
+import asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+import pytest
+from database import encode_keyset_cursor, decode_keyset_cursor, keyset_query
+from bench_fakes import FakeCollection, Latency
+
+def test_cursor_round_trip():
+    ts, oid = datetime(2026, 1, 1, 12, 0, 0, 123456), ObjectId()
+    assert decode_keyset_cursor(encode_keyset_cursor(ts, oid)) == (ts, oid)
+
+@pytest.mark.parametrize("cursor", ["", "2026-01-01T00:00:00", "2026-01-01|not-an-oid", "nope|" + "a" * 24])
+def test_bad_cursor_raises(cursor):
+    with pytest.raises((ValueError, InvalidId)):  # main.py แปลงเป็น 400
+        keyset_query("played_at", cursor)
+
+def test_keyset_pages_visit_every_doc_once_with_tied_timestamps():
+    players = FakeCollection("players", Latency(0))
+    base = datetime(2026, 1, 1)
+    # 3 คนต่อวินาที -> หน้าตัดกลางกลุ่มที่ played_at เท่ากัน
+    docs = [{"_id": ObjectId(), "played_at": base + timedelta(seconds=i // 3)} for i in range(20)]
+
+    async def run():
+        await players.insert_many(docs)
+        seen, cursor = [], None
+        while True:
+            query = keyset_query("played_at", cursor) if cursor else {}
+            page = await players.find(query).sort([("played_at", -1), ("_id", -1)]).limit(4).to_list(length=None)
+            seen += [doc["_id"] for doc in page]
+            if len(page) < 4:
+                return seen
+            cursor = encode_keyset_cursor(page[-1]["played_at"], page[-1]["_id"])
+    seen = asyncio.run(run())
+    expected = [d["_id"] for d in sorted(docs, key=lambda d: (d["played_at"], d["_id"]), reverse=True)]
+    assert seen == expected
@@ -0,0 +1,60 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+import pytest
+import exporter
+from bench_fakes import FakeCollection, Latency
+
+BASE = datetime(2026, 1, 1, 12, 0)
+
+@pytest.fixture(autouse=True)
+def players(monkeypatch):
+    collection = FakeCollection("players", Latency(0))
+    docs = [{"name": f"แฟน {i}", "gender": "male", "ip_hash": f"h{i}", "blessing": 'a "quoted", line\nnext',
+             "image_file": "A.png", "played_at": BASE + timedelta(minutes=i)} for i in range(7)]
+    asyncio.run(collection.insert_many(docs))
+    monkeypatch.setattr(exporter, "players", collection)
+    monkeypatch.setattr(exporter, "EXPORT_BATCH_SIZE", 3)  # หลาย batch
+    return collection
+
+def collect(fmt, query=None, gzip_output=False):
+    async def run():
+        return [chunk async for chunk in exporter.export_stream(fmt, query or {}, gzip=gzip_output)]
+    chunks = asyncio.run(run())
+    if gzip_output:
+        return gzip.decompress(b"".join(chunks)).decode("utf-8")
+    return "".join(chunks)
+
+def test_json_matches_single_document_shape():
+    body = json.loads(collect("json"))
+    assert body["status"] == "success"
+    assert [doc["ip_hash"] for doc in body["data"]] == [f"h{i}" for i in reversed(range(7))]
+    assert "_id" not in body["data"][0]
+
+def test_ndjson_one_record_per_line_with_date_range():
+    query = exporter.build_query(since=BASE + timedelta(minutes=2), until=BASE + timedelta(minutes=5))
+    lines = collect("ndjson", query).splitlines()
+    assert [json.loads(line)["ip_hash"] for line in lines] == ["h4", "h3", "h2"]
+
+def test_csv_has_bom_header_and_escaped_rows():
+    text = collect("csv")
+    assert text.startswith("\ufeff")
+    rows = list(csv.reader(io.StringIO(text[1:])))
+    assert rows[0] == [header for header, _ in exporter.CSV_COLUMNS]
+    assert len(rows) == 8
+    assert rows[1][0] == (BASE + timedelta(minutes=6)).isoformat()
+    assert rows[1][1] == "แฟน 6" and rows[1][5] == 'a "quoted", line\nnext'
+    assert rows[1][3] == ""  # ไม่มี ip_address -> ช่องว่าง
+
+@pytest.mark.parametrize("fmt", ["json", "ndjson", "csv"])
+def test_gzip_stream_decompresses_to_plain_output(fmt):
+    assert collect(fmt, gzip_output=True) == collect(fmt)
+
+def test_empty_export_is_still_valid():
+    query = exporter.build_query(since=BASE + timedelta(days=1))
+    assert json.loads(collect("json", query)) == {"status": "success", "data": []}
+    assert collect("ndjson", query) == ""
+    assert collect("csv", query).count("\n") == 1
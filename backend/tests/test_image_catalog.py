@@ -0,0 +1,43 @@
+import os
+import pytest
+import image_catalog
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    variants = tmp_path / "male" / image_catalog.VARIANTS_DIRNAME
+    variants.mkdir(parents=True)
+    (tmp_path / "male" / "A.png").write_bytes(b"p" * 100)
+    (tmp_path / "male" / "B.png").write_bytes(b"p" * 100)  # ไม่มี variant
+    for suffix, size in (("avif", 10), ("webp", 20), ("thumb.webp", 5)):
+        (variants / f"A.{suffix}").write_bytes(b"v" * size)
+    monkeypatch.setattr(image_catalog, "IMAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(image_catalog, "ASSETS_DIR", str(tmp_path / "missing"))
+    monkeypatch.setattr(image_catalog, "_catalog", {"entries": {}, "by_name": {}, "alternates": {}, "signature": None})
+    image_catalog.load_catalog()
+    return image_catalog
+
+def test_parse_accept_reads_q_values():
+    prefs = image_catalog.parse_accept("image/avif;q=0.9, image/webp, */*;q=0.1, image/png;q=bad, ;q=1")
+    assert prefs == {"image/avif": 0.9, "image/webp": 1.0, "*/*": 0.1, "image/png": 0.0}
+    assert image_catalog.parse_accept(None) == {}
+
+@pytest.mark.parametrize("accept,expected", [
+    ("image/avif,image/webp,*/*", "A.avif"),
+    ("image/avif;q=0.5,image/webp", "A.webp"),
+    ("image/avif;q=0,image/webp;q=0", "A.png"),
+    ("*/*", "A.png"),  # wildcard ไม่นับว่ารองรับ AVIF/WebP
+    ("image/png,image/webp;q=0.8", "A.png"),  # ต่ำกว่าต้นฉบับ
+    ("", "A.png"),
+])
+def test_lookup_variant_negotiates_format(catalog, accept, expected):
+    entry, negotiated = catalog.lookup_variant("male", "A.png", accept, negotiate=True)
+    assert os.path.basename(entry.path) == expected and negotiated
+
+def test_lookup_variant_without_negotiation_serves_original(catalog):
+    entry, negotiated = catalog.lookup_variant("male", "A.png", "image/avif,image/webp")
+    assert os.path.basename(entry.path) == "A.png" and not negotiated
+    entry, _ = catalog.lookup_variant("male", "A.png", size="thumb")
+    assert os.path.basename(entry.path) == "A.thumb.webp"
+    entry, negotiated = catalog.lookup_variant("male", "B.png", "image/avif", negotiate=True)
+    assert os.path.basename(entry.path) == "B.png" and not negotiated
+    assert catalog.lookup_variant("male", "nope.png") == (None, False)
@@ -0,0 +1,37 @@
+import importlib
+import pytest
+
+RESULT = {"gender": "male", "image_file": "A.png", "blessing": "hi"}
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setenv("PLAYED_CACHE_MAX_BYTES", "1000")
+    import played_cache
+    return importlib.reload(played_cache)
+
+def test_hit_miss_and_invalidate(cache):
+    assert cache.get("ip") is None
+    cache.put("ip", {**RESULT, "name": "not cached"})
+    assert cache.get("ip") == RESULT
+    cache.invalidate("ip")
+    assert cache.get("ip") is None
+    assert cache.cache_stats()["hits"] == 1 and cache.cache_stats()["misses"] == 2
+
+def test_put_after_invalidate_is_ignored(cache):
+    seen = cache.version()
+    cache.invalidate("ip")  # admin ลบระหว่าง request กำลังอ่าน DB
+    cache.put("ip", RESULT, seen)
+    assert cache.get("ip") is None
+
+def test_expired_entry_is_dropped(cache, monkeypatch):
+    cache.put("ip", RESULT)
+    monkeypatch.setattr(cache.time, "monotonic", lambda: 10 ** 9)
+    assert cache.get("ip") is None
+    assert cache.cache_stats()["bytes"] == 0
+
+def test_byte_bound_evicts_least_recent(cache):
+    for i in range(10):
+        cache.put(f"ip{i}", RESULT)
+    stats = cache.cache_stats()
+    assert stats["bytes"] <= 1000 and stats["evictions"] > 0
+    assert cache.get("ip9") == RESULT and cache.get("ip0") is None
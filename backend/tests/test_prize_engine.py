@@ -0,0 +1,87 @@
+import asyncio
+import importlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+import pytest
+import image_catalog
+from bench_fakes import FakeCollection, Latency
+
+Entry = namedtuple("Entry", ["filename"])
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setenv("PRIZE_LEASE_SIZE", "5")
+    import prize_engine
+    module = importlib.reload(prize_engine)
+    module.prize_stock = FakeCollection("prize_stock", Latency(0))
+    module.players = FakeCollection("players", Latency(0))
+    catalogue = {"male": (Entry("A.png"), Entry("B.png")), "female": ()}
+    monkeypatch.setattr(image_catalog, "entries", lambda gender: catalogue.get(gender, ()))
+    return module
+
+def alias_probabilities(prob, alias):
+    n = len(prob)
+    p = [value / n for value in prob]
+    for i, j in enumerate(alias):
+        if prob[i] < 1.0:
+            p[j] += (1.0 - prob[i]) / n
+    return p
+
+@pytest.mark.parametrize("weights", [[1], [1, 1], [3, 1], [5, 1, 0.5, 2], [1, 2, 3, 4, 5, 6, 7]])
+def test_alias_table_matches_weights(engine, weights):
+    prob, alias = engine.build_alias(weights)
+    total = sum(weights)
+    assert alias_probabilities(prob, alias) == pytest.approx([w / total for w in weights])
+
+def test_concurrent_draws_never_oversell(engine):
+    engine._config = {"default": {"weight": 1, "stock": 7}}
+
+    async def run():
+        await engine.seed_stock()
+        return await asyncio.gather(*(engine.draw("male") for _ in range(20)))
+    results = asyncio.run(run())
+    given = [r for r in results if r]
+    assert len(given) == 14
+    assert results.count(None) == 6
+    assert engine.engine_stats()["available"]["male"] == 0
+
+def test_release_and_return_leases_restore_stock(engine):
+    engine._config = {"default": {"weight": 1, "stock": None}, "male": {"A.png": {"stock": 10}, "B.png": {"weight": 0}}}
+
+    async def run():
+        await engine.seed_stock()
+        drawn = [await engine.draw("male") for _ in range(3)]
+        engine.release("male", drawn[0])
+        await engine.return_leases()
+        return drawn, await engine.prize_stock.find_one({"_id": "male/A.png"})
+    drawn, doc = asyncio.run(run())
+    assert drawn == ["A.png"] * 3
+    assert doc["remaining"] == 8  # แจกจริง 2 ชิ้น
+    assert doc.get("leases") == {}
+
+def test_expired_lease_is_reclaimed_once(engine):
+    engine._config = {"default": {"weight": 1, "stock": 10}}
+    stock = engine.prize_stock
+
+    async def run():
+        await engine.seed_stock()
+        for _ in range(2):
+            filename = await engine.draw("male")
+            await engine.players.insert_one({"gender": "male", "image_file": filename,
+                                             **engine.lease_tag("male", filename)})
+        # worker นี้ "ตาย": lease หมดอายุ แล้วมี worker ใหม่มาเก็บกวาด
+        dead = engine.OWNER
+        for doc in stock._docs:
+            if dead in doc.get("leases", {}):
+                doc["leases"][dead]["expires_at"] = datetime.now() - timedelta(seconds=1)
+        engine.OWNER = "survivor"
+        engine._leases.clear()
+        engine._granted.clear()
+        first = await engine.reclaim_expired()
+        second = await engine.reclaim_expired()
+        remaining = sum(doc["remaining"] for doc in stock._docs)
+        return first, second, remaining
+    first, second, remaining = asyncio.run(run())
+    assert second == 0
+    assert remaining == 20 - 2
+    assert first > 0
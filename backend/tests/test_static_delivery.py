@@ -0,0 +1,69 @@
+import asyncio
+import os
+from types import SimpleNamespace
+import pytest
+import static_delivery
+
+@pytest.fixture(autouse=True)
+def empty_lru(monkeypatch):
+    monkeypatch.setattr(static_delivery, "_lru", static_delivery.OrderedDict())
+    monkeypatch.setattr(static_delivery, "_lru_state", {"bytes": 0, "hits": 0, "misses": 0})
+    monkeypatch.setattr(static_delivery, "_loading", {})
+
+def make_file(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return static_delivery.make_entry(str(path))
+
+def test_concurrent_misses_read_once_and_count_once(tmp_path):
+    entry = make_file(tmp_path, "a.png", 1000)
+
+    async def run():
+        return await asyncio.gather(*(static_delivery.get_cached_bytes(entry) for _ in range(10)))
+    results = asyncio.run(run())
+    assert all(len(data) == 1000 for data in results)
+    assert static_delivery.lru_stats() == {"files": 1, "bytes": 1000, "hits": 0, "misses": 10}
+
+def test_eviction_keeps_bytes_under_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(static_delivery, "LRU_MAX_BYTES", 2500)
+    entries = [make_file(tmp_path, f"{i}.png", 1000) for i in range(4)]
+
+    async def run():
+        for entry in entries:
+            await static_delivery.get_cached_bytes(entry)
+        await static_delivery.get_cached_bytes(entries[-1])
+    asyncio.run(run())
+    stats = static_delivery.lru_stats()
+    assert stats["bytes"] == 2000 and stats["files"] == 2 and stats["hits"] == 1
+    assert list(static_delivery._lru) == [entries[2].path, entries[3].path]
+
+def test_changed_file_replaces_entry_without_leaking_bytes(tmp_path):
+    entry = make_file(tmp_path, "a.png", 1000)
+
+    async def run():
+        await static_delivery.get_cached_bytes(entry)
+        with open(entry.path, "wb") as f:
+            f.write(b"y" * 400)
+        os.utime(entry.path, (entry.mtime + 10, entry.mtime + 10))
+        return await static_delivery.get_cached_bytes(static_delivery.make_entry(entry.path))
+    assert asyncio.run(run()) == b"y" * 400
+    assert static_delivery.lru_stats()["bytes"] == 400
+
+@pytest.mark.parametrize("header,expected", [
+    ("gzip, deflate, br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=0.5, br;q=0.4", "gzip"),
+    ("br;q=0, gzip;q=0", None),
+    ("identity", None),
+    ("*", "br"),
+    ("*, br;q=0", "gzip"),
+    ("", None),
+])
+def test_pick_variant_honours_q_values(tmp_path, header, expected):
+    entry = make_file(tmp_path, "app.js", 10)
+    entry = entry._replace(variants={"br": make_file(tmp_path, "app.js.br", 5),
+                                     "gzip": make_file(tmp_path, "app.js.gz", 6)})
+    request = SimpleNamespace(headers={"accept-encoding": header})
+    body, encoding = static_delivery._pick_variant(request, entry)
+    assert encoding == expected
+    assert body is (entry.variants[expected] if expected else entry)
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import stats_counters
+from bench_fakes import FakeCollection, Latency
+
+PLAY = {"gender": "male", "image_file": "A.png", "played_at": datetime(2026, 1, 1, 12, 0, 30)}
+
+@pytest.fixture(autouse=True)
+def fresh(monkeypatch):
+    monkeypatch.setattr(stats_counters, "_delta", {})
+    monkeypatch.setattr(stats_counters, "_flush_lock", None)
+    monkeypatch.setattr(stats_counters, "event_stats", FakeCollection("event_stats", Latency(0)))
+
+def test_flush_applies_play_and_delete():
+    async def run():
+        stats_counters.record_play(PLAY, "th")
+        stats_counters.record_play({**PLAY, "gender": "female"}, "en")
+        stats_counters.record_delete({**PLAY, "lang": "th"})
+        await stats_counters.flush()
+        return await stats_counters.get_stats(window_minutes=10 ** 6)
+    stats = asyncio.run(run())
+    assert stats["total_plays"] == 1
+    # delta สุทธิ 0 ไม่ถูกเขียน
+    assert stats["by_gender"].get("male", 0) == 0 and stats["by_gender"]["female"] == 1
+    assert stats["by_lang"].get("th", 0) == 0 and stats["by_lang"]["en"] == 1
+
+def test_partial_bulk_failure_requeues_only_failed_ops():
+    class Flaky:
+        async def bulk_write(self, ops, ordered):
+            self.ids = [op._filter["_id"] for op in ops]
+            raise BulkWriteError({"writeErrors": [{"index": 1, "code": 2}]})
+    flaky = Flaky()
+    stats_counters.event_stats = flaky
+    stats_counters.record_play(PLAY, "th")
+
+    with pytest.raises(BulkWriteError):
+        asyncio.run(stats_counters.flush())
+    assert list(stats_counters._delta) == [flaky.ids[1]]
+
+class FakeAggregate:
+    """players.aggregate(...) ที่คืน $facet สำเร็จรูป และรันงานแทรก (จำลอง worker อื่น) ระหว่าง aggregation"""
+
+    def __init__(self, facets, during=None):
+        self.facets = facets
+        self.during = during
+        self.pipeline = None
+
+    async def aggregate(self, pipeline):
+        self.pipeline = pipeline
+        if self.during:
+            await self.during()
+        facets = self.facets
+
+        class Cursor:
+            async def to_list(self, length=None):
+                return [facets]
+        return Cursor()
+
+def test_rebuild_replaces_counters_despite_concurrent_flush(monkeypatch):
+    event_stats = stats_counters.event_stats
+    minute = datetime(2026, 1, 1, 12, 0)
+    later = datetime.now().replace(second=0, microsecond=0) + timedelta(minutes=5)
+    facets = {
+        "gender": [{"_id": "male", "count": 3}],
+        "lang": [{"_id": "th", "count": 3}],
+        "image": [{"_id": {"gender": "male", "image_file": "A.png"}, "count": 3}],
+        "minute": [{"_id": minute, "count": 3}],
+    }
+
+    async def other_worker_flush():
+        # worker อื่น flush ระหว่าง rebuild: counter เดิม + minute bucket ใหม่หลัง cutoff
+        await event_stats.bulk_write([
+            UpdateOne({"_id": "total:plays"}, {"$inc": {"count": 1}, "$set": {"kind": "total", "key": "plays"}}, upsert=True),
+            UpdateOne({"_id": f"minute:{later.isoformat()}"},
+                      {"$inc": {"count": 1}, "$set": {"kind": "minute", "key": later.isoformat(), "bucket": later}},
+                      upsert=True),
+        ])
+
+    async def run():
+        await event_stats.insert_many([{"_id": "gender:female", "kind": "gender", "key": "female", "count": 99}])
+        stats_counters.record_play(PLAY, "th")  # delta ก่อน rebuild (aggregation นับแล้ว)
+        fake = FakeAggregate(facets, during=other_worker_flush)
+        monkeypatch.setattr(stats_counters, "players", fake)
+        await stats_counters.rebuild()
+        return fake
+    fake = asyncio.run(run())
+    assert "$lt" in fake.pipeline[0]["$match"]["played_at"]
+    assert stats_counters._delta == {}
+    docs = {d["_id"]: d["count"] for d in event_stats._docs}
+    assert docs["total:plays"] == 3 and docs["gender:male"] == 3
+    assert "gender:female" not in docs  # counter ที่ไม่มีแล้วถูกลบ
+    assert docs[f"minute:{later.isoformat()}"] == 1  # ของใหม่หลัง cutoff ไม่ถูกลบ
+
+def test_plays_before_cutoff_are_not_counted_twice_during_rebuild(monkeypatch):
+    async def play_during_aggregation():
+        stats_counters.record_play(PLAY, "th")  # played_at ก่อน cutoff -> อยู่ใน aggregation แล้ว
+        stats_counters.record_play({**PLAY, "played_at": datetime.now() + timedelta(minutes=1)}, "th")
+
+    facets = {"gender": [{"_id": "male", "count": 1}], "lang": [], "image": [], "minute": []}
+    monkeypatch.setattr(stats_counters, "players", FakeAggregate(facets, during=play_during_aggregation))
+    asyncio.run(stats_counters.rebuild())
+    assert stats_counters._delta["total:plays"][1] == 1
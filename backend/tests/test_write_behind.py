@@ -0,0 +1,101 @@
+import asyncio
+import importlib
+import pytest
+from bson import json_util, ObjectId
+from bench_fakes import FakeCollection, Latency
+
+@pytest.fixture
+def wb(tmp_path, monkeypatch):
+    monkeypatch.setenv("WRITE_BEHIND", "1")
+    monkeypatch.setenv("WRITE_BEHIND_JOURNAL", str(tmp_path / "journal"))
+    import write_behind
+    module = importlib.reload(write_behind)
+    players = FakeCollection("players", Latency(0))
+    asyncio.run(players.create_index("ip_hash", unique=True))
+    module.COLLECTIONS["players"] = players
+    module.COLLECTIONS["chat_messages"] = FakeCollection("chat_messages", Latency(0))
+    yield module
+    if module._journal is not None:
+        module._journal.close()
+
+def journal_lines(module):
+    with open(module.JOURNAL_PATH, encoding="utf-8") as f:
+        return [json_util.loads(line) for line in f if line.strip()]
+
+def test_enqueue_journals_before_returning(wb):
+    async def run():
+        await asyncio.gather(*(wb.enqueue("players", {"ip_hash": f"h{i}"}, key=f"h{i}") for i in range(20)))
+    asyncio.run(run())
+    assert [entry["k"] for entry in journal_lines(wb)] == [f"h{i}" for i in range(20)]
+    assert wb.lookup_pending("players", "h3")["ip_hash"] == "h3"
+    assert wb.stats()["queue_depth"] == 20
+
+def test_flush_inserts_and_truncates_journal(wb):
+    async def run():
+        for i in range(3):
+            await wb.enqueue("players", {"ip_hash": f"h{i}"}, key=f"h{i}")
+        await wb.flush_all()
+    asyncio.run(run())
+    players = wb.COLLECTIONS["players"]
+    assert len(players._docs) == 3
+    assert journal_lines(wb) == []
+    assert wb.lookup_pending("players", "h0") is None
+
+def test_discard_removes_from_queue_and_journal(wb):
+    async def run():
+        await wb.enqueue("players", {"ip_hash": "keep"}, key="keep")
+        await wb.enqueue("players", {"ip_hash": "drop"}, key="drop")
+        assert await wb.discard("players", "drop")
+        assert not await wb.discard("players", "drop")
+    asyncio.run(run())
+    assert [entry["k"] for entry in journal_lines(wb)] == ["keep"]
+    assert wb.lookup_pending("players", "drop") is None
+
+def test_replay_skips_torn_line_and_ignores_own_duplicates(wb):
+    written = {"_id": ObjectId(), "ip_hash": "written"}
+    with open(wb.JOURNAL_PATH, "w", encoding="utf-8") as f:
+        f.write(json_util.dumps({"c": "players", "d": written, "k": "written"}) + "\n")
+        f.write(json_util.dumps({"c": "players", "d": {"_id": ObjectId(), "ip_hash": "new"}, "k": "new"}) + "\n")
+        f.write('{"c": "players", "d": {"ip_ha')  # crash กลางบรรทัด
+    lost = []
+    wb.on_conflict("players", lost.append)
+    players = wb.COLLECTIONS["players"]
+
+    async def run():
+        await players.insert_one(dict(written))  # insert ไปแล้วก่อน crash
+        await wb.replay_journal()
+    asyncio.run(run())
+    assert sorted(d["ip_hash"] for d in players._docs) == ["new", "written"]
+    assert lost == []
+    assert wb.stats()["duplicates_dropped"] == 1
+    assert wb.stats()["queue_depth"] == 0
+
+def test_conflict_with_other_worker_calls_handler(wb):
+    lost = []
+    wb.on_conflict("players", lost.append)
+    players = wb.COLLECTIONS["players"]
+
+    async def run():
+        await players.insert_one({"ip_hash": "shared", "image_file": "winner.png"})
+        await wb.enqueue("players", {"ip_hash": "shared", "image_file": "loser.png"}, key="shared")
+        await wb.flush_all()
+    asyncio.run(run())
+    assert [d["image_file"] for d in lost] == ["loser.png"]
+    assert wb.stats()["conflicts_reconciled"] == 1
+    assert [d["image_file"] for d in players._docs] == ["winner.png"]
+
+def test_failed_journal_write_leaves_no_record(wb):
+    def broken(lines):
+        raise OSError("disk full")
+
+    async def run():
+        await wb.enqueue("players", {"ip_hash": "ok"}, key="ok")
+        write_lines, wb._write_lines = wb._write_lines, broken
+        with pytest.raises(OSError):
+            await wb.enqueue("players", {"ip_hash": "lost"}, key="lost")
+        wb._write_lines = write_lines
+        await wb.flush_all()
+    asyncio.run(run())
+    assert wb.lookup_pending("players", "lost") is None
+    assert wb._journal_lines == []
+    assert [doc["ip_hash"] for doc in wb.COLLECTIONS["players"]._docs] == ["ok"]
@@ -0,0 +1,272 @@
+import os
+import time
+import asyncio
+from bson import json_util, ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+from database import players, chat_messages
+
+# --- Write-Behind Persistence (optional) ---
+# WRITE_BEHIND=1 : play record / chat message ไม่ insert ทันที แต่เข้าคิวใน memory
+# แล้ว flush เป็น insert_many ตามขนาด (WRITE_BEHIND_BATCH) หรือเวลา (WRITE_BEHIND_INTERVAL_MS)
+# ทุก record ถูกเขียนลง journal (append-only) ก่อนตอบ -> process crash ก็ replay ได้ตอน startup
+# journal เขียนใน thread ทีละกลุ่ม (group commit) ผ่าน _journal_lock เดียว ไม่ block event loop
+# record ได้ _id ตั้งแต่ enqueue -> insert ซ้ำ (retry / replay) ชน _id ของตัวเอง = เขียนไปแล้ว ไม่ใช่ conflict
+# หมายเหตุ: การกัน ip_hash ซ้ำระหว่างรอ flush ทำใน process นี้; ถ้ารันหลาย worker
+# unique index ใน Mongo เป็นตัวตัดสินสุดท้าย: record ที่แพ้ (worker อื่นเขียนก่อน) ถูกทิ้งตอน flush
+# แล้วเรียก handler จาก on_conflict() ให้ย้อนผลข้างเคียง (stats / prize / cache) ของ request นั้น
+# ถ้าเขียน journal ไม่ได้ (OSError) record ถูกถอนออกจากคิวแล้ว error ส่งต่อให้ caller -> ไม่มี record ผี
+# ขอบเขต: buffer เฉพาะ insert ของ record ใหม่ (players / chat_messages); การอัปเดตห้องแชท (chats: seq,
+# last_message, unread_count) ยังเขียนตรงแบบ synchronous เพราะ seq ต้องได้จาก $inc แบบ atomic ใน Mongo
+
+ENABLED = os.getenv("WRITE_BEHIND", "0") == "1"
+BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH", "200"))
+FLUSH_INTERVAL = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "200")) / 1000.0
+JOURNAL_PATH = os.getenv("WRITE_BEHIND_JOURNAL", "write_behind.journal")
+JOURNAL_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "0") == "1"
+RETRY_BACKOFF = 1.0
+
+COLLECTIONS = {"players": players, "chat_messages": chat_messages}
+CONFLICT_KEYS = {"players": "ip_hash"}  # collection -> field ของ unique key ที่ต้องตรวจว่าใครชนะ
+
+_queue = []       # [(collection, doc, key)]
+_pending = {}     # (collection, key) -> doc, ใช้เช็คซ้ำก่อน flush
+_journal = None
+_journal_lines = []  # บรรทัดที่รอเขียนลง journal
+_journal_seq = {"queued": 0, "written": 0}
+_journal_lock = None
+_conflict_handlers = {}
+_wake = None
+_lock = None
+_stats = {
+    "flushes": 0,
+    "flushed_records": 0,
+    "duplicates_dropped": 0,
+    "conflicts_reconciled": 0,
+    "flush_errors": 0,
+    "last_flush_ms": None,
+    "max_flush_ms": 0.0,
+}
+
+def _open_journal():
+    global _journal
+    if _journal is None:
+        _journal = open(JOURNAL_PATH, "a", encoding="utf-8")
+    return _journal
+
+def _line(collection: str, doc: dict, key):
+    return json_util.dumps({"c": collection, "d": doc, "k": key}) + "\n"
+
+def _write_lines(lines):
+    """(thread) append หลายบรรทัดแล้ว flush/fsync ครั้งเดียว"""
+    journal = _open_journal()
+    journal.write("".join(lines))
+    journal.flush()
+    if JOURNAL_FSYNC:
+        os.fsync(journal.fileno())
+
+def _replace_journal(lines):
+    """(thread) เขียน journal ใหม่ทั้งไฟล์แบบ atomic"""
+    global _journal
+    if _journal is not None:
+        _journal.close()
+        _journal = None
+    tmp = JOURNAL_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("".join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, JOURNAL_PATH)
+
+def _lock_journal():
+    global _journal_lock
+    if _journal_lock is None:
+        _journal_lock = asyncio.Lock()
+    return _journal_lock
+
+async def _sync_journal(seq: int):
+    """รอจน journal มีบรรทัดที่ seq แล้ว; คนที่ได้ lock เขียนบรรทัดที่รออยู่ทั้งหมดทีเดียว"""
+    async with _lock_journal():
+        if _journal_seq["written"] >= seq:
+            return
+        lines = _journal_lines[:]
+        upto = _journal_seq["queued"]
+        _journal_lines.clear()
+        try:
+            await asyncio.to_thread(_write_lines, lines)
+        except OSError:
+            _journal_lines[:0] = lines
+            raise
+        _journal_seq["written"] = upto
+
+async def _rewrite_journal():
+    """เขียน journal ใหม่ให้เหลือเฉพาะ record ที่ยังไม่ได้ flush"""
+    async with _lock_journal():
+        # snapshot ใน event loop: _queue มีทุก record ที่ enqueue แล้ว (รวมบรรทัดที่ยังรอเขียน)
+        lines = [_line(collection, doc, key) for collection, doc, key in _queue]
+        upto = _journal_seq["queued"]
+        _journal_lines.clear()
+        await asyncio.to_thread(_replace_journal, lines)
+        _journal_seq["written"] = upto
+
+async def enqueue(collection: str, doc: dict, key=None):
+    """เข้าคิว + pending ทันที (ก่อน await -> request ซ้อนเห็นเลย) แล้วรอ journal เขียนเสร็จ"""
+    doc.setdefault("_id", ObjectId())
+    _queue.append((collection, doc, key))
+    if key is not None:
+        _pending[(collection, key)] = doc
+    line = _line(collection, doc, key)
+    _journal_lines.append(line)
+    _journal_seq["queued"] += 1
+    seq = _journal_seq["queued"]
+    if len(_queue) >= BATCH_SIZE and _wake is not None:
+        _wake.set()
+    try:
+        await _sync_journal(seq)
+    except OSError:
+        # journal เขียนไม่ได้ -> request นี้ล้มเหลว ต้องไม่เหลือ record ค้างให้ flush ทีหลัง
+        _forget(collection, doc, key, line)
+        raise
+
+def _forget(collection: str, doc: dict, key, line: str):
+    """ถอน record ที่ enqueue ไม่สำเร็จออกจาก queue / pending / บรรทัด journal ที่รอเขียน"""
+    _queue[:] = [item for item in _queue if item[1] is not doc]
+    if key is not None and _pending.get((collection, key)) is doc:
+        del _pending[(collection, key)]
+    _journal_lines[:] = [pending for pending in _journal_lines if pending is not line]
+
+def on_conflict(collection: str, handler):
+    """handler(doc) ถูกเรียกเมื่อ record ของ collection นี้แพ้ unique key ตอน flush (ถูกทิ้ง)"""
+    _conflict_handlers[collection] = handler
+
+def lookup_pending(collection: str, key):
+    return _pending.get((collection, key))
+
+async def discard(collection: str, key):
+    """ลบ record ที่ยังไม่ flush (เช่น admin ลบประวัติ); รอ batch ที่กำลัง flush ก่อน"""
+    async with _flush_lock():
+        if _pending.pop((collection, key), None) is None:
+            return False
+        _queue[:] = [item for item in _queue if not (item[0] == collection and item[2] == key)]
+        await _rewrite_journal()
+        return True
+
+def stats():
+    return {"enabled": ENABLED, "queue_depth": len(_queue), "batch_size": BATCH_SIZE,
+            "interval_ms": int(FLUSH_INTERVAL * 1000), **_stats}
+
+async def _insert_batch(collection: str, docs):
+    try:
+        await COLLECTIONS[collection].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        # ชน unique index = มีอยู่แล้ว (replay/retry ซ้ำ หรือ worker อื่นเขียนก่อน)
+        _stats["duplicates_dropped"] += len(errors)
+        await _reconcile(collection, [docs[err["index"]] for err in errors])
+
+async def _reconcile(collection: str, dropped):
+    """แยก record ที่แพ้ให้ worker อื่น (_id ใน DB ไม่ใช่ของเรา) ออกจาก record ที่เขียนไปแล้วเอง"""
+    field = CONFLICT_KEYS.get(collection)
+    handler = _conflict_handlers.get(collection)
+    if not field or not handler or not dropped:
+        return
+    winners = {}
+    async for doc in COLLECTIONS[collection].find({field: {"$in": [d.get(field) for d in dropped]}},
+                                                  {"_id": 1, field: 1}):
+        winners[doc[field]] = doc["_id"]
+    for doc in dropped:
+        winner = winners.get(doc.get(field))
+        if winner is not None and winner != doc["_id"]:
+            _stats["conflicts_reconciled"] += 1
+            try:
+                handler(doc)
+            except Exception as e:
+                print(f"⚠️ Write-behind conflict handler failed: {e}")
+
+def _flush_lock():
+    global _lock
+    if _lock is None:
+        _lock = asyncio.Lock()
+    return _lock
+
+async def flush():
+    async with _flush_lock():
+        await _flush_batch()
+
+async def _flush_batch():
+    if not _queue:
+        return
+    batch = _queue[:BATCH_SIZE]
+    grouped = {}
+    for collection, doc, _ in batch:
+        grouped.setdefault(collection, []).append(doc)
+
+    started = time.perf_counter()
+    for collection, docs in grouped.items():
+        await _insert_batch(collection, docs)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    # สำเร็จทั้ง batch -> เอาออกจากคิว/pending แล้วเขียน journal ใหม่
+    flushed = {id(item) for item in batch}
+    _queue[:] = [item for item in _queue if id(item) not in flushed]
+    for collection, doc, key in batch:
+        if key is not None and _pending.get((collection, key)) is doc:
+            del _pending[(collection, key)]
+    await _rewrite_journal()
+
+    _stats["flushes"] += 1
+    _stats["flushed_records"] += len(batch)
+    _stats["last_flush_ms"] = round(elapsed_ms, 2)
+    _stats["max_flush_ms"] = max(_stats["max_flush_ms"], round(elapsed_ms, 2))
+
+async def flush_all():
+    while _queue:
+        await flush()
+
+def _read_journal():
+    with open(JOURNAL_PATH, encoding="utf-8") as f:
+        return [line for line in f if line.strip()]
+
+async def replay_journal():
+    """Startup (ก่อนรับ request): insert record ที่ค้างใน journal (idempotent ด้วย unique index)"""
+    if not ENABLED or not os.path.exists(JOURNAL_PATH):
+        return
+    lines = await asyncio.to_thread(_read_journal)
+    for line in lines:
+        try:
+            entry = json_util.loads(line)
+        except ValueError:
+            # บรรทัดสุดท้ายเขียนไม่จบตอน crash
+            continue
+        _queue.append((entry["c"], entry["d"], entry["k"]))
+        if entry["k"] is not None:
+            _pending[(entry["c"], entry["k"])] = entry["d"]
+    if _queue:
+        print(f"📒 Write-behind: replaying {len(_queue)} journaled records")
+        try:
+            await flush_all()
+        except PyMongoError as e:
+            # ยังอยู่ในคิว -> flush_loop จะลองใหม่
+            print(f"⚠️ Write-behind replay failed (will retry): {e}")
+
+async def flush_loop():
+    """Background task: flush ทุก FLUSH_INTERVAL หรือทันทีเมื่อคิวถึง BATCH_SIZE"""
+    global _wake
+    if not ENABLED:
+        return
+    _wake = asyncio.Event()
+    print(f"✍️ Write-behind enabled (batch {BATCH_SIZE}, every {int(FLUSH_INTERVAL * 1000)}ms)")
+
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+        try:
+            await flush_all()
+        except PyMongoError as e:
+            _stats["flush_errors"] += 1
+            print(f"⚠️ Write-behind flush failed: {e}")
+            await asyncio.sleep(RETRY_BACKOFF)
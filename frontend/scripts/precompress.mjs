@@ -0,0 +1,21 @@
+// สร้างไฟล์ .br / .gz คู่กับไฟล์ใน dist/ ให้ backend เสิร์ฟแบบ pre-compressed ได้เลย
+import { readdirSync, readFileSync, writeFileSync, statSync } from 'node:fs'
+import { join } from 'node:path'
+import { brotliCompressSync, gzipSync, constants } from 'node:zlib'
+
+const DIST_DIR = 'dist'
+const COMPRESSIBLE = /\.(js|css|html|svg|json|txt|map)$/
+const MIN_BYTES = 1024
+
+const walk = (dir) => readdirSync(dir).flatMap((name) => {
+  const path = join(dir, name)
+  return statSync(path).isDirectory() ? walk(path) : [path]
+})
+
+for (const file of walk(DIST_DIR)) {
+  if (!COMPRESSIBLE.test(file)) continue
+  const data = readFileSync(file)
+  if (data.length < MIN_BYTES) continue
+  writeFileSync(`${file}.br`, brotliCompressSync(data, { params: { [constants.BROTLI_PARAM_QUALITY]: 11 } }))
+  writeFileSync(`${file}.gz`, gzipSync(data, { level: 9 }))
+}
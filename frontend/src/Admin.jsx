@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { Lock, Database, Clock, Image as ImageIcon, LogOut, Trash2, FileDown, ShieldCheck, Power, RefreshCw, ChevronLeft, ChevronRight, Inbox, MessageCircle, Send, ArrowLeft } from 'lucide-react'
 
 export default function Admin() {
@@ -12,12 +12,17 @@ export default function Admin() {
   // View State
   const [view, setView] = useState('history') // 'history' | 'inbox'
   const [selectedChat, setSelectedChat] = useState(null) // ห้องแชทที่เปิดอยู่
+  const [chatMessages, setChatMessages] = useState([]) // ข้อความของห้องที่เปิด (โหลดเมื่อเปิดห้อง)
+  const [chatsCursor, setChatsCursor] = useState(null) // cursor หน้าถัดไปของ Inbox
+  const chatSeqRef = useRef(-1)
+  const chatRoomRef = useRef(null)
   const [replyMsg, setReplyMsg] = useState('')
 
   // Pagination State
   const [page, setPage] = useState(1)
   const [totalPages, setTotalPages] = useState(1)
   const [totalDocs, setTotalDocs] = useState(0)
+  const [stats, setStats] = useState(null) // สรุปจาก /api/admin/stats (counter, ไม่ scan)
 
   // --- 1. Init & Auth ---
   useEffect(() => {
@@ -38,6 +43,34 @@ export default function Admin() {
     return () => clearInterval(interval)
   }, [selectedChat])
 
+  // --- 2.1 Load Conversation On Demand (delta ด้วย ?after=<seq>) ---
+  const fetchChatMessages = async (sessionId, key = secretKey) => {
+    try {
+        const res = await fetch(`/api/admin/chats/${sessionId}?after=${chatSeqRef.current}`, { headers: { 'X-Admin-Key': key } })
+        if (!res.ok) return
+        const json = await res.json()
+        if (json.data.length === 0 || chatRoomRef.current !== sessionId) return
+        chatSeqRef.current = Math.max(chatSeqRef.current, json.data[json.data.length - 1].seq)
+        setChatMessages(prev => {
+            const last = prev.length ? prev[prev.length - 1].seq : -1
+            return [...prev, ...json.data.filter(m => m.seq > last)]
+        })
+    } catch (err) {
+        console.error(err)
+    }
+  }
+
+  useEffect(() => {
+    chatSeqRef.current = -1
+    chatRoomRef.current = selectedChat?.session_id ?? null
+    setChatMessages([])
+    if (!selectedChat) return;
+    const sessionId = selectedChat.session_id
+    fetchChatMessages(sessionId)
+    const interval = setInterval(() => fetchChatMessages(sessionId), 3000);
+    return () => clearInterval(interval)
+  }, [selectedChat?.session_id])
+
   // --- 3. Fetch Data Logic ---
   const fetchAllData = async (key, pageNum = 1, silent=false) => {
     if (!silent) setLoading(true)
@@ -48,6 +81,9 @@ export default function Admin() {
         const resChats = await fetch('/api/admin/chats', { headers: { 'X-Admin-Key': key } })
         // ดึง System Status
         const resStatus = await fetch('/api/admin/system_status', { headers: { 'X-Admin-Key': key } })
+        // ดึง Stats (ไม่บังคับ ถ้าพังก็แค่ไม่แสดง)
+        const resStats = await fetch('/api/admin/stats?window=15', { headers: { 'X-Admin-Key': key } })
+        if (resStats.ok) setStats((await resStats.json()).data)
         
         if (resHistory.ok && resStatus.ok && resChats.ok) {
             const jsonHistory = await resHistory.json()
@@ -55,7 +91,13 @@ export default function Admin() {
             const jsonStatus = await resStatus.json()
             
             setData(jsonHistory.data)
-            setChats(jsonChats.data)
+            if (silent) {
+                // refresh เบื้องหลัง: อัปเดตเฉพาะหน้าแรก แล้ว merge ตาม session_id -> หน้าที่กด Load more ไว้ไม่หาย
+                setChats(prev => mergeChats(jsonChats.data, prev))
+            } else {
+                setChats(jsonChats.data)
+                setChatsCursor(jsonChats.next_cursor)
+            }
             
             // ถ้าเปิดแชทใครค้างไว้ ให้อัปเดตข้อความในห้องนั้นด้วย
             if (selectedChat) {
@@ -84,6 +126,12 @@ export default function Admin() {
     }
   }
 
+  // ห้องจาก fresh (ใหม่กว่า) มาก่อน ตามด้วยห้องเดิมที่ไม่ซ้ำ session_id
+  const mergeChats = (fresh, prev) => {
+      const seen = new Set(fresh.map(c => c.session_id))
+      return [...fresh, ...prev.filter(c => !seen.has(c.session_id))]
+  }
+
   // --- 4. Actions ---
   const handleLogin = (e) => { e.preventDefault(); fetchAllData(secretKey, 1) }
   const handleRefresh = () => fetchAllData(secretKey, page)
@@ -98,12 +146,23 @@ export default function Admin() {
               body: JSON.stringify({ session_id: selectedChat.session_id, message: replyMsg })
           })
           setReplyMsg('')
+          fetchChatMessages(selectedChat.session_id)
           fetchAllData(secretKey, page, true) // Force refresh immediately
       } catch (e) {
           alert("Reply failed")
       }
   }
 
+  const loadMoreChats = async () => {
+      if (!chatsCursor) return;
+      try {
+          const res = await fetch(`/api/admin/chats?cursor=${encodeURIComponent(chatsCursor)}`, { headers: { 'X-Admin-Key': secretKey } })
+          const json = await res.json()
+          setChats(prev => mergeChats(prev, json.data))
+          setChatsCursor(json.next_cursor)
+      } catch (err) { alert("Error") }
+  }
+
   const toggleSystem = async () => {
       if (!window.confirm("ยืนยันเปลี่ยนสถานะระบบ (เปิด/ปิด)?")) return;
       try {
@@ -124,18 +183,15 @@ export default function Admin() {
   const exportToCSV = async () => {
     if (!window.confirm("ดาวน์โหลด CSV?")) return
     try {
-        const res = await fetch('/api/admin/export', { headers: { 'X-Admin-Key': secretKey } })
-        const json = await res.json()
-        const headers = ["Timestamp", "Name", "Gender", "IP Address", "IP Hash", "Message", "Blessing", "Image File"];
-        const rows = json.data.map(r => [
-            new Date(r.played_at).toLocaleString('en-US'), `"${r.name.replace(/"/g, '""')}"`, r.gender, r.ip_address || "N/A", r.ip_hash,
-            `"${r.blessing.replace(/"/g, '""').replace(/\n/g, ' ')}"`, `"${r.blessing.replace(/"/g, '""').replace(/\n/g, ' ')}"`, r.image_file
-        ]);
-        const csvContent = "\uFEFF" + [headers.join(","), ...rows.map(e => e.join(","))].join("\n");
+        // Server stream CSV มาให้เลย (ไม่ต้องโหลด JSON ทั้งก้อนมาแปลงเอง)
+        const res = await fetch('/api/admin/export?format=csv&gzip=true', { headers: { 'X-Admin-Key': secretKey } })
+        if (!res.ok) throw new Error(res.status)
+        const url = URL.createObjectURL(await res.blob())
         const link = document.createElement("a");
-        link.setAttribute("href", encodeURI("data:text/csv;charset=utf-8," + csvContent));
+        link.setAttribute("href", url);
         link.setAttribute("download", `Riser_Gacha_Export.csv`);
         document.body.appendChild(link); link.click(); document.body.removeChild(link);
+        URL.revokeObjectURL(url)
     } catch (e) { alert("Export Error") }
   }
 
@@ -179,6 +235,16 @@ export default function Admin() {
       {/* Main Content */}
       <main className="max-w-6xl mx-auto p-4 md:p-6">
         
+        {/* === STATS SUMMARY === */}
+        {view === 'history' && stats && (
+            <div className="grid grid-cols-2 md:grid-cols-4 gap-3 mb-4">
+                <div className="bg-white rounded-xl border border-slate-200 p-4"><p className="text-[10px] uppercase text-slate-400 font-bold">Total Plays</p><p className="text-2xl font-bold text-slate-900">{stats.total_plays}</p></div>
+                <div className="bg-white rounded-xl border border-slate-200 p-4"><p className="text-[10px] uppercase text-slate-400 font-bold">Male / Female</p><p className="text-2xl font-bold text-slate-900">{stats.by_gender.male || 0} / {stats.by_gender.female || 0}</p></div>
+                <div className="bg-white rounded-xl border border-slate-200 p-4"><p className="text-[10px] uppercase text-slate-400 font-bold">TH / EN</p><p className="text-2xl font-bold text-slate-900">{stats.by_lang.th || 0} / {stats.by_lang.en || 0}</p></div>
+                <div className="bg-white rounded-xl border border-slate-200 p-4"><p className="text-[10px] uppercase text-slate-400 font-bold">Plays (last 15 min)</p><p className="text-2xl font-bold text-slate-900">{stats.plays_per_minute.reduce((sum, b) => sum + b.plays, 0)}</p></div>
+            </div>
+        )}
+
         {/* === VIEW: HISTORY === */}
         {view === 'history' && (
             <div className="bg-white rounded-2xl shadow-sm border border-slate-200 overflow-hidden">
@@ -227,6 +293,7 @@ export default function Admin() {
                             </div>
                         ))}
                         {chats.length === 0 && <div className="text-center text-slate-400 py-10 text-sm">No messages yet.</div>}
+                        {chatsCursor && <button onClick={loadMoreChats} className="w-full py-2 text-xs text-blue-500 hover:underline">Load more</button>}
                     </div>
                 </div>
 
@@ -252,8 +319,8 @@ export default function Admin() {
 
                             {/* Messages */}
                             <div className="flex-1 overflow-y-auto p-4 space-y-3 bg-slate-50/50">
-                                {selectedChat.messages.map((m, i) => (
-                                    <div key={i} className={`flex ${m.sender === 'admin' ? 'justify-end' : 'justify-start'}`}>
+                                {chatMessages.map((m) => (
+                                    <div key={m.seq} className={`flex ${m.sender === 'admin' ? 'justify-end' : 'justify-start'}`}>
                                         <div className={`max-w-[80%] p-3 rounded-2xl text-sm shadow-sm ${m.sender === 'admin' ? 'bg-blue-600 text-white rounded-br-none' : 'bg-white text-slate-700 border border-slate-200 rounded-bl-none'}`}>
                                             {m.text}
                                             <div className={`text-[9px] mt-1 text-right ${m.sender==='admin'?'text-blue-200':'text-slate-400'}`}>{new Date(m.timestamp).toLocaleTimeString()}</div>
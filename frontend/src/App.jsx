@@ -36,6 +36,10 @@ const TRANSLATIONS = {
     alert_name_required: "⚠️ กรุณากรอกชื่อเล่น หรือ Account X",
     alert_played: "⚠️ คุณได้ใช้สิทธิ์เข้าร่วมกิจกรรมนี้ไปแล้ว ขอบคุณที่ร่วมสนุกกับ Fan Project ของเรานะครับ 💖",
     alert_closed: "⛔ ขณะนี้กิจกรรมยังไม่เปิดให้ร่วมสนุก กรุณารอติดตามการเปิดกิจกรรมอย่างเป็นทางการอีกครั้ง",
+    alert_out_of_stock: "🎁 ของรางวัลฝั่งนี้หมดแล้ว ขอบคุณที่ร่วมสนุกกับ Fan Project ของเรานะครับ 💖",
+    alert_busy: "⏳ ตอนนี้มีคนร่วมสนุกเยอะมาก กรุณาลองใหม่อีกครั้งในอีก {s} วินาที",
+    alert_rate_limited: "⏳ ส่งคำขอถี่เกินไป กรุณารอ {s} วินาทีแล้วลองใหม่",
+    alert_room_full: "💬 ห้องแชทนี้มีข้อความเต็มแล้ว ทีมงานจะติดต่อกลับโดยเร็วที่สุด",
     share_alert_success: "✅ คัดลอกรูปแล้ว! กด Paste ใน X ได้เลย",
     share_alert_fail: "📸 อย่าลืมแนบรูปที่ Save ไว้ไปอวดเพื่อนๆ นะ!",
     share_text: "สุ่มกาชา Riser Concert ได้รูปสวยมาก! 🔮✨\n\nมาเล่นกันที่ Fan Project by @Jaiidees\n\n#RiserConcert #JaiideesGiveaway",
@@ -74,6 +78,10 @@ const TRANSLATIONS = {
   alert_name_required: "⚠️ Please enter your nickname or X account.",
   alert_played: "⚠️ You have already participated in this event. Thank you for supporting our Fan Project! 💖",
   alert_closed: "⛔ This event is not open yet. Please stay tuned for the official launch.",
+  alert_out_of_stock: "🎁 All prizes for this side have been given out. Thank you for supporting our Fan Project! 💖",
+  alert_busy: "⏳ Lots of fans are playing right now. Please try again in {s} seconds.",
+  alert_rate_limited: "⏳ Too many requests. Please wait {s} seconds and try again.",
+  alert_room_full: "💬 This chat has reached its message limit. Our team will get back to you soon.",
   share_alert_success: "✅ Image copied! You can now paste it directly into X.",
   share_alert_fail: "📸 Don’t forget to attach the image you saved when sharing with your friends!",
   share_text: "I just got an amazing wallpaper from the Riser Concert Gacha! 🔮✨\n\nJoin the fun at Fan Project by @Jaiidees\n\n#RiserConcert #JaiideesGiveaway",
@@ -85,6 +93,9 @@ const TRANSLATIONS = {
 }
 }
 
+// <img> ขอ AVIF/WebP ได้ (server เลือกตาม Accept); ปุ่ม download/share ใช้ URL เดิม = ไฟล์ต้นฉบับ
+const displayUrl = (url) => url + (url.includes('?') ? '&' : '?') + 'format=auto'
+
 function App() {
   // --- ROUTING LOGIC ---
   let path = window.location.pathname;
@@ -121,28 +132,58 @@ function App() {
     setSessionId(sid)
   }, [])
 
-  // Poll Chat History (Every 3s)
+  // Live Chat: SSE (/api/chat/stream) + fallback เป็น polling แบบ ?after=<seq>
   useEffect(() => {
-    if (!showChat) return;
-    
+    if (!showChat || !sessionId) return;
+
+    let lastSeq = -1
+    let source = null
+    let interval = null
+
+    const mergeMessages = (incoming) => {
+        const fresh = incoming.filter(m => m.seq > lastSeq)
+        if (fresh.length === 0) return
+        lastSeq = fresh[fresh.length - 1].seq
+        setChatHistory(prev => {
+            // ลบข้อความ optimistic (ยังไม่มี seq) ที่ server ยืนยันแล้ว และข้อความซ้ำตอนเปิดแชทใหม่
+            const confirmed = fresh.filter(m => m.sender === 'user').map(m => m.text)
+            const freshSeqs = new Set(fresh.map(m => m.seq))
+            const kept = prev.filter(m => m.seq === undefined ? !confirmed.includes(m.text) : !freshSeqs.has(m.seq))
+            return [...kept, ...fresh]
+        })
+    }
+
     const fetchChat = async () => {
         try {
-            const res = await fetch(`/api/chat/history/${sessionId}`)
+            const res = await fetch(`/api/chat/history/${sessionId}?after=${lastSeq}`)
             const data = await res.json()
-            if (data.status === 'success') {
-                setChatHistory(data.data)
-            }
+            if (data.status === 'success') mergeMessages(data.data)
         } catch (e) {
             console.error("Polling error", e)
         }
     }
-    
-    // Initial fetch
-    fetchChat()
-    
-    // Interval fetch
-    const interval = setInterval(fetchChat, 3000)
-    return () => clearInterval(interval)
+
+    const startPolling = () => {
+        if (interval) return
+        fetchChat()
+        interval = setInterval(fetchChat, 3000)
+    }
+
+    if (window.EventSource) {
+        source = new EventSource(`/api/chat/stream/${sessionId}?after=${lastSeq}`)
+        source.onmessage = (e) => mergeMessages([JSON.parse(e.data)])
+        source.onerror = () => {
+            // EventSource reconnect เองได้ ถ้าปิดถาวรค่อย fallback เป็น polling
+            if (source.readyState === EventSource.CLOSED) startPolling()
+        }
+    } else {
+        startPolling()
+    }
+
+    return () => {
+        if (source) source.close()
+        if (interval) clearInterval(interval)
+    }
   }, [showChat, sessionId])
 
   // Auto-scroll to bottom of chat
@@ -188,6 +229,12 @@ function App() {
       } else if (data.status === 'closed') {
         alert(t.alert_closed)
         setStep('landing')
+      } else if (data.status === 'out_of_stock') {
+        alert(t.alert_out_of_stock)
+        setStep('landing')
+      } else if (data.status === 'busy' || data.status === 'rate_limited') {
+        alert((data.status === 'busy' ? t.alert_busy : t.alert_rate_limited).replace('{s}', data.retry_after))
+        setStep('landing')
       } else {
         alert("Error, please try again.")
         setStep('landing')
@@ -209,7 +256,7 @@ function App() {
     setChatMsg('')
 
     try {
-        await fetch('/api/chat/send', {
+        const res = await fetch('/api/chat/send', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ 
@@ -218,6 +265,10 @@ function App() {
                 name: formData.name || "Fan" 
             })
         })
+        if (res.status === 429) {
+            const data = await res.json()
+            alert(data.status === 'room_full' ? t.alert_room_full : t.alert_rate_limited.replace('{s}', data.retry_after))
+        }
     } catch (e) {
         alert("Failed to send message")
     }
@@ -376,7 +427,7 @@ function App() {
           <div className="animate-zoom-in space-y-5">
             <div className="bg-white border border-white rounded-3xl overflow-hidden shadow-2xl shadow-blue-100/50 relative group">
               <div className="relative w-full aspect-[9/16] bg-slate-100">
-                <img src={result.image_url} alt="Result" className="w-full h-full object-cover" />
+                <img src={displayUrl(result.image_url)} alt="Result" className="w-full h-full object-cover" />
                 <div className="absolute top-4 right-4 bg-white/90 backdrop-blur-md border border-white shadow-sm px-3 py-1 rounded-full flex items-center gap-1.5">
                     <span className="w-1.5 h-1.5 rounded-full bg-pink-500 animate-pulse"></span><span className="text-[10px] font-bold text-pink-600 tracking-wider">{t.ssr_badge}</span>
                 </div>
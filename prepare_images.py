@@ -1,57 +1,194 @@
 import os
-from PIL import Image, ImageEnhance
+import sys
+import json
+import hashlib
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image, ImageEnhance, features
 
 # Config
 INPUT_DIR = "assets"
-OUTPUT_DIR = "processed_images"
+# Docker build ชี้ไปที่ cache mount (ดู Dockerfile) -> manifest + ผลลัพธ์เดิมอยู่ข้าม build
+OUTPUT_DIR = os.getenv("PROCESSED_IMAGES_DIR", "processed_images")
 LOGO_PATH = "logo.png"
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, "manifest.json")
+VARIANTS_DIRNAME = "_variants"
+GENDERS = ['male', 'female']
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
 
-def add_watermark():
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
+# เปลี่ยนเลขนี้เมื่อแก้ logic ลายน้ำ/variant เพื่อบังคับ build ใหม่ทั้งหมด
+PIPELINE_VERSION = 2
 
+# Variants: (suffix, format, width or None = ขนาดเต็ม, save options)
+VARIANTS = [
+    ("webp", "WEBP", None, {"quality": 85, "method": 6}),
+    ("avif", "AVIF", None, {"quality": 60}),
+    ("960w.webp", "WEBP", 960, {"quality": 82, "method": 6}),
+    ("thumb.webp", "WEBP", 320, {"quality": 75, "method": 6}),
+]
+
+_logo = None
+
+def _init_worker(logo_path):
+    global _logo
+    _logo = Image.open(logo_path).convert("RGBA")
+
+@lru_cache(maxsize=32)
+def get_logo(target_width: int):
+    """Resize + fade logo ครั้งเดียวต่อความกว้างรูป (cache ต่อ process)"""
+    # Resize Logo (20% of image width)
+    w_percent = (target_width * 0.2) / float(_logo.size[0])
+    h_size = int((float(_logo.size[1]) * float(w_percent)))
+    logo_resized = _logo.resize((int(target_width * 0.2), h_size), Image.Resampling.LANCZOS)
+
+    # Set Opacity 30%
+    alpha = logo_resized.split()[3]
+    alpha = ImageEnhance.Brightness(alpha).enhance(0.3)
+    logo_resized.putalpha(alpha)
+    return logo_resized
+
+def file_hash(path: str):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def variant_path(gender: str, filename: str, suffix: str):
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(OUTPUT_DIR, gender, VARIANTS_DIRNAME, f"{stem}.{suffix}")
+
+def enabled_variants():
+    return [v for v in VARIANTS if features.check(v[1].lower())]
+
+def process_image(gender: str, filename: str, variants):
+    """Worker: ลายน้ำ + บันทึกไฟล์หลักและทุก variant"""
+    in_file = os.path.join(INPUT_DIR, gender, filename)
+    img = Image.open(in_file).convert("RGBA")
+
+    # Paste at Bottom Right
+    logo_resized = get_logo(img.width)
+    position = (img.width - logo_resized.width - 20, img.height - logo_resized.height - 20)
+    img.paste(logo_resized, position, logo_resized)
+    rgb = img.convert("RGB")
+
+    # Save (ชื่อไฟล์เดิม ให้ backend/URL เดิมใช้ต่อได้)
+    outputs = [os.path.join(OUTPUT_DIR, gender, filename)]
+    rgb.save(outputs[0], quality=95)
+
+    for suffix, fmt, width, options in variants:
+        out = rgb
+        if width and rgb.width > width:
+            out = rgb.resize((width, int(rgb.height * width / rgb.width)), Image.Resampling.LANCZOS)
+        path = variant_path(gender, filename, suffix)
+        out.save(path, fmt, **options)
+        outputs.append(path)
+    return outputs
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    tmp = MANIFEST_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, MANIFEST_PATH)
+
+def is_up_to_date(record, st, src_hash, config_key):
+    if not record or record.get("config") != config_key:
+        return False
+    if not all(os.path.exists(p) for p in record.get("outputs", [])):
+        return False
+    if record.get("mtime") == st.st_mtime and record.get("size") == st.st_size:
+        return True
+    return src_hash is not None and record.get("sha1") == src_hash
+
+def add_watermark(force: bool = False, workers: int = None):
     # Load Logo
     if not os.path.exists(LOGO_PATH):
         print("Error: logo.png not found!")
         return
-    
-    logo = Image.open(LOGO_PATH).convert("RGBA")
-    
-    # Process each gender folder
-    for gender in ['male', 'female']:
+
+    variants = enabled_variants()
+    skipped_formats = sorted({v[1] for v in VARIANTS} - {v[1] for v in variants})
+    if skipped_formats:
+        print(f"Warning: Pillow has no support for {', '.join(skipped_formats)} -> skipped")
+
+    # Output config ทั้งหมดรวมเป็น key เดียว: logo/variant เปลี่ยน = build ใหม่
+    config_key = f"v{PIPELINE_VERSION}:{file_hash(LOGO_PATH)}:{','.join(v[0] for v in variants)}"
+    manifest = {} if force else load_manifest()
+    new_manifest = {}
+    jobs = []
+
+    for gender in GENDERS:
         in_path = os.path.join(INPUT_DIR, gender)
-        out_path = os.path.join(OUTPUT_DIR, gender)
-        
-        if not os.path.exists(out_path):
-            os.makedirs(out_path)
-            
+        os.makedirs(os.path.join(OUTPUT_DIR, gender, VARIANTS_DIRNAME), exist_ok=True)
         if not os.path.exists(in_path):
             continue
 
-        for filename in os.listdir(in_path):
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                print(f"Processing: {gender}/{filename}")
-                
-                # Open Image
-                img = Image.open(os.path.join(in_path, filename)).convert("RGBA")
-                
-                # Resize Logo (20% of image width)
-                w_percent = (img.width * 0.2) / float(logo.size[0])
-                h_size = int((float(logo.size[1]) * float(w_percent)))
-                logo_resized = logo.resize((int(img.width * 0.2), h_size), Image.Resampling.LANCZOS)
-                
-                # Set Opacity 30%
-                alpha = logo_resized.split()[3]
-                alpha = ImageEnhance.Brightness(alpha).enhance(0.3)
-                logo_resized.putalpha(alpha)
-                
-                # Paste at Bottom Right
-                position = (img.width - logo_resized.width - 20, img.height - logo_resized.height - 20)
-                img.paste(logo_resized, position, logo_resized)
-                
-                # Save
-                img.convert("RGB").save(os.path.join(out_path, filename), quality=95)
+        for filename in sorted(os.listdir(in_path)):
+            if not filename.lower().endswith(IMAGE_EXTS):
+                continue
+            key = f"{gender}/{filename}"
+            st = os.stat(os.path.join(in_path, filename))
+            record = manifest.get(key)
+            src_hash = None
+            if record and not (record.get("mtime") == st.st_mtime and record.get("size") == st.st_size):
+                src_hash = file_hash(os.path.join(in_path, filename))
+
+            if is_up_to_date(record, st, src_hash, config_key):
+                new_manifest[key] = {**record, "mtime": st.st_mtime, "size": st.st_size}
+                continue
+            jobs.append((gender, filename, st, src_hash))
+
+    print(f"Images: {len(jobs)} to process, {len(new_manifest)} unchanged")
+
+    failed = []
+    try:
+        if jobs:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(LOGO_PATH,)) as pool:
+                futures = {pool.submit(process_image, gender, filename, variants): (gender, filename, st, src_hash)
+                           for gender, filename, st, src_hash in jobs}
+                for future in as_completed(futures):
+                    gender, filename, st, src_hash = futures[future]
+                    try:
+                        outputs = future.result()
+                    except Exception as e:
+                        # รูปเสียรูปเดียวไม่ทิ้งงานของรูปอื่น; ไม่ลง manifest -> รอบหน้าทำใหม่
+                        print(f"Error: {gender}/{filename}: {e}")
+                        failed.append(f"{gender}/{filename}")
+                        continue
+                    print(f"Processed: {gender}/{filename} ({len(outputs)} files)")
+                    new_manifest[f"{gender}/{filename}"] = {
+                        "sha1": src_hash or file_hash(os.path.join(INPUT_DIR, gender, filename)),
+                        "mtime": st.st_mtime,
+                        "size": st.st_size,
+                        "config": config_key,
+                        "outputs": outputs,
+                    }
+    finally:
+        # บันทึกเสมอ (รวม error/Ctrl+C กลางทาง) -> รูปที่เสร็จแล้วไม่ต้องทำซ้ำ
+        save_manifest(new_manifest)
+    prune_outputs(new_manifest)
+    return failed
+
+def prune_outputs(manifest):
+    """ลบไฟล์ผลลัพธ์ที่ไม่มีใน manifest แล้ว (ต้นฉบับถูกลบ/เปลี่ยนชื่อ) ไม่ให้ค้างใน cache แล้วกลายเป็นรางวัล"""
+    keep = {os.path.normpath(p) for record in manifest.values() for p in record.get("outputs", [])}
+    for gender in GENDERS:
+        for root, _, files in os.walk(os.path.join(OUTPUT_DIR, gender)):
+            for name in files:
+                path = os.path.normpath(os.path.join(root, name))
+                if path not in keep:
+                    os.remove(path)
 
 if __name__ == "__main__":
-    add_watermark()
-    print("All Done! Images ready in /processed_images")
\ No newline at end of file
+    failed = add_watermark(force="--force" in sys.argv)
+    if failed:
+        print(f"Failed: {len(failed)} images ({', '.join(failed)})")
+        sys.exit(1)
+    print(f"All Done! Images ready in {OUTPUT_DIR}")